@@ -1,7 +1,21 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import date, datetime, timedelta
+import hashlib
+import io
 import json
+import os
+import time
+import atexit
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from PIL import Image, ImageOps
+
+from columnar_log import REPORT_WINDOWS, ColumnarLog, daily_totals
 
 # Plotly 임포트 (Streamlit 호환)
 try:
@@ -14,58 +28,448 @@ except:
 # 페이지 설정
 st.set_page_config(page_title="나의 건강 관리", layout="wide", page_icon="🏥")
 
-# 세션 상태 초기화
-if 'weight_data' not in st.session_state:
-    st.session_state.weight_data = []
-if 'meal_data' not in st.session_state:
-    st.session_state.meal_data = []
-if 'exercise_data' not in st.session_state:
-    st.session_state.exercise_data = []
-
-# 당뇨 관리 친화적인 음식 목록 (100개)
-FOOD_DATABASE = {
-    # 채소류 (20개)
-    "시금치나물(70g)": 20, "브로콜리(100g)": 35, "양배추(100g)": 25, "오이(100g)": 15,
-    "토마토(100g)": 18, "당근(100g)": 41, "파프리카(100g)": 26, "양상추(100g)": 15,
-    "배추(100g)": 13, "무(100g)": 18, "가지(100g)": 25, "호박(100g)": 20,
-    "콩나물(100g)": 30, "숙주나물(100g)": 28, "미역(20g)": 10, "김(10g)": 20,
-    "청경채(100g)": 13, "근대(100g)": 19, "깻잎(20g)": 10, "상추(50g)": 8,
-    
-    # 단백질류 (20개)
-    "닭가슴살(100g)": 165, "계란1개": 78, "두부(80g)": 60, "연어(100g)": 206,
-    "고등어구이(100g)": 205, "참치캔(80g)": 110, "새우(100g)": 99, "오징어(100g)": 92,
-    "명태(100g)": 83, "삶은달걀(1개)": 78, "계란흰자(1개)": 17, "닭안심(100g)": 114,
-    "소고기(살코기100g)": 201, "돼지고기(살코기100g)": 143, "흰살생선(100g)": 82,
-    "콩(30g)": 120, "병아리콩(50g)": 82, "렌틸콩(50g)": 58, "검은콩(30g)": 114,
-    "아몬드(15g)": 87,
-    
-    # 곡류 (20개)
-    "현미밥(210g, 1공기)": 310, "귀리(40g)": 152, "퀴노아(50g)": 185, "보리(40g)": 143,
-    "통밀빵(1조각, 40g)": 92, "고구마(중1개, 130g)": 130, "감자(중1개, 150g)": 115,
-    "단호박(100g)": 47, "옥수수(1개, 150g)": 132, "흑미밥(210g)": 315,
-    "잡곡밥(210g)": 320, "메밀국수(100g)": 343, "현미죽(1그릇)": 180,
-    "통밀파스타(100g)": 348, "우엉(100g)": 58, "연근(100g)": 66,
-    "밤(5개)": 170, "은행(20알)": 90, "토란(100g)": 58, "무말랭이(30g)": 85,
-    
-    # 과일류 (15개)
-    "사과(중1개, 200g)": 104, "배(중1개, 250g)": 103, "귤(1개, 100g)": 45,
-    "딸기(100g)": 32, "블루베리(100g)": 57, "키위(1개, 100g)": 61,
-    "자몽(1/2개, 150g)": 52, "오렌지(1개, 150g)": 62, "수박(200g)": 60,
-    "참외(1/2개, 200g)": 62, "복숭아(중1개, 150g)": 59, "체리(100g)": 63,
-    "멜론(200g)": 68, "자두(1개, 80g)": 38, "포도(100g)": 69,
-    
-    # 유제품 및 기타 (15개)
-    "무가당요거트(150ml)": 90, "저지방우유(200ml)": 90, "두유(200ml)": 95,
-    "그릭요거트(100g)": 59, "코티지치즈(50g)": 52, "모짜렐라치즈(30g)": 85,
-    "아몬드우유(200ml)": 39, "케피어(150ml)": 80, "리코타치즈(50g)": 87,
-    "페타치즈(30g)": 75, "저지방치즈(20g)": 50, "플레인요거트(100g)": 61,
-    "카망베르치즈(30g)": 85, "염소치즈(30g)": 76, "무가당두유(200ml)": 81,
-    
-    # 견과류 및 씨앗 (10개)
-    "호두(10g)": 65, "땅콩(15g)": 87, "캐슈넛(15g)": 82, "피스타치오(15g)": 85,
-    "해바라기씨(15g)": 88, "호박씨(15g)": 84, "치아시드(10g)": 49,
-    "아마씨(10g)": 55, "참깨(10g)": 57, "잣(10g)": 67
-}
+# 기록 저장소 (SQLite) - 브라우저를 새로고침해도 기록이 유지되고, 화면에 필요한 행만 읽어옴
+# 사용자마다 DB 파일(샤드)을 따로 써서 다른 사람의 기록을 보거나 지울 수 없음 (PrediCare 앱과 같은 방식)
+DB_PATH = "data/health_log.db"  # 기본 사용자 샤드 (사용자 구분 이전의 단일 DB를 그대로 사용)
+REGISTRY_PATH = "data/health_log_users.db"  # 사용자 이름 → 샤드 파일 목록
+SHARD_DIR = "data/health_log_users"
+DEFAULT_USER = "기본 사용자"
+DB_POOL_SIZE = 8
+PREVIEW_PX = 640  # 업로드 사진 미리보기의 긴 변 픽셀 (원본 대신 이 크기로 줄인 JPEG만 브라우저로 전송)
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+class ConnectionPool:
+    """스레드 인식 SQLite 연결 풀 (PrediCare 앱과 같은 방식)."""
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._local = threading.local()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed:
+                conn.close()
+            else:
+                try:
+                    self._idle.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+@st.cache_resource(show_spinner=False)
+def get_pool(path: str = DB_PATH) -> ConnectionPool:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    pool = ConnectionPool(path)
+    atexit.register(pool.close)
+    return pool
+
+
+@st.cache_resource(show_spinner=False)
+def get_registry() -> ConnectionPool:
+    pool = get_pool(REGISTRY_PATH)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS users (name TEXT PRIMARY KEY, shard TEXT NOT NULL UNIQUE, created_at INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO users(name, shard, created_at) VALUES (?, ?, 0)", (DEFAULT_USER, DB_PATH))
+        conn.commit()
+    return pool
+
+
+def list_users() -> List[str]:
+    with get_registry().connection() as conn:
+        return [name for (name,) in conn.execute("SELECT name FROM users ORDER BY created_at, name")]
+
+
+def shard_for(user: str) -> str:
+    """사용자의 샤드 경로. 처음 보는 이름이면 SHARD_DIR 아래에 새 파일을 배정해 등록한다."""
+    with get_registry().connection() as conn:
+        row = conn.execute("SELECT shard FROM users WHERE name = ?", (user,)).fetchone()
+        if row is not None:
+            return row[0]
+        shard = os.path.join(SHARD_DIR, hashlib.sha1(user.encode("utf-8")).hexdigest()[:16] + ".db")
+        conn.execute("INSERT OR IGNORE INTO users(name, shard, created_at) VALUES (?, ?, ?)", (user, shard, int(time.time())))
+        conn.commit()
+        return conn.execute("SELECT shard FROM users WHERE name = ?", (user,)).fetchone()[0]
+
+
+def current_shard() -> str:
+    # 이 세션이 고른 사용자의 샤드 (고르기 전에는 기본 사용자)
+    return st.session_state.get("shard", DB_PATH)
+
+
+@st.cache_resource(show_spinner=False)
+def open_shard(path: str) -> ConnectionPool:
+    """샤드의 연결 풀 (샤드마다 하나). 프로세스에서 처음 열 때 테이블을 만든다."""
+    pool = get_pool(path)
+    with pool.connection() as conn:
+        _create_tables(conn)
+    return pool
+
+
+@contextmanager
+def get_conn(path: Optional[str] = None):
+    with open_shard(path or current_shard()).connection() as conn:
+        yield conn
+
+
+def init_db(path: Optional[str] = None):
+    open_shard(path or current_shard())
+
+
+def _create_tables(conn: sqlite3.Connection):
+    # PrediCare init_db 와 같은 구성: 기록 종류별 테이블 + 날짜 열(d) 인덱스
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS weights (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            d TEXT,
+            weight_kg REAL
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS meals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            d TEXT,
+            slot TEXT,
+            food TEXT,
+            calories INTEGER,
+            portion INTEGER
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS exercises (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            d TEXT,
+            exercise TEXT,
+            calories INTEGER
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_weights_d ON weights(d)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meals_d ON meals(d)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_exercises_d ON exercises(d)")
+    conn.commit()
+
+
+@st.cache_resource(show_spinner=False)
+def _table_versions(shard: str) -> Dict[str, int]:
+    return {}
+
+
+def get_table_versions(shard: Optional[str] = None) -> Dict[str, int]:
+    # 샤드(사용자)별로 같은 샤드를 보는 세션들이 공유하는 테이블 버전. 쓰기 때마다 올려 해당 테이블 조회 캐시만 무효화
+    return _table_versions(shard or current_shard())
+
+
+def refresh_cache(table: str, record: Optional[Dict] = None):
+    versions = get_table_versions()
+    old_version = versions.get(table, 0)
+    versions[table] = old_version + 1
+    if record is not None:
+        get_log_store().add(table, old_version, old_version + 1, record)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _load_records(shard: str, table: str, start: Optional[str], end: Optional[str], limit: Optional[int], newest_first: bool, version: int) -> pd.DataFrame:
+    where, params = [], []
+    if start is not None:
+        where.append("d >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("d <= ?")
+        params.append(end)
+    q = f"SELECT * FROM {table}"
+    if where:
+        q += " WHERE " + " AND ".join(where)
+    q += " ORDER BY d DESC, id DESC" if newest_first else " ORDER BY d, id"
+    if limit is not None:
+        q += f" LIMIT {int(limit)}"
+    with get_conn(shard) as conn:
+        return pd.read_sql_query(q, conn, params=params)
+
+
+def load_records(table: str, start: Optional[str] = None, end: Optional[str] = None, limit: Optional[int] = None, newest_first: bool = False) -> pd.DataFrame:
+    """기간(YYYY-MM-DD, 양끝 포함)/개수 조건에 맞는 행만 조회."""
+    return _load_records(current_shard(), table, start, end, limit, newest_first, get_table_versions().get(table, 0))
+
+
+# 식단/운동 기록의 열 단위(columnar) 메모리 사본 (columnar_log.ColumnarLog) - 오늘/최근 N일 필터를 이진 탐색 + 벡터 합계로 처리
+LOG_TEXT_COLUMNS = {"meals": ("slot", "food"), "exercises": ("exercise",)}
+
+
+class LogStore:
+    """샤드 하나의 테이블별 ColumnarLog 를 테이블 버전과 함께 보관 (같은 샤드를 보는 세션끼리 공유)."""
+
+    def __init__(self, shard: str):
+        self.shard = shard
+        self._lock = threading.Lock()
+        self._logs: Dict[str, Tuple[int, ColumnarLog]] = {}
+
+    def get(self, table: str, version: int) -> ColumnarLog:
+        with self._lock:
+            entry = self._logs.get(table)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+            text_columns = LOG_TEXT_COLUMNS[table]
+            cols = ", ".join(("id", "d", "calories") + text_columns)
+            with get_conn(self.shard) as conn:
+                df = pd.read_sql_query(f"SELECT {cols} FROM {table} ORDER BY d, id", conn)
+            log = ColumnarLog.from_frame(df, text_columns)
+            self._logs[table] = (version, log)
+            return log
+
+    def add(self, table: str, old_version: int, new_version: int, record: Dict):
+        # 캐시가 최신일 때만 행을 끼워 넣고, 아니면 다음 get 에서 다시 읽도록 둠
+        with self._lock:
+            entry = self._logs.get(table)
+            if entry is not None and entry[0] == old_version:
+                self._logs[table] = (new_version, entry[1].inserted(record))
+
+
+@st.cache_resource(show_spinner=False)
+def _log_store(shard: str) -> LogStore:
+    return LogStore(shard)
+
+
+def get_log_store(shard: Optional[str] = None) -> LogStore:
+    return _log_store(shard or current_shard())
+
+
+def get_log(table: str, shard: Optional[str] = None) -> ColumnarLog:
+    return get_log_store(shard).get(table, get_table_versions(shard).get(table, 0))
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _report_totals(shard: str, start: date, days: int, meals_version: int, exercises_version: int) -> Tuple[np.ndarray, np.ndarray]:
+    return daily_totals(get_log("meals", shard), start, days), daily_totals(get_log("exercises", shard), start, days)
+
+
+def report_totals(start: date, days: int) -> Tuple[np.ndarray, np.ndarray]:
+    """기간 리포트의 (일별 섭취, 일별 소모). 기록이 바뀌지 않았으면 통계 화면으로 돌아올 때 다시 집계하지 않음."""
+    versions = get_table_versions()
+    return _report_totals(current_shard(), start, days, versions.get("meals", 0), versions.get("exercises", 0))
+
+
+# 차트 캐시 - 샤드·테이블 버전(+기간)이 같으면 만들어 둔 Figure 를 그대로 사용 (같은 샤드의 세션끼리 공유, 읽기 전용)
+# st.plotly_chart 는 Figure 를 받으면 검증 없이 to_dict 만 하므로 trace 구성/검증 비용이 다시 들지 않음
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _weight_figure(shard: str, version: int) -> Optional[go.Figure]:
+    df_weight = _load_records(shard, "weights", None, None, None, False, version)
+    if df_weight.empty:
+        return None
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=pd.to_datetime(df_weight['d']),
+        y=df_weight['weight_kg'],
+        mode='lines+markers',
+        name='체중',
+        line=dict(color='#FF6B6B', width=3),
+        marker=dict(size=8)
+    ))
+    fig.update_layout(
+        xaxis_title="날짜",
+        yaxis_title="체중 (kg)",
+        hovermode='x unified',
+        height=400
+    )
+    return fig
+
+
+def weight_figure() -> Optional[go.Figure]:
+    """대시보드 체중 추이 그래프 (기록이 없으면 None)."""
+    return _weight_figure(current_shard(), get_table_versions().get("weights", 0))
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def _calorie_figure(shard: str, start: date, days: int, meals_version: int, exercises_version: int) -> go.Figure:
+    intake, burn = _report_totals(shard, start, days, meals_version, exercises_version)
+    dates = np.arange(start, start + timedelta(days=days), dtype="datetime64[D]")
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=dates,
+        y=intake,
+        name='섭취 칼로리',
+        marker_color='#FF6B6B'
+    ))
+    fig.add_trace(go.Bar(
+        x=dates,
+        y=burn,
+        name='소모 칼로리',
+        marker_color='#4ECDC4'
+    ))
+    fig.update_layout(
+        barmode='group',
+        xaxis_title="날짜",
+        yaxis_title="칼로리 (kcal)",
+        height=400
+    )
+    return fig
+
+
+def calorie_figure(start: date, days: int) -> go.Figure:
+    """기간 리포트의 일별 섭취/소모 막대 그래프."""
+    versions = get_table_versions()
+    return _calorie_figure(current_shard(), start, days, versions.get("meals", 0), versions.get("exercises", 0))
+
+
+def insert_weight(d: str, weight_kg: float):
+    with get_conn() as conn:
+        conn.execute("INSERT INTO weights(d, weight_kg) VALUES (?,?)", (d, weight_kg))
+        conn.commit()
+    refresh_cache("weights")
+
+
+def insert_meal(d: str, slot: str, food: str, calories: int, portion: int):
+    with get_conn() as conn:
+        cur = conn.execute(
+            "INSERT INTO meals(d, slot, food, calories, portion) VALUES (?,?,?,?,?)",
+            (d, slot, food, calories, portion),
+        )
+        conn.commit()
+    refresh_cache("meals", {"id": cur.lastrowid, "d": d, "calories": calories, "slot": slot, "food": food})
+
+
+def insert_exercise(d: str, exercise: str, calories: int):
+    with get_conn() as conn:
+        cur = conn.execute("INSERT INTO exercises(d, exercise, calories) VALUES (?,?,?)", (d, exercise, calories))
+        conn.commit()
+    refresh_cache("exercises", {"id": cur.lastrowid, "d": d, "calories": calories, "exercise": exercise})
+
+
+def delete_record(table: str, record_id: int):
+    with get_conn() as conn:
+        conn.execute(f"DELETE FROM {table} WHERE id = ?", (int(record_id),))
+        conn.commit()
+    refresh_cache(table)
+
+
+init_db()
+
+# 당뇨 관리 친화적인 음식 목록 (100개) - nutrition/foods.csv 에서 관리 (칼로리·탄수화물·단백질·지방·식이섬유·GI·제공량)
+# 처음 실행할 때(또는 CSV가 바뀌었을 때) data/nutrition/ 아래 .npy 로 컴파일하고, 이후에는 메모리 매핑으로 읽음
+CATALOG_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nutrition", "foods.csv")
+CATALOG_DIR = "data/nutrition"
+NUTRIENT_COLUMNS = ("kcal", "carb_g", "protein_g", "fat_g", "fiber_g", "gi", "serving_g")
+CATALOG_TEXT_COLUMNS = ("name", "category", "serving")
+
+
+def compile_catalog(csv_path: str, out_dir: str = CATALOG_DIR) -> Tuple[str, str]:
+    """CSV 카탈로그를 숫자 행렬(float32)과 텍스트 배열 두 개의 .npy 로 변환. CSV보다 새 파일이 있으면 재사용."""
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    values_path = os.path.join(out_dir, f"{stem}.values.npy")
+    text_path = os.path.join(out_dir, f"{stem}.text.npy")
+    src_mtime = os.path.getmtime(csv_path)
+    if all(os.path.exists(p) and os.path.getmtime(p) >= src_mtime for p in (values_path, text_path)):
+        return values_path, text_path
+
+    os.makedirs(out_dir, exist_ok=True)
+    df = pd.read_csv(csv_path, dtype={c: str for c in CATALOG_TEXT_COLUMNS})
+    arrays = {
+        values_path: df[list(NUTRIENT_COLUMNS)].to_numpy(dtype=np.float32),  # GI 미상은 NaN
+        text_path: df[list(CATALOG_TEXT_COLUMNS)].fillna("").to_numpy(dtype=str),
+    }
+    for path, arr in arrays.items():
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, path)  # 읽는 쪽이 반쯤 쓴 파일을 보지 않도록 교체
+    return values_path, text_path
+
+
+class NutritionCatalog:
+    """메모리 매핑된 영양 카탈로그.
+
+    values[i] 는 음식 i 의 NUTRIENT_COLUMNS 값(1회 제공량 기준), text[i] 는 (이름, 분류, 제공 단위).
+    숫자는 파이썬 객체로 풀지 않고 NumPy 배열 그대로 쓰며, 이름 → 번호 사전만 메모리에 둔다.
+    """
+
+    def __init__(self, values: np.ndarray, text: np.ndarray):
+        self.values = values
+        self.text = text
+        self.names: List[str] = text[:, 0].tolist()
+        self.ids: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def load(cls, csv_path: str, out_dir: str = CATALOG_DIR) -> "NutritionCatalog":
+        values_path, text_path = compile_catalog(csv_path, out_dir)
+        return cls(np.load(values_path, mmap_mode="r"), np.load(text_path, mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.ids
+
+    def column(self, nutrient: str) -> np.ndarray:
+        return self.values[:, NUTRIENT_COLUMNS.index(nutrient)]
+
+    def nutrient(self, name: str, nutrient: str, default: float = 0.0) -> float:
+        i = self.ids.get(name)
+        if i is None:
+            return default
+        return float(self.values[i, NUTRIENT_COLUMNS.index(nutrient)])
+
+    def names_in(self, category: str) -> List[str]:
+        return [self.names[i] for i in np.flatnonzero(self.text[:, 1] == category)]
+
+    def frame(self) -> pd.DataFrame:
+        df = pd.DataFrame(np.asarray(self.values), columns=list(NUTRIENT_COLUMNS))
+        for j, col in reversed(list(enumerate(CATALOG_TEXT_COLUMNS))):
+            df.insert(0, col, self.text[:, j])
+        return df
+
+
+@st.cache_resource(show_spinner=False)
+def get_catalog(csv_path: str = CATALOG_CSV) -> NutritionCatalog:
+    return NutritionCatalog.load(csv_path)
+
+
+def food_kcal(name: str) -> int:
+    return int(round(get_catalog().nutrient(name, "kcal")))
+
 
 # 무릎 친화적 운동 목록
 EXERCISE_DATABASE = {
@@ -83,12 +487,152 @@ EXERCISE_DATABASE = {
     "의자 운동 (20분)": 80
 }
 
+# 음식 검색 인덱스 - 음식 수가 수만 개로 늘어도 검색어 길이에 비례하는 후보만 확인
+CHOSEONG = "ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ"
+
+
+def normalize_name(text: str) -> str:
+    return "".join(text.split()).lower()
+
+
+def to_choseong(text: str) -> str:
+    # 한글 음절은 초성으로 바꾸고 나머지 글자는 그대로 둠 (예: "닭가슴살" → "ㄷㄱㅅㅅ")
+    out = []
+    for ch in text:
+        code = ord(ch) - 0xAC00
+        out.append(CHOSEONG[code // 588] if 0 <= code < 11172 else ch)
+    return "".join(out)
+
+
+class FoodSearchIndex:
+    """음식명 n-gram 역색인 (일반 검색 + 초성 검색).
+
+    이름(공백 제거·소문자)과 그 초성 문자열 각각에 대해 1~2글자 n-gram → 음식 번호 목록을 만든다.
+    검색어의 n-gram 목록 중 가장 짧은 것부터 교집합을 구해 후보를 줄인 뒤, 후보만 부분 문자열로 확인하고
+    완전 일치 > 접두 일치 > 부분 일치, 일치 위치, 이름 길이 순으로 정렬한다.
+    """
+
+    def __init__(self, names: List[str]):
+        self.names = names
+        self.keys = [normalize_name(n) for n in names]
+        self.choseong_keys = [to_choseong(k) for k in self.keys]
+        self.grams = self._build(self.keys)
+        self.choseong_grams = self._build(self.choseong_keys)
+
+    @staticmethod
+    def _grams(text: str) -> set:
+        return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+    @classmethod
+    def _build(cls, keys: List[str]) -> Dict[str, List[int]]:
+        index: Dict[str, List[int]] = {}
+        for i, key in enumerate(keys):
+            for gram in cls._grams(key):
+                index.setdefault(gram, []).append(i)
+        return index
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        q = normalize_name(query)
+        if not q:
+            return []
+        # 검색어가 초성으로만 이루어졌으면 초성 문자열에서 찾음
+        if all(ch in CHOSEONG for ch in q):
+            keys, index = self.choseong_keys, self.choseong_grams
+        else:
+            keys, index = self.keys, self.grams
+        grams = [q[i:i + 2] for i in range(len(q) - 1)] or [q]
+        postings = sorted((index.get(g, []) for g in set(grams)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+        ranked = []
+        for i in candidates:
+            pos = keys[i].find(q)
+            if pos < 0:
+                continue
+            kind = 0 if keys[i] == q else (1 if pos == 0 else 2)
+            ranked.append((kind, pos, len(keys[i]), self.names[i]))
+        ranked.sort()
+        names = [r[3] for r in ranked]
+        return names[:limit] if limit else names
+
+
+@st.cache_resource(show_spinner=False)
+def get_food_index() -> FoodSearchIndex:
+    return FoodSearchIndex(get_catalog().names)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def food_table(search: str, sort_by: str, categories: Tuple[str, ...]) -> pd.DataFrame:
+    """음식 목록 화면의 표 (검색/정렬/분류 조건별로 한 번만 구성)."""
+    # 음식 목록을 데이터프레임으로 (메모리 매핑된 카탈로그에서 바로 구성)
+    food_df = get_catalog().frame().drop(columns=["serving_g"]).rename(columns={
+        "name": "음식명", "category": "카테고리", "serving": "1회 제공량", "kcal": "칼로리(kcal)",
+        "carb_g": "탄수화물(g)", "protein_g": "단백질(g)", "fat_g": "지방(g)", "fiber_g": "식이섬유(g)", "gi": "GI",
+    })
+    if search:
+        food_df = food_df[food_df['음식명'].isin(get_food_index().search(search))]
+    if sort_by == "칼로리 낮은순":
+        food_df = food_df.sort_values('칼로리(kcal)')
+    elif sort_by == "칼로리 높은순":
+        food_df = food_df.sort_values('칼로리(kcal)', ascending=False)
+    else:
+        food_df = food_df.sort_values('음식명')
+    if categories:
+        food_df = food_df[food_df['카테고리'].isin(categories)]
+    return food_df
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def preview_image(file_id: str, _data: bytes, max_px: int = PREVIEW_PX) -> bytes:
+    """업로드 사진을 max_px 이하 JPEG로 축소 (업로드 id 별로 한 번만; 재실행마다 원본 전체를 해시/전송하지 않음)."""
+    with Image.open(io.BytesIO(_data)) as im:
+        im.draft("RGB", (max_px, max_px))  # JPEG 는 디코딩 단계에서 미리 축소
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        im.thumbnail((max_px, max_px))
+        buf = io.BytesIO()
+        im.save(buf, "JPEG", quality=80, optimize=True)
+    return buf.getvalue()
+
+# 부분 재실행: 위젯을 바꾸면 그 위젯이 있는 fragment 함수(사이드바/탭 하나)만 다시 실행
+# st.fragment(1.37+, requirements.txt 의 고정 버전) / st.experimental_fragment(1.33+). 더 낮은 버전에서는 그냥 호출되어 전체 재실행
+_st_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+fragment = _st_fragment or (lambda func: func)
+
+
+def share(key: str, value):
+    """다른 fragment도 쓰는 값을 세션에 공유. 부분 재실행 중 값이 바뀌면 앱 전체를 다시 실행해 함께 갱신."""
+    changed = key in st.session_state and st.session_state[key] != value
+    st.session_state[key] = value
+    if changed and _st_fragment is not None:
+        st.rerun()
+    return value
+
+
 # 메인 타이틀
 st.title("🏥 나의 건강 관리 프로그램")
 st.markdown("### 당뇨 관리를 위한 맞춤형 체중 관리 시스템")
 
 # 사이드바 - 프로필
-with st.sidebar:
+@fragment
+def render_sidebar():
+    if "user_pending" in st.session_state:  # 새로 등록한 사용자를 선택 상태로
+        st.session_state["user"] = st.session_state.pop("user_pending")
+    user = st.selectbox("사용자", list_users(), key="user", help="사용자마다 기록을 별도 DB 파일에 저장합니다. 다른 사용자의 기록은 보이지 않습니다.")
+    with st.expander("새 사용자 등록"):
+        new_user = st.text_input("이름", key="new_user").strip()
+        if st.button("등록") and new_user:
+            shard_for(new_user)
+            st.session_state["user_pending"] = new_user
+            st.rerun()
+    shard = shard_for(user)
+    if shard != current_shard():
+        # 다른 사용자의 샤드로 바꾸고 앱 전체를 다시 그림
+        st.session_state["shard"] = shard
+        st.rerun()
+
     st.header("👤 내 정보")
     st.info("""
     **연령대**: 50대  
@@ -99,53 +643,40 @@ with st.sidebar:
     
     st.markdown("---")
     st.header("📅 오늘의 목표")
-    target_cal = st.number_input("목표 칼로리 (kcal)", 1200, 2000, 1500)
-    target_exercise = st.number_input("목표 운동 시간 (분)", 20, 120, 30)
+    share("target_cal", st.number_input("목표 칼로리 (kcal)", 1200, 2000, 1500))  # 대시보드에서 사용
+    st.number_input("목표 운동 시간 (분)", 20, 120, 30)
 
-# 탭 생성
-tab1, tab2, tab3, tab4, tab5 = st.tabs(["📊 대시보드", "🍽️ 식단 기록", "🏃 운동 기록", "📈 통계", "📋 음식 목록"])
+with st.sidebar:
+    render_sidebar()
 
 # 탭1: 대시보드
-with tab1:
+@fragment
+def render_dashboard():
+    target_cal = st.session_state["target_cal"]
     col1, col2, col3 = st.columns(3)
+    today = date.today()
+    meal_log = get_log("meals")
+    exercise_log = get_log("exercises")
     
     with col1:
         st.metric("현재 체중", "0 kg", "기록 시작하기")
     
     with col2:
-        today_meals = [m for m in st.session_state.meal_data if m['date'] == datetime.now().strftime("%Y-%m-%d")]
-        today_cal = sum([m['calories'] for m in today_meals])
+        today_meals = meal_log.rows(today, today)
+        today_cal = meal_log.total(today, today)
         st.metric("오늘 섭취 칼로리", f"{today_cal} kcal", f"{today_cal - target_cal:+.0f} kcal")
     
     with col3:
-        today_exercise = [e for e in st.session_state.exercise_data if e['date'] == datetime.now().strftime("%Y-%m-%d")]
-        today_burn = sum([e['calories'] for e in today_exercise])
+        today_exercise = exercise_log.rows(today, today)
+        today_burn = exercise_log.total(today, today)
         st.metric("오늘 소모 칼로리", f"{today_burn} kcal", f"{today_burn} kcal")
     
     st.markdown("---")
     
     # 체중 추이 그래프
-    if st.session_state.weight_data:
+    fig = weight_figure()
+    if fig is not None:
         st.subheader("📉 체중 변화 추이")
-        df_weight = pd.DataFrame(st.session_state.weight_data)
-        df_weight['date'] = pd.to_datetime(df_weight['date'])
-        df_weight = df_weight.sort_values('date')
-        
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(
-            x=df_weight['date'], 
-            y=df_weight['weight'],
-            mode='lines+markers',
-            name='체중',
-            line=dict(color='#FF6B6B', width=3),
-            marker=dict(size=8)
-        ))
-        fig.update_layout(
-            xaxis_title="날짜",
-            yaxis_title="체중 (kg)",
-            hovermode='x unified',
-            height=400
-        )
         st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("체중 데이터를 입력하면 그래프가 표시됩니다.")
@@ -155,22 +686,23 @@ with tab1:
     
     with col1:
         st.subheader("🍽️ 오늘의 식단")
-        if today_meals:
-            for meal in today_meals:
-                st.write(f"**{meal['time']}** - {meal['food']} ({meal['calories']} kcal)")
+        if not today_meals.empty:
+            for meal in today_meals.itertuples():
+                st.write(f"**{meal.slot}** - {meal.food} ({meal.calories} kcal)")
         else:
             st.write("아직 기록된 식단이 없습니다.")
     
     with col2:
         st.subheader("🏃 오늘의 운동")
-        if today_exercise:
-            for exercise in today_exercise:
-                st.write(f"**{exercise['exercise']}** - {exercise['calories']} kcal 소모")
+        if not today_exercise.empty:
+            for exercise in today_exercise.itertuples():
+                st.write(f"**{exercise.exercise}** - {exercise.calories} kcal 소모")
         else:
             st.write("아직 기록된 운동이 없습니다.")
 
 # 탭2: 식단 기록
-with tab2:
+@fragment
+def render_meals():
     st.header("🍽️ 식단 기록하기")
     
     col1, col2 = st.columns([2, 1])
@@ -180,10 +712,10 @@ with tab2:
         meal_time = st.selectbox("시간대", ["아침", "점심", "저녁", "간식"])
         
         # 음식 검색
-        search_food = st.text_input("음식 검색 (이름 입력)", placeholder="예: 닭가슴살")
+        search_food = st.text_input("음식 검색 (이름 입력)", placeholder="예: 닭가슴살 또는 초성 ㄷㄱㅅㅅ")
         
         if search_food:
-            filtered_foods = {k: v for k, v in FOOD_DATABASE.items() if search_food in k}
+            filtered_foods = {k: food_kcal(k) for k in get_food_index().search(search_food)}
             if filtered_foods:
                 selected_food = st.selectbox("음식 선택", list(filtered_foods.keys()))
                 calories = filtered_foods[selected_food]
@@ -196,13 +728,7 @@ with tab2:
                 st.write(f"조절된 칼로리: **{adjusted_cal} kcal**")
                 
                 if st.button("식단에 추가", type="primary"):
-                    st.session_state.meal_data.append({
-                        'date': meal_date.strftime("%Y-%m-%d"),
-                        'time': meal_time,
-                        'food': selected_food,
-                        'calories': adjusted_cal,
-                        'portion': portion
-                    })
+                    insert_meal(meal_date.strftime("%Y-%m-%d"), meal_time, selected_food, adjusted_cal, portion)
                     st.success(f"{selected_food}이(가) 추가되었습니다!")
                     st.rerun()
             else:
@@ -213,12 +739,13 @@ with tab2:
             category = st.selectbox("카테고리 선택", 
                 ["채소류 (저칼로리)", "단백질류 (포만감)", "곡류 (에너지)", "과일류 (비타민)", "기타"])
             
+            catalog = get_catalog()
             category_map = {
-                "채소류 (저칼로리)": list(FOOD_DATABASE.keys())[:20],
-                "단백질류 (포만감)": list(FOOD_DATABASE.keys())[20:40],
-                "곡류 (에너지)": list(FOOD_DATABASE.keys())[40:60],
-                "과일류 (비타민)": list(FOOD_DATABASE.keys())[60:75],
-                "기타": list(FOOD_DATABASE.keys())[75:]
+                "채소류 (저칼로리)": catalog.names_in("채소류"),
+                "단백질류 (포만감)": catalog.names_in("단백질류"),
+                "곡류 (에너지)": catalog.names_in("곡류"),
+                "과일류 (비타민)": catalog.names_in("과일류"),
+                "기타": catalog.names_in("유제품") + catalog.names_in("견과류")
             }
             
             for food in category_map[category][:10]:
@@ -226,16 +753,10 @@ with tab2:
                 with col_a:
                     st.write(food)
                 with col_b:
-                    st.write(f"{FOOD_DATABASE[food]} kcal")
+                    st.write(f"{food_kcal(food)} kcal")
                 with col_c:
                     if st.button("추가", key=f"add_{food}"):
-                        st.session_state.meal_data.append({
-                            'date': meal_date.strftime("%Y-%m-%d"),
-                            'time': meal_time,
-                            'food': food,
-                            'calories': FOOD_DATABASE[food],
-                            'portion': 100
-                        })
+                        insert_meal(meal_date.strftime("%Y-%m-%d"), meal_time, food, food_kcal(food), 100)
                         st.success("추가됨!")
                         st.rerun()
     
@@ -256,36 +777,35 @@ with tab2:
         
         uploaded_file = st.file_uploader("음식 사진 업로드", type=['jpg', 'png', 'jpeg'])
         if uploaded_file:
-            st.image(uploaded_file, caption="업로드된 사진", use_container_width=True)
+            st.image(preview_image(uploaded_file.file_id, uploaded_file.getvalue()), caption="업로드된 사진", use_container_width=True)
             st.warning("사진 분석 기능은 개발 중입니다.")
     
     # 오늘의 식단 목록
     st.markdown("---")
     st.subheader("📋 기록된 식단")
     
-    if st.session_state.meal_data:
-        df_meals = pd.DataFrame(st.session_state.meal_data)
-        df_meals = df_meals.sort_values('date', ascending=False)
-        
-        for idx, row in df_meals.head(20).iterrows():
+    df_meals = load_records("meals", limit=20, newest_first=True)
+    if not df_meals.empty:
+        for _, row in df_meals.iterrows():
             col1, col2, col3, col4, col5 = st.columns([2, 1, 2, 1, 1])
             with col1:
-                st.write(f"**{row['date']}**")
+                st.write(f"**{row['d']}**")
             with col2:
-                st.write(row['time'])
+                st.write(row['slot'])
             with col3:
                 st.write(row['food'])
             with col4:
                 st.write(f"{row['calories']} kcal")
             with col5:
-                if st.button("삭제", key=f"del_meal_{idx}"):
-                    st.session_state.meal_data = [m for i, m in enumerate(st.session_state.meal_data) if i != idx]
+                if st.button("삭제", key=f"del_meal_{row['id']}"):
+                    delete_record("meals", row['id'])
                     st.rerun()
     else:
         st.write("아직 기록된 식단이 없습니다.")
 
 # 탭3: 운동 기록
-with tab3:
+@fragment
+def render_exercise():
     st.header("🏃 운동 기록하기")
     
     st.info("⚠️ 무릎 건강을 위한 저강도 운동 위주로 구성되어 있습니다.")
@@ -305,11 +825,7 @@ with tab3:
                 st.write(f"{cal} kcal")
             with col_c:
                 if st.button("기록", key=f"ex_{exercise}"):
-                    st.session_state.exercise_data.append({
-                        'date': exercise_date.strftime("%Y-%m-%d"),
-                        'exercise': exercise,
-                        'calories': cal
-                    })
+                    insert_exercise(exercise_date.strftime("%Y-%m-%d"), exercise, cal)
                     st.success("운동이 기록되었습니다!")
                     st.rerun()
     
@@ -340,27 +856,26 @@ with tab3:
     st.markdown("---")
     st.subheader("📋 운동 기록")
     
-    if st.session_state.exercise_data:
-        df_exercise = pd.DataFrame(st.session_state.exercise_data)
-        df_exercise = df_exercise.sort_values('date', ascending=False)
-        
-        for idx, row in df_exercise.head(15).iterrows():
+    df_exercise = load_records("exercises", limit=15, newest_first=True)
+    if not df_exercise.empty:
+        for _, row in df_exercise.iterrows():
             col1, col2, col3, col4 = st.columns([2, 3, 1, 1])
             with col1:
-                st.write(f"**{row['date']}**")
+                st.write(f"**{row['d']}**")
             with col2:
                 st.write(row['exercise'])
             with col3:
                 st.write(f"{row['calories']} kcal")
             with col4:
-                if st.button("삭제", key=f"del_ex_{idx}"):
-                    st.session_state.exercise_data = [e for i, e in enumerate(st.session_state.exercise_data) if i != idx]
+                if st.button("삭제", key=f"del_ex_{row['id']}"):
+                    delete_record("exercises", row['id'])
                     st.rerun()
     else:
         st.write("아직 기록된 운동이 없습니다.")
 
 # 탭4: 통계
-with tab4:
+@fragment
+def render_stats():
     st.header("📈 건강 통계")
     
     # 체중 기록
@@ -372,18 +887,16 @@ with tab4:
         weight_value = st.number_input("체중 (kg)", 40.0, 150.0, 60.0, 0.1)
         
         if st.button("체중 기록", type="primary"):
-            st.session_state.weight_data.append({
-                'date': weight_date.strftime("%Y-%m-%d"),
-                'weight': weight_value
-            })
+            insert_weight(weight_date.strftime("%Y-%m-%d"), weight_value)
             st.success("체중이 기록되었습니다!")
             st.rerun()
     
     with col2:
-        if st.session_state.weight_data:
-            latest_weight = st.session_state.weight_data[-1]['weight']
-            if len(st.session_state.weight_data) > 1:
-                prev_weight = st.session_state.weight_data[-2]['weight']
+        recent_weights = load_records("weights", limit=2, newest_first=True)
+        if not recent_weights.empty:
+            latest_weight = recent_weights['weight_kg'].iloc[0]
+            if len(recent_weights) > 1:
+                prev_weight = recent_weights['weight_kg'].iloc[1]
                 weight_change = latest_weight - prev_weight
                 st.metric("최근 체중", f"{latest_weight} kg", f"{weight_change:+.1f} kg")
             else:
@@ -391,77 +904,39 @@ with tab4:
         else:
             st.info("체중을 기록해주세요.")
     
-    # 주간 통계
+    # 기간별 통계
     st.markdown("---")
-    st.subheader("📊 주간 리포트")
+    st.subheader("📊 기간별 리포트")
     
-    # 최근 7일 데이터
-    today = datetime.now()
-    week_ago = today - timedelta(days=7)
-    
-    week_meals = [m for m in st.session_state.meal_data 
-                  if datetime.strptime(m['date'], "%Y-%m-%d") >= week_ago]
-    week_exercise = [e for e in st.session_state.exercise_data 
-                     if datetime.strptime(e['date'], "%Y-%m-%d") >= week_ago]
+    report_options = {f"최근 {n}일": n for n in REPORT_WINDOWS}
+    report_days = report_options[st.selectbox("리포트 기간", list(report_options.keys()))]
+    today = date.today()
+    report_start = today - timedelta(days=report_days - 1)
+    intake, burn = report_totals(report_start, report_days)
     
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        total_cal = sum([m['calories'] for m in week_meals])
-        avg_cal = total_cal / 7 if total_cal > 0 else 0
-        st.metric("주간 평균 섭취", f"{avg_cal:.0f} kcal/일")
+        avg_cal = intake.sum() / report_days
+        st.metric("평균 섭취", f"{avg_cal:.0f} kcal/일")
     
     with col2:
-        total_burn = sum([e['calories'] for e in week_exercise])
-        avg_burn = total_burn / 7 if total_burn > 0 else 0
-        st.metric("주간 평균 소모", f"{avg_burn:.0f} kcal/일")
+        avg_burn = burn.sum() / report_days
+        st.metric("평균 소모", f"{avg_burn:.0f} kcal/일")
     
     with col3:
         net_cal = avg_cal - avg_burn
         st.metric("순 칼로리", f"{net_cal:.0f} kcal/일")
     
     # 일별 칼로리 그래프
-    if week_meals or week_exercise:
+    if intake.any() or burn.any():
         st.subheader("📊 일별 칼로리 비교")
-        
-        dates = [(today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(6, -1, -1)]
-        
-        intake_by_date = {date: 0 for date in dates}
-        burn_by_date = {date: 0 for date in dates}
-        
-        for meal in week_meals:
-            if meal['date'] in intake_by_date:
-                intake_by_date[meal['date']] += meal['calories']
-        
-        for exercise in week_exercise:
-            if exercise['date'] in burn_by_date:
-                burn_by_date[exercise['date']] += exercise['calories']
-        
-        fig = go.Figure()
-        fig.add_trace(go.Bar(
-            x=dates,
-            y=[intake_by_date[d] for d in dates],
-            name='섭취 칼로리',
-            marker_color='#FF6B6B'
-        ))
-        fig.add_trace(go.Bar(
-            x=dates,
-            y=[burn_by_date[d] for d in dates],
-            name='소모 칼로리',
-            marker_color='#4ECDC4'
-        ))
-        
-        fig.update_layout(
-            barmode='group',
-            xaxis_title="날짜",
-            yaxis_title="칼로리 (kcal)",
-            height=400
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(calorie_figure(report_start, report_days), use_container_width=True)
 
 # 탭5: 음식 목록
-with tab5:
-    st.header("📋 음식 데이터베이스 (100개)")
+@fragment
+def render_food_list():
+    st.header(f"📋 음식 데이터베이스 ({len(get_catalog())}개)")
     st.write("당뇨 관리에 적합한 음식 목록입니다.")
     
     # 검색 기능
@@ -470,25 +945,12 @@ with tab5:
     # 정렬 옵션
     sort_by = st.selectbox("정렬 기준", ["이름순", "칼로리 낮은순", "칼로리 높은순"])
     
-    # 음식 목록을 데이터프레임으로
-    food_df = pd.DataFrame(list(FOOD_DATABASE.items()), columns=['음식명', '칼로리(kcal)'])
-    
-    if search:
-        food_df = food_df[food_df['음식명'].str.contains(search)]
-    
-    if sort_by == "칼로리 낮은순":
-        food_df = food_df.sort_values('칼로리(kcal)')
-    elif sort_by == "칼로리 높은순":
-        food_df = food_df.sort_values('칼로리(kcal)', ascending=False)
-    else:
-        food_df = food_df.sort_values('음식명')
-    
     # 카테고리별 필터
     categories = st.multiselect("카테고리 선택", 
         ["채소류", "단백질류", "곡류", "과일류", "유제품", "견과류"],
         default=[])
     
-    st.dataframe(food_df, use_container_width=True, height=600)
+    st.dataframe(food_table(search, sort_by, tuple(categories)), use_container_width=True, height=600)
     
     st.markdown("---")
     st.info("""
@@ -500,6 +962,17 @@ with tab5:
     - 식사는 천천히, 규칙적으로 하세요
     """)
 
+# 탭 생성 - st.tabs 는 보이지 않는 탭까지 매번 모두 계산하므로, 선택한 화면 하나만 실행
+TABS = {
+    "📊 대시보드": render_dashboard,
+    "🍽️ 식단 기록": render_meals,
+    "🏃 운동 기록": render_exercise,
+    "📈 통계": render_stats,
+    "📋 음식 목록": render_food_list,
+}
+active_tab = st.radio("화면 선택", list(TABS), horizontal=True, label_visibility="collapsed", key="active_tab")
+TABS[active_tab]()
+
 # 하단 정보
 st.markdown("---")
 st.markdown("""
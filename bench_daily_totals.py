@@ -0,0 +1,56 @@
+# 기간 리포트 집계 성능 측정 (columnar_log.daily_totals vs 기존 방식: 행마다 strptime + dict 누적)
+# --------------------------------------------------------------
+# 사용법: python bench_daily_totals.py [--rows 10000 100000 1000000] [--years 5]
+# - 임의로 만든 식단 기록으로 측정하므로 실제 기록(DB)에는 영향이 없음
+# - 100만 행이면 기존 방식 쪽이 수십 초 걸리므로 앱 화면이 아니라 여기서 따로 실행
+# --------------------------------------------------------------
+
+import argparse
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from columnar_log import REPORT_WINDOWS, ColumnarLog, daily_totals
+
+
+def benchmark_daily_totals(n_rows: int, windows: List[int], years: int = 5, seed: int = 0) -> pd.DataFrame:
+    """임의 기록 n_rows 개로 daily_totals 와 기존 방식(행마다 strptime + dict 누적)의 소요 시간 비교."""
+    rng = np.random.default_rng(seed)
+    end = date.today()
+    day = np.sort(rng.integers(end.toordinal() - 365 * years, end.toordinal() + 1, n_rows)).astype(np.int32)
+    calories = rng.integers(10, 800, n_rows).astype(np.int64)
+    log = ColumnarLog(np.arange(n_rows, dtype=np.int64), day, calories, {}, {})
+    records = [{"d": date.fromordinal(int(o)).strftime("%Y-%m-%d"), "calories": int(c)} for o, c in zip(day, calories)]
+    results = []
+    for days in windows:
+        start = end - timedelta(days=days - 1)
+        t0 = time.perf_counter()
+        daily_totals(log, start, days)
+        vector_ms = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        start_dt = datetime.combine(start, datetime.min.time())
+        by_date: Dict[str, int] = {}
+        for r in records:
+            if datetime.strptime(r["d"], "%Y-%m-%d") >= start_dt:
+                by_date[r["d"]] = by_date.get(r["d"], 0) + r["calories"]
+        loop_ms = (time.perf_counter() - t0) * 1000
+        results.append({"기간(일)": days, "기록 수": n_rows, "벡터 집계(ms)": round(vector_ms, 3), "기존 루프(ms)": round(loop_ms, 1)})
+    return pd.DataFrame(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="app.py 기간 리포트 집계(daily_totals) 성능 측정")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000], help="임의 기록 수 (여러 개 가능)")
+    parser.add_argument("--years", type=int, default=5, help="기록이 퍼져 있는 기간(년)")
+    args = parser.parse_args()
+    for n_rows in args.rows:
+        print(benchmark_daily_totals(n_rows, REPORT_WINDOWS, years=args.years).to_string(index=False))
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# 식단/운동 기록의 열 단위(columnar) 메모리 사본
+# --------------------------------------------------------------
+# - 오늘/최근 N일 필터를 날짜 서수 배열의 이진 탐색으로 자르고, 합계는 잘린 배열의 벡터 합으로 계산
+# - streamlit/DB 에 의존하지 않으므로 앱(app.py)과 성능 측정 스크립트(bench_daily_totals.py) 양쪽에서 import 해서 사용
+# --------------------------------------------------------------
+
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def to_ordinals(days: pd.Series) -> np.ndarray:
+    # "YYYY-MM-DD" 문자열 열 → date.toordinal() 값 (행마다 파싱하지 않고 한 번에 변환)
+    parsed = pd.to_datetime(days, format="%Y-%m-%d").to_numpy().astype("datetime64[D]")
+    return parsed.astype(np.int64).astype(np.int32) + EPOCH_ORDINAL
+
+
+class ColumnarLog:
+    """날짜 서수(day) 기준으로 정렬된 열 배열 묶음.
+
+    day/calories/ids 는 NumPy 배열, 텍스트 열은 정수 코드 + 어휘 목록으로 보관한다.
+    기간 조회는 np.searchsorted 로 구간을 자르고, 합계는 잘린 배열의 sum 으로 계산한다.
+    행 추가 시에는 새 객체를 반환하므로 다른 세션이 읽는 중인 배열은 바뀌지 않는다.
+    """
+
+    def __init__(self, ids: np.ndarray, day: np.ndarray, calories: np.ndarray, codes: Dict[str, np.ndarray], vocab: Dict[str, List[str]]):
+        self.ids = ids
+        self.day = day
+        self.calories = calories
+        self.codes = codes
+        self.vocab = vocab
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, text_columns: Tuple[str, ...]) -> "ColumnarLog":
+        # df 는 (d, id) 순으로 정렬되어 있어야 함
+        codes, vocab = {}, {}
+        for col in text_columns:
+            col_codes, uniques = pd.factorize(df[col])
+            codes[col] = col_codes.astype(np.int32)
+            vocab[col] = list(uniques)
+        day = to_ordinals(df["d"]) if len(df) else np.empty(0, dtype=np.int32)
+        return cls(df["id"].to_numpy(np.int64), day, df["calories"].to_numpy(np.int64), codes, vocab)
+
+    def span(self, start: date, end: date) -> slice:
+        lo = np.searchsorted(self.day, start.toordinal(), side="left")
+        hi = np.searchsorted(self.day, end.toordinal(), side="right")
+        return slice(int(lo), int(hi))
+
+    def total(self, start: date, end: date) -> int:
+        return int(self.calories[self.span(start, end)].sum())
+
+    def rows(self, start: date, end: date) -> pd.DataFrame:
+        sl = self.span(start, end)
+        data = {
+            "id": self.ids[sl],
+            "d": np.datetime_as_string((self.day[sl] - EPOCH_ORDINAL).astype("datetime64[D]")),
+            "calories": self.calories[sl],
+        }
+        for col, col_codes in self.codes.items():
+            data[col] = np.asarray(self.vocab[col], dtype=object)[col_codes[sl]] if len(self.vocab[col]) else np.empty(0, dtype=object)
+        return pd.DataFrame(data)
+
+    def inserted(self, record: Dict) -> "ColumnarLog":
+        day = date.fromisoformat(record["d"]).toordinal()
+        pos = int(np.searchsorted(self.day, day, side="right"))
+        codes, vocab = {}, {}
+        for col, col_codes in self.codes.items():
+            words = self.vocab[col]
+            if record[col] in words:
+                code = words.index(record[col])
+            else:
+                words = words + [record[col]]
+                code = len(words) - 1
+            codes[col] = np.insert(col_codes, pos, code)
+            vocab[col] = words
+        return ColumnarLog(
+            np.insert(self.ids, pos, record["id"]),
+            np.insert(self.day, pos, day),
+            np.insert(self.calories, pos, record["calories"]),
+            codes,
+            vocab,
+        )
+
+
+REPORT_WINDOWS = [7, 30, 90, 365]  # 리포트 기간(일)
+
+
+def daily_totals(log: ColumnarLog, start: date, days: int) -> np.ndarray:
+    """start 부터 days 일 동안의 일별 칼로리 합계 (길이 days 배열).
+
+    기간은 이진 탐색으로 자르고, 일별 합계는 (날짜 서수 - 시작 서수)를 bin 으로 한 np.bincount 한 번으로 구한다.
+    """
+    sl = log.span(start, start + timedelta(days=days - 1))
+    bins = log.day[sl] - start.toordinal()
+    return np.bincount(bins, weights=log.calories[sl], minlength=days)[:days]
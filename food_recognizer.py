@@ -0,0 +1,177 @@
+# 음식 사진 로컬 인식기 (오프라인 · CPU 전용)
+# --------------------------------------------------------------
+# - 외부 API 없이, 사용자가 음식 항목을 적어 저장해 둔 식단 사진 중 비슷한 것을 찾아 그 항목을 제안
+# - 사진 특징: 차이 해시(dHash, 64비트) + 색 분포(RGB 4x4x4 히스토그램, 64차원)
+#   · dHash 해밍 거리가 작으면 같은 사진(재업로드·재압축)으로 보고 가장 먼저 제안
+#     (무늬가 거의 없는 사진은 해시가 비슷비슷하므로 색 분포도 비슷할 때만)
+#   · 나머지는 색 분포 유사도(바타차리야 계수, 0~1)로 비교
+# - streamlit 에 의존하지 않으므로 앱 스크립트와 별도 프로세스(작업자) 양쪽에서 import 해서 사용
+# - RecognitionQueue: 특징 계산을 spawn 작업자 프로세스에 맡기는 작업 큐 (작업자는 이 모듈만 import, 앱 스크립트는 실행하지 않음)
+# --------------------------------------------------------------
+
+import io
+import multiprocessing
+import sys
+import threading
+import types
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+FEATURE_PX = 64  # 색 분포를 계산할 축소 크기 (JPEG 는 이 크기 근처로 축소 디코딩)
+HIST_BINS = 4  # 채널당 구간 수
+VECTOR_DIM = HIST_BINS ** 3
+DUPLICATE_BITS = 6  # dHash 해밍 거리가 이 이하이면 사실상 같은 사진
+DHASH_MIN_BITS = 20  # 켜진 비트가 이보다 적거나 64-이 값보다 많은 dHash 는 무늬가 없는 사진 (해시만으로 같은 사진이라 보지 않음)
+TOP_K = 5  # 투표에 쓰는 최근접 사진 수
+MIN_SIMILARITY = 0.80  # 이보다 덜 비슷한 사진은 제안 근거로 쓰지 않음
+MAX_SUGGESTIONS = 5
+RECOGNITION_WORKERS = 2  # 특징 계산 작업자 프로세스 수
+RECOGNITION_KEEP = 256  # 끝난 작업 결과를 보관할 최대 개수 (넘으면 먼저 끝난 것부터 버림)
+
+
+def photo_features(source) -> Tuple[int, np.ndarray]:
+    """사진(경로·bytes·파일류 객체)의 (dHash, 색 분포 벡터). dHash 는 SQLite INTEGER 에 맞게 부호 있는 64비트."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as im:
+        im.draft("RGB", (FEATURE_PX, FEATURE_PX))  # 원본 해상도로 풀지 않음 → 큰 사진도 수 ms
+        im = ImageOps.exif_transpose(im).convert("RGB")
+    small = im.resize((FEATURE_PX, FEATURE_PX), Image.BILINEAR)
+
+    # dHash: 9x8 흑백에서 가로로 이웃한 픽셀의 밝기 증감 64개 (64px 축소본이 아니라 디코딩한 사진에서 바로 안티에일리어싱 축소)
+    gray = np.asarray(im.convert("L").resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    dhash = int(np.packbits(gray[:, 1:] > gray[:, :-1]).view(">i8")[0])
+
+    # 색 분포: 구간별 픽셀 비율의 제곱근 (단위 벡터가 되므로 내적 = 바타차리야 계수)
+    q = np.asarray(small, dtype=np.int32).reshape(-1, 3) // (256 // HIST_BINS)
+    hist = np.bincount((q[:, 0] * HIST_BINS + q[:, 1]) * HIST_BINS + q[:, 2], minlength=VECTOR_DIM)
+    vec = np.sqrt(hist / hist.sum()).astype(np.float32)
+    return dhash, vec
+
+
+class PhotoIndex:
+    """라벨 붙은 사진들의 특징을 배열로 들고 최근접 검색 (N×64 float32 행렬-벡터 곱 한 번)."""
+
+    def __init__(self, ids: Iterable[int], hashes: Iterable[int], vectors: np.ndarray):
+        self.ids = np.asarray(list(ids), dtype=np.int64)
+        self.hashes = np.asarray(list(hashes), dtype=np.int64)
+        self.vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, VECTOR_DIM)
+
+    @classmethod
+    def from_rows(cls, rows: List[Tuple[int, int, bytes]]) -> "PhotoIndex":
+        # [(id, dhash, vec BLOB)] → 색인 (BLOB 은 float32 VECTOR_DIM 개)
+        vectors = np.frombuffer(b"".join(r[2] for r in rows), dtype=np.float32)
+        return cls((r[0] for r in rows), (r[1] for r in rows), vectors)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, dhash: int, vec: np.ndarray, k: int = TOP_K, min_similarity: float = MIN_SIMILARITY) -> List[Tuple[int, float]]:
+        """
+        비슷한 순 [(id, 점수)] 최대 k개. 같은 사진(dHash 근접)은 1보다 큰 점수로 맨 앞에.
+        단, 무늬가 없는 사진(dHash 켜진 비트가 DHASH_MIN_BITS 범위 밖)은 색 분포도 min_similarity 이상일 때만 같은 사진으로 봄.
+        """
+        if not len(self):
+            return []
+        score = self.vectors @ vec.astype(np.float32)
+        bits = np.unpackbits((self.hashes ^ np.int64(dhash)).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+        ones = bin(dhash & 0xFFFF_FFFF_FFFF_FFFF).count("1")
+        textured = DHASH_MIN_BITS <= ones <= 64 - DHASH_MIN_BITS
+        dup = (bits <= DUPLICATE_BITS) & (textured | (score >= min_similarity))
+        score[dup] = 1.0 + (DUPLICATE_BITS - bits[dup]) / 64
+        k = min(k, len(score))
+        top = np.argpartition(-score, k - 1)[:k]
+        top = top[np.argsort(-score[top])]
+        return [(int(self.ids[i]), float(score[i])) for i in top if score[i] >= min_similarity]
+
+
+def vote(neighbours: List[Tuple[int, float]], labels: Dict[int, List[str]], limit: int = MAX_SUGGESTIONS) -> List[Tuple[str, float]]:
+    """이웃 사진들의 음식 라벨을 유사도 가중 투표 → [(음식명, 득표)] 상위. 최고 득표의 절반 미만은 제외."""
+    votes: Dict[str, float] = {}
+    for photo_id, score in neighbours:
+        for name in labels.get(photo_id, ()):
+            votes[name] = votes.get(name, 0.0) + score
+    if not votes:
+        return []
+    best = max(votes.values())
+    ranked = sorted(((name, v) for name, v in votes.items() if v >= best / 2), key=lambda nv: (-nv[1], nv[0]))
+    return ranked[:limit]
+
+
+@contextmanager
+def _without_main_module():
+    """
+    spawn 작업자는 부모의 sys.modules["__main__"] 을 (__file__ 경로로) 다시 실행한 뒤 작업을 받는다.
+    스트림릿은 __main__ 을 앱 스크립트 모듈로 바꿔 두므로 그대로 두면 작업자마다 앱 전체(DB 초기화·화면 코드)가 다시 실행됨.
+    작업자 프로세스는 submit 안에서만 생성되므로, 그동안만 __file__/__spec__ 이 없는 빈 __main__ 으로 바꿔 둔다.
+    """
+    main = sys.modules.get("__main__")
+    stub = sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        if sys.modules.get("__main__") is stub:  # 그사이 다른 세션의 재실행이 __main__ 을 바꿨으면 그대로 둠
+            sys.modules["__main__"] = main
+
+
+class RecognitionQueue:
+    """사진 분석 작업 큐 (프로세스 풀). 같은 key(업로드 내용 해시 / 저장된 사진 경로)는 한 번만 제출하고 결과를 보관."""
+
+    def __init__(self, workers: int = RECOGNITION_WORKERS):
+        # spawn: 스레드가 여럿 도는 스트림릿 서버 프로세스를 fork 하지 않음 (작업자 프로세스는 submit 안에서 필요할 때 생성)
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self._jobs: Dict[str, Future] = {}
+        self._finished: deque = deque()  # (key, 작업) 끝난 순서대로 — 보관 수를 넘으면 앞에서부터 버림
+        self._guard = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        with self._guard:
+            return key in self._jobs
+
+    def poll(self, key: str, source) -> Tuple[str, Any]:
+        """(상태, 결과). 상태는 "pending" / "done" / "failed". 처음 보는 key 면 source(bytes 또는 경로) 분석을 제출."""
+        with self._guard:
+            job = self._jobs.get(key)
+            submitted = job is None
+            if submitted:
+                self._trim()
+                with _without_main_module():
+                    job = self._jobs[key] = self._executor.submit(photo_features, source)
+        if submitted:  # 이미 끝난 작업이면 콜백이 바로 실행되므로 잠금 밖에서 등록
+            job.add_done_callback(lambda done, key=key: self._finished_job(key, done))
+        if not job.done():
+            return "pending", None
+        if job.exception() is not None:  # 지워졌거나 깨진 사진 (실패도 보관해 다시 제출하지 않음)
+            return "failed", None
+        return "done", job.result()
+
+    def forget(self, key: str):
+        with self._guard:
+            self._jobs.pop(key, None)
+
+    def pending(self) -> int:
+        with self._guard:
+            return sum(not job.done() for job in self._jobs.values())
+
+    def _finished_job(self, key: str, job: Future):
+        with self._guard:
+            if self._jobs.get(key) is not job:  # 끝나기 전에 forget 된 작업
+                return
+            self._finished.append((key, job))
+            if len(self._finished) > 2 * len(self._jobs) + RECOGNITION_KEEP:  # forget 으로 남은 항목 정리 (가끔 한 번)
+                self._finished = deque(item for item in self._finished if self._jobs.get(item[0]) is item[1])
+
+    def _trim(self):
+        # 보관 수를 넘을 때만 끝난 순서대로 버림 (이미 forget 된 항목은 건너뜀)
+        while len(self._jobs) >= RECOGNITION_KEEP and self._finished:
+            key, job = self._finished.popleft()
+            if self._jobs.get(key) is job:
+                del self._jobs[key]
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -5,41 +5,284 @@
 # 2) 사이드바에서 목표/프로필 설정 → "오늘 기록" 탭에서 식단(사진 업로드/수동), 걷기, 체중 입력
 # 3) "통계" 탭에서 체중/칼로리/걸음수 추이를 시각화
 # 4) "가이드" 탭에서 당뇨 전단계/갱년기 친화 식단·운동 가이드 확인
-# 5) 이미지 인식은 선택 기능(외부 API 키 설정 시 활성화). 키가 없으면 수동 입력 가능
+# 5) 이미지 인식은 선택 기능(로컬·오프라인). 음식 항목을 적어 저장한 사진과 비교해 제안, 없으면 수동 입력
 # --------------------------------------------------------------
 
 import os
 import io
+import hashlib
+import csv
 import math
-import base64
+import re
+import tempfile
+import atexit
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
 from datetime import datetime, date, timedelta
-from typing import List, Tuple, Optional
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+from typing import Any, Iterable, Iterator, List, Tuple, Optional, Dict
 
 import pandas as pd
 import numpy as np
 import streamlit as st
 import altair as alt
+from PIL import Image, ImageOps
+
+from food_recognizer import PhotoIndex, RecognitionQueue, vote
 import sqlite3
 
+# Parquet 내보내기/가져오기용 (스트림릿 설치 시 함께 설치됨). 없으면 CSV만 사용
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
 APP_NAME = "PrediCare"
-DB_PATH = "data/health.db"
+DB_PATH = "data/health.db"  # 기본 사용자 샤드 (사용자 구분 이전의 단일 DB를 그대로 사용)
+REGISTRY_PATH = "data/users.db"  # 사용자 이름 → 개인 DB(샤드) 파일 목록
+SHARD_DIR = "data/users"
+DEFAULT_USER = "기본 사용자"
 IMG_DIR = "data/meal_photos"
+PHOTO_CHUNK = 256 * 1024  # 사진 업로드를 디스크로 옮길 때 한 번에 읽는 바이트 수
+PHOTO_EXTS = {".jpg": ".jpg", ".jpeg": ".jpg", ".png": ".png"}  # 같은 내용이 확장자 표기만 달라 두 번 저장되지 않도록 정규화
+THUMB_DIR = "data/meal_thumbs"
+THUMB_SIZES = {"small": 160, "medium": 640}  # 축소본 이름 → 긴 변 픽셀
+THUMB_FAILED_KEEP = 1024  # 축소본 생성에 실패한 사진(다시 시도하지 않음)을 기억해 둘 최대 개수
+GALLERY_PAGE_SIZE = 12  # 사진 기록 한 페이지에 보여줄 식단 수 (이 수만큼의 small 축소본만 전송)
+GALLERY_COLUMNS = 4
+DATE_COLUMNS = {"meals": "day", "activities": "day", "weights": "d", "daily_summary": "d"}  # 기간 조회 기준 열 (일 번호)
+SCHEMA_VERSION = 4  # PRAGMA user_version 으로 관리하는 마이그레이션 단계
+# 일시는 정수로 저장: dt = 1970-01-01 기준 epoch 초(벽시계 시각 그대로, 시간대 변환 없음), d/day = epoch 일 번호(dt // 86400)
+EPOCH = datetime(1970, 1, 1)
+EPOCH_UNITS = {"dt": "s", "d": "D", "day": "D"}  # 정수 열 → 조회 시 datetime64 로 바꿀 단위
+ITEM_SERVING_RE = re.compile(r"^(.*\S)\s+x(\d+(?:\.\d+)?)$")  # "닭가슴살 100g x1.5" → (음식명, 인분)
+
+# 일별 요약(daily_summary) 누적 갱신: 원본 INSERT와 같은 트랜잭션에서 실행
+SUMMARY_ADD_MEAL = """
+    INSERT INTO daily_summary(d, intake_kcal, carb_g) VALUES (?, ?, ?)
+    ON CONFLICT(d) DO UPDATE SET
+        intake_kcal = intake_kcal + excluded.intake_kcal,
+        carb_g = carb_g + excluded.carb_g
+"""
+SUMMARY_ADD_ACTIVITY = """
+    INSERT INTO daily_summary(d, burn_kcal, steps) VALUES (?, ?, ?)
+    ON CONFLICT(d) DO UPDATE SET
+        burn_kcal = burn_kcal + excluded.burn_kcal,
+        steps = CASE WHEN excluded.steps IS NULL THEN steps ELSE COALESCE(steps, 0) + excluded.steps END
+"""
+SUMMARY_SET_WEIGHT = """
+    INSERT INTO daily_summary(d, weight_kg) VALUES (?, ?)
+    ON CONFLICT(d) DO UPDATE SET weight_kg = excluded.weight_kg
+"""
+DB_POOL_SIZE = 8  # 유휴 상태로 보관할 최대 연결 수
+BULK_CHUNK = 1000  # 일괄 입력 시 한 번에 executemany 로 넘기는 행 수 (메모리는 이 크기만큼만 사용)
+IMPORT_CHUNK = 5000  # ZIP 가져오기 시 CSV를 읽는 행 단위
+EXPORT_TABLES = ("meals", "activities", "weights")
+PARQUET_ROW_GROUP = 65536  # Parquet 내보내기 시 한 번에 읽어 쓰는 행 수 (= row group 크기)
+# 가져오기 대상: 테이블 → (중복 판단 자연 키, 일괄 입력 레코드 열 순서). ZIP 안의 <테이블>.parquet 또는 <테이블>.csv
+IMPORT_SPECS = {
+    "meals": (("dt", "label", "items"), ("dt", "label", "items", "calories", "carbs_g", "photo_path")),
+    "activities": (("dt", "kind", "minutes"), ("dt", "kind", "minutes", "steps", "distance_km", "pace_kmh", "calories")),
+    "weights": (("d", "weight_kg"), ("d", "weight_kg")),
+}
+
+# 연결 생성 시 1회 적용. WAL: 읽기와 쓰기가 서로를 막지 않음 / NORMAL: WAL에서 안전한 수준의 fsync
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA foreign_keys=ON",
+)
 
 # ----------------------------- 유틸 & 초기화 ----------------------------- #
 
 def ensure_dirs():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    os.makedirs(SHARD_DIR, exist_ok=True)
     os.makedirs(IMG_DIR, exist_ok=True)
+    os.makedirs(THUMB_DIR, exist_ok=True)
 
 
-def get_conn():
+class ConnectionPool:
+    """스레드 인식 SQLite 연결 풀.
+
+    스트림릿은 세션마다 별도 스레드에서 스크립트를 실행한다. 한 스레드가 빌린 연결은 반납 전까지
+    그 스레드 전용이며(중첩 호출 시 같은 연결 재사용), 반납된 연결은 최대 `size`개까지 보관했다가
+    다음 요청에 재사용한다.
+    """
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        self._local = threading.local()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    def _release(self, conn: sqlite3.Connection):
+        # 커밋되지 않은 작업이 다음 사용자에게 넘어가지 않도록 정리
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+@st.cache_resource(show_spinner=False)
+def get_pool(path: str = DB_PATH) -> ConnectionPool:
     ensure_dirs()
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    return conn
+    pool = ConnectionPool(path)
+    atexit.register(pool.close)
+    return pool
+
+
+# ----------------------------- 사용자별 샤드 ----------------------------- #
+# 사용자마다 SQLite 파일 하나(샤드)를 쓰므로 쓰기 잠금도 사용자별로 나뉜다. 어떤 사용자가 어느 파일을 쓰는지는
+# 작은 레지스트리 DB(REGISTRY_PATH)에 기록하고, 세션은 고른 사용자의 샤드 경로만 session_state 에 들고 있다.
+
+@st.cache_resource(show_spinner=False)
+def get_registry() -> ConnectionPool:
+    pool = get_pool(REGISTRY_PATH)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS users (name TEXT PRIMARY KEY, shard TEXT NOT NULL UNIQUE, created_at INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO users(name, shard, created_at) VALUES (?, ?, 0)", (DEFAULT_USER, DB_PATH))
+        conn.commit()
+    return pool
+
+
+def list_users() -> List[str]:
+    with get_registry().connection() as conn:
+        return [name for (name,) in conn.execute("SELECT name FROM users ORDER BY created_at, name")]
+
+
+def shard_for(user: str) -> str:
+    """사용자의 샤드 경로. 처음 보는 이름이면 SHARD_DIR 아래에 새 파일을 배정해 등록한다."""
+    with get_registry().connection() as conn:
+        row = conn.execute("SELECT shard FROM users WHERE name = ?", (user,)).fetchone()
+        if row is not None:
+            return row[0]
+        shard = os.path.join(SHARD_DIR, hashlib.sha1(user.encode("utf-8")).hexdigest()[:16] + ".db")
+        conn.execute("INSERT OR IGNORE INTO users(name, shard, created_at) VALUES (?, ?, ?)", (user, shard, to_epoch(datetime.now())))
+        conn.commit()
+        return conn.execute("SELECT shard FROM users WHERE name = ?", (user,)).fetchone()[0]
+
 
+def current_shard() -> str:
+    # 이 세션이 고른 사용자의 샤드 (고르기 전에는 기본 사용자)
+    return st.session_state.get("shard", DB_PATH)
 
-def init_db():
-    conn = get_conn()
+
+@st.cache_resource(show_spinner=False)
+def open_shard(path: str) -> ConnectionPool:
+    """샤드의 연결 풀 (샤드마다 하나). 프로세스에서 처음 열 때 테이블 생성/마이그레이션을 실행한다."""
+    pool = get_pool(path)
+    with pool.connection() as conn:
+        _create_tables(conn)
+        _migrate(conn)
+        _create_indexes(conn)
+    return pool
+
+
+@contextmanager
+def get_conn(path: Optional[str] = None):
+    with open_shard(path or current_shard()).connection() as conn:
+        yield conn
+
+
+def init_db(path: Optional[str] = None):
+    open_shard(path or current_shard())
+
+
+# 일시 열이 있는 테이블 DDL ({name}: 마이그레이션 시 임시 테이블 이름으로도 사용). day 는 dt 에서 계산되는 생성 열
+TIMESTAMP_TABLE_DDL = {
+    "meals": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dt INTEGER,
+            label TEXT,
+            items TEXT,
+            calories REAL,
+            carbs_g REAL,
+            photo_path TEXT,
+            day INTEGER GENERATED ALWAYS AS (dt / 86400) VIRTUAL
+        )
+    """,
+    "activities": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dt INTEGER,
+            kind TEXT,
+            minutes REAL,
+            steps INTEGER,
+            distance_km REAL,
+            pace_kmh REAL,
+            calories REAL,
+            day INTEGER GENERATED ALWAYS AS (dt / 86400) VIRTUAL
+        )
+    """,
+    "weights": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            d INTEGER,
+            weight_kg REAL
+        )
+    """,
+    "daily_summary": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            d INTEGER PRIMARY KEY,
+            intake_kcal REAL NOT NULL DEFAULT 0,
+            carb_g REAL NOT NULL DEFAULT 0,
+            burn_kcal REAL NOT NULL DEFAULT 0,
+            steps INTEGER,
+            weight_kg REAL
+        )
+    """,
+}
+
+
+def _create_tables(conn: sqlite3.Connection):
     cur = conn.cursor()
     cur.execute(
         """
@@ -56,57 +299,392 @@ def init_db():
         )
         """
     )
+    for table in ("meals", "activities", "weights"):
+        cur.execute(TIMESTAMP_TABLE_DDL[table].format(name=table))
+    # 식단 항목: meals.items 문자열을 음식 단위로 정규화 (음식별 빈도/탄수화물 공급원 집계용)
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS meals (
+        CREATE TABLE IF NOT EXISTS foods (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            dt TEXT,
-            label TEXT,
-            items TEXT,
-            calories REAL,
-            carbs_g REAL,
-            photo_path TEXT
+            name TEXT NOT NULL UNIQUE,
+            kcal REAL,
+            carb_g REAL
         )
         """
     )
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS activities (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            dt TEXT,
-            kind TEXT,
-            minutes REAL,
-            steps INTEGER,
-            distance_km REAL,
-            pace_kmh REAL,
-            calories REAL
+        CREATE TABLE IF NOT EXISTS meal_items (
+            meal_id INTEGER NOT NULL REFERENCES meals(id) ON DELETE CASCADE,
+            food_id INTEGER NOT NULL REFERENCES foods(id),
+            servings REAL NOT NULL DEFAULT 1
         )
         """
     )
+    cur.execute(TIMESTAMP_TABLE_DDL["daily_summary"].format(name="daily_summary"))
+    # 사진 인식용 식단 사진 특징 (food_recognizer.photo_features: dHash + float32 색 분포 BLOB)
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS weights (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            d TEXT,
-            weight_kg REAL
+        CREATE TABLE IF NOT EXISTS photo_features (
+            meal_id INTEGER PRIMARY KEY REFERENCES meals(id) ON DELETE CASCADE,
+            dhash INTEGER NOT NULL,
+            vec BLOB NOT NULL
+        )
+        """
+    )
+    conn.commit()
+
+
+def _create_indexes(conn: sqlite3.Connection):
+    # 마이그레이션(열 타입 변경) 이후에 생성해야 하므로 테이블 생성과 분리
+    cur = conn.cursor()
+    # 기간 조회(query_df)는 day/d, 가져오기 중복 확인은 dt/d 로 범위 검색
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meals_dt ON meals(dt)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meals_day ON meals(day)")
+    # 사진 기록 페이지 조회용 (사진이 있는 식단만 담는 부분 인덱스)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meals_photo ON meals(dt) WHERE photo_path IS NOT NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_activities_dt ON activities(dt)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_activities_day ON activities(day)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_weights_d ON weights(d)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meal_items_meal ON meal_items(meal_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meal_items_food ON meal_items(food_id)")
+    conn.commit()
+
+
+def _migrate(conn: sqlite3.Connection):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    if version < 2:
+        rebuild_meal_items(conn)
+    if version < 3:
+        _migrate_epoch_columns(conn)  # daily_summary 재계산 포함 (v1 단계 대체)
+    if version < 4:
+        conn.execute("DELETE FROM photo_features")  # v4: dHash 계산 방식 변경 → 예전 특징은 버리고 다시 색인
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+
+def _migrate_epoch_columns(conn: sqlite3.Connection):
+    # v3: ISO 문자열 일시/날짜 → 정수 epoch 초/일 번호.
+    # SQLite는 열 타입을 바꿀 수 없으므로 새 테이블에 변환해 옮긴 뒤 교체 (id 유지 → meal_items 그대로 유효)
+    copies = {
+        "meals": "SELECT id, CAST(strftime('%s', dt) AS INTEGER), label, items, calories, carbs_g, photo_path FROM meals",
+        "activities": "SELECT id, CAST(strftime('%s', dt) AS INTEGER), kind, minutes, steps, distance_km, pace_kmh, calories FROM activities",
+        "weights": "SELECT id, CAST(strftime('%s', d) AS INTEGER) / 86400, weight_kg FROM weights",
+    }
+    columns = {
+        "meals": "id, dt, label, items, calories, carbs_g, photo_path",
+        "activities": "id, dt, kind, minutes, steps, distance_km, pace_kmh, calories",
+        "weights": "id, d, weight_kg",
+    }
+    decl = {name: typ for _, name, typ, *_ in conn.execute("PRAGMA table_info(meals)")}
+    if decl.get("dt", "").upper() == "INTEGER":  # 새로 만든 DB는 이미 v3 형식
+        rebuild_daily_summary(conn)
+        return
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys=OFF")  # meals 교체 중 meal_items 가 CASCADE 로 지워지지 않도록 (트랜잭션 밖에서만 변경 가능)
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        for table, select in copies.items():
+            cur.execute(TIMESTAMP_TABLE_DDL[table].format(name=f"{table}_v3"))
+            cur.execute(f"INSERT INTO {table}_v3({columns[table]}) {select}")
+            cur.execute(f"DROP TABLE {table}")
+            cur.execute(f"ALTER TABLE {table}_v3 RENAME TO {table}")
+        cur.execute("DROP TABLE daily_summary")
+        cur.execute(TIMESTAMP_TABLE_DDL["daily_summary"].format(name="daily_summary"))
+        rebuild_daily_summary(conn)  # commit 포함
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
+
+
+def rebuild_daily_summary(conn: sqlite3.Connection):
+    # 기존 기록 전체로 일별 요약을 다시 계산 (최초 마이그레이션/복구용)
+    cur = conn.cursor()
+    cur.execute("DELETE FROM daily_summary")
+    cur.execute(
+        """
+        WITH src AS (
+            SELECT day AS d, calories AS intake_kcal, carbs_g AS carb_g, 0 AS burn_kcal, NULL AS steps FROM meals
+            UNION ALL
+            SELECT day, 0, 0, calories, steps FROM activities
+            UNION ALL
+            SELECT d, 0, 0, 0, NULL FROM weights
         )
+        INSERT INTO daily_summary(d, intake_kcal, carb_g, burn_kcal, steps, weight_kg)
+        SELECT
+            d,
+            COALESCE(SUM(intake_kcal), 0),
+            COALESCE(SUM(carb_g), 0),
+            COALESCE(SUM(burn_kcal), 0),
+            SUM(steps),
+            (SELECT w.weight_kg FROM weights w WHERE w.d = src.d ORDER BY w.id DESC LIMIT 1)
+        FROM src
+        GROUP BY d
         """
     )
     conn.commit()
 
 
-@st.cache_data(show_spinner=False)
+def parse_items(items_text: str) -> List[Tuple[str, float]]:
+    """'현미밥 1/2공기(100g) x1.5, 두부 100g' → [(음식명, 인분)]. 'xN' 표기가 없으면 1인분."""
+    pairs = []
+    for part in items_text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        m = ITEM_SERVING_RE.match(part)
+        pairs.append((m.group(1), float(m.group(2))) if m else (part, 1.0))
+    return pairs
+
+
+def _insert_meal_items(cur: sqlite3.Cursor, meals: Iterable[Tuple[int, Optional[str]]]):
+    # [(meal_id, items 문자열)] → meal_items. 호출 측 트랜잭션 안에서 실행 (commit 하지 않음)
+    rows = [(meal_id, servings, name) for meal_id, items in meals for name, servings in parse_items(items or "")]
+    if not rows:
+        return
+    cur.executemany("INSERT INTO foods(name) VALUES (?) ON CONFLICT(name) DO NOTHING", [(name,) for _, _, name in rows])
+    cur.executemany("INSERT INTO meal_items(meal_id, food_id, servings) SELECT ?, id, ? FROM foods WHERE name = ?", rows)
+
+
+def rebuild_meal_items(conn: sqlite3.Connection):
+    # 기존 meals.items 문자열을 파싱해 meal_items를 다시 채움 (마이그레이션/복구용)
+    cur = conn.cursor()
+    cur.execute("DELETE FROM meal_items")
+    _insert_meal_items(cur, conn.execute("SELECT id, items FROM meals ORDER BY id").fetchall())
+    conn.commit()
+
+
+def to_epoch(value: Any) -> int:
+    """datetime / date / ISO 문자열 → epoch 초 (정수는 그대로)."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    elif not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return (value - EPOCH) // timedelta(seconds=1)
+
+
+def to_day(value: Any) -> int:
+    """date / datetime / ISO 문자열 → epoch 일 번호 (정수는 그대로)."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return to_epoch(value) // 86400
+
+
+def with_datetimes(df: pd.DataFrame) -> pd.DataFrame:
+    # 정수 일시/일 번호 열을 datetime64 로 한 번에 변환 (행마다 파이썬 객체를 만들지 않음)
+    for col, unit in EPOCH_UNITS.items():
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], unit=unit)
+    return df
+
+
+class TableCache:
+    """테이블별 버전 캐시.
+
+    테이블마다 버전 번호와 (행 수, 최대 id) 워터마크를 함께 보관한다. 쓰기 후 버전이 오르면
+    다음 조회에서 워터마크 이후의 행만 읽어 기존 프레임 뒤에 붙이고, 행 수가 맞지 않으면
+    (수정/삭제가 있었던 경우) 그 테이블만 전체를 다시 읽는다.
+    """
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._entries: Dict[str, Tuple[int, int, int, pd.DataFrame]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _lock(self, table: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(table, threading.Lock())
+
+    def version(self, table: str) -> int:
+        return self._versions.get(table, 0)
+
+    def bump(self, table: str, reload: bool = False):
+        with self._lock(table):
+            self._versions[table] = self.version(table) + 1
+            if reload:
+                self._entries.pop(table, None)
+
+    def get(self, conn: sqlite3.Connection, table: str) -> pd.DataFrame:
+        with self._lock(table):
+            version = self.version(table)
+            entry = self._entries.get(table)
+            if entry is not None and entry[0] == version:
+                return entry[3]
+            rows, max_id = conn.execute(f"SELECT COUNT(*), COALESCE(MAX(id), 0) FROM {table}").fetchone()
+            df = None
+            if entry is not None:
+                _, old_rows, old_max_id, old_df = entry
+                delta = with_datetimes(pd.read_sql_query(f"SELECT * FROM {table} WHERE id > ? ORDER BY id", conn, params=(old_max_id,)))
+                if old_rows + len(delta) == rows:
+                    df = old_df if delta.empty else pd.concat([old_df, delta], ignore_index=True)
+            if df is None:
+                df = with_datetimes(pd.read_sql_query(f"SELECT * FROM {table}", conn))
+            self._entries[table] = (version, rows, max_id, df)
+            return df
+
+
+@st.cache_resource(show_spinner=False)
+def _table_cache(shard: str) -> TableCache:
+    return TableCache()
+
+
+def get_table_cache() -> TableCache:
+    # 버전/프레임 캐시는 샤드마다 따로 (다른 사용자의 쓰기가 내 캐시를 무효화하지 않음)
+    return _table_cache(current_shard())
+
+
 def load_df(table: str) -> pd.DataFrame:
-    conn = get_conn()
-    return pd.read_sql_query(f"SELECT * FROM {table}", conn)
+    with get_conn() as conn:
+        df = get_table_cache().get(conn, table)
+    # 얕은 복사: 호출 측에서 열을 추가/교체해도 캐시된 프레임은 그대로 유지
+    return df.copy(deep=False)
+
+
+def refresh_cache(*tables: str, reload: bool = False):
+    """쓰기 후 해당 테이블만 무효화. 추가(INSERT)는 증분 반영, reload=True면 전체 재조회."""
+    cache = get_table_cache()
+    for table in tables or ("profile", "meals", "activities", "weights", "daily_summary"):
+        cache.bump(table, reload=reload)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _query_df(shard: str, table: str, columns: Optional[Tuple[str, ...]], start: Optional[date], end: Optional[date], version: int) -> pd.DataFrame:
+    date_col = DATE_COLUMNS[table]
+    col_clause = ", ".join(columns) if columns else "*"
+    where, params = [], []
+    if start is not None:
+        where.append(f"{date_col} >= ?")
+        params.append(to_day(start))
+    if end is not None:
+        where.append(f"{date_col} <= ?")
+        params.append(to_day(end))
+    q = f"SELECT {col_clause} FROM {table}"
+    if where:
+        q += " WHERE " + " AND ".join(where)
+    q += f" ORDER BY {'dt' if date_col == 'day' else date_col}"  # 같은 날 안에서는 시각 순
+    with get_conn(shard) as conn:
+        return with_datetimes(pd.read_sql_query(q, conn, params=params))
+
+
+def query_df(table: str, columns: Optional[List[str]] = None, start: Optional[date] = None, end: Optional[date] = None) -> pd.DataFrame:
+    """기간(start~end, 양끝 포함)과 열 목록을 SQLite 쿼리로 넘겨 필요한 행만 조회.
+
+    결과는 테이블 버전을 키에 포함해 캐시하므로 해당 테이블에 쓰기가 있을 때만 다시 읽는다.
+    """
+    cols = tuple(columns) if columns else None
+    return _query_df(current_shard(), table, cols, start, end, get_table_cache().version(table))
+
+
+TOP_FOOD_ORDERS = {"count": "meals", "servings": "servings", "kcal": "kcal", "carb": "carb_g"}
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _top_foods(shard: str, start: Optional[date], order: str, limit: int, version: int) -> pd.DataFrame:
+    where, params = "", []
+    if start is not None:
+        where = "WHERE m.day >= ?"
+        params.append(to_day(start))
+    q = f"""
+        SELECT f.name AS food,
+               COUNT(DISTINCT mi.meal_id) AS meals,
+               SUM(mi.servings) AS servings,
+               SUM(mi.servings * f.kcal) AS kcal,
+               SUM(mi.servings * f.carb_g) AS carb_g
+        FROM meal_items mi
+        JOIN meals m ON m.id = mi.meal_id
+        JOIN foods f ON f.id = mi.food_id
+        {where}
+        GROUP BY f.id
+        ORDER BY {TOP_FOOD_ORDERS[order]} DESC, f.name
+        LIMIT ?
+    """
+    with get_conn(shard) as conn:
+        return pd.read_sql_query(q, conn, params=params + [limit])
+
+
+def top_foods(start: Optional[date] = None, order: str = "count", limit: int = 10) -> pd.DataFrame:
+    """기간 내 음식별 섭취 빈도·인분·칼로리·탄수화물 상위 N개 (meal_items 집계, 칼로리/탄수화물은 foods에 값이 있는 음식만)."""
+    return _top_foods(current_shard(), start, order, limit, get_table_cache().version("meals"))
 
 
-def refresh_cache():
-    load_df.clear()
+@st.cache_data(show_spinner=False, max_entries=32)
+def _photo_count(shard: str, version: int) -> int:
+    with get_conn(shard) as conn:
+        return conn.execute("SELECT COUNT(*) FROM meals WHERE photo_path IS NOT NULL").fetchone()[0]
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _photo_page(shard: str, page: int, page_size: int, version: int) -> pd.DataFrame:
+    q = """
+        SELECT id, dt, label, items, calories, photo_path FROM meals
+        WHERE photo_path IS NOT NULL
+        ORDER BY dt DESC, id DESC
+        LIMIT ? OFFSET ?
+    """
+    with get_conn(shard) as conn:
+        return with_datetimes(pd.read_sql_query(q, conn, params=(page_size, page * page_size)))
+
+
+def photo_count() -> int:
+    return _photo_count(current_shard(), get_table_cache().version("meals"))
+
+
+def photo_page(page: int, page_size: int = GALLERY_PAGE_SIZE) -> pd.DataFrame:
+    """사진이 있는 식단을 최신순으로 page_size 개씩 나눈 page 번째(0부터) 묶음. 사진 파일은 읽지 않고 경로만 반환."""
+    return _photo_page(current_shard(), page, page_size, get_table_cache().version("meals"))
 
 
 # ----------------------------- 계산 로직 ----------------------------- #
 
+@st.cache_data(show_spinner=False, max_entries=32)
+def _stats_charts(shard: str, start: Optional[date], carb_target: float, version: int) -> Optional[Dict[str, Optional[dict]]]:
+    # 일별 합계는 저장 시점에 daily_summary에 누적되어 있으므로 기간 내 행만 읽으면 됨
+    daily = _query_df(shard, "daily_summary", ("d", "intake_kcal", "carb_g", "burn_kcal", "steps", "weight_kg"), start, None, version)  # d: datetime64
+    if daily.empty:
+        return None
+    daily = daily.fillna({"intake_kcal": 0, "burn_kcal": 0, "carb_g": 0})  # 결측 0 처리 (시각화를 위한 용도)
+    x = alt.X("d:T", title="날짜")
+    # 데이터는 이름(NamedData)으로만 참조하고 DataFrame 은 datasets 로 따로 넘김 (행을 JSON 으로 풀어 명세에 넣지 않음)
+    specs: Dict[str, Optional[dict]] = {"weight": None, "steps": None}
+    if daily["weight_kg"].notna().any():
+        chart_w = alt.Chart(alt.NamedData(name="weight")).mark_line(point=True).encode(x=x, y=alt.Y("weight_kg:Q", title="체중(kg)"))
+        specs["weight"] = {**chart_w.to_dict(), "datasets": {"weight": daily.dropna(subset=["weight_kg"])[["d", "weight_kg"]]}}
+
+    melt = daily.melt(id_vars=["d"], value_vars=["intake_kcal", "burn_kcal"], var_name="type", value_name="kcal")
+    chart_c = alt.Chart(alt.NamedData(name="kcal")).mark_bar().encode(
+        x=x,
+        y=alt.Y("kcal:Q", title="kcal"),
+        color="type:N",
+        tooltip=["d:T", "type:N", "kcal:Q"],
+    )
+    specs["kcal"] = {**chart_c.to_dict(), "datasets": {"kcal": melt}}
+
+    chart_carbs = alt.Chart(alt.NamedData(name="carbs")).mark_line(point=True).encode(x=x, y=alt.Y("carb_g:Q", title="탄수화물(g)"))
+    if carb_target:
+        # 목표선
+        chart_carbs = chart_carbs + alt.Chart(alt.Data(values=[{"y": carb_target}])).mark_rule().encode(y="y:Q")
+    specs["carbs"] = {**chart_carbs.to_dict(), "datasets": {"carbs": daily[["d", "carb_g"]]}}
+
+    if daily["steps"].notna().any():
+        chart_s = alt.Chart(alt.NamedData(name="steps")).mark_bar().encode(x=x, y=alt.Y("steps:Q", title="걸음수"))
+        specs["steps"] = {**chart_s.to_dict(), "datasets": {"steps": daily[["d", "steps"]].fillna({"steps": 0})}}
+    return specs
+
+
+def stats_charts(start: Optional[date], carb_target: float = 0) -> Optional[Dict[str, Optional[dict]]]:
+    """통계 탭 차트의 Vega-Lite 명세 (데이터 없으면 None, 체중/걸음수 기록이 없으면 해당 항목 None).
+
+    daily_summary 버전·기간·목표선이 같으면 캐시에서 그대로 반환하므로, 관계없는 위젯으로 다시 실행될 때
+    Altair 차트 구성과 Vega-Lite 변환(스키마 검증 포함)을 반복하지 않는다.
+    """
+    return _stats_charts(current_shard(), start, carb_target, get_table_cache().version("daily_summary"))
+
+
 def bmr_mifflin(weight_kg: float, height_cm: float, age: int, sex: str) -> float:
     # Mifflin-St Jeor
     s = 5 if sex.lower().startswith("m") else -161
@@ -142,86 +720,504 @@ def kcal_from_met(met: float, weight_kg: float, minutes: float) -> float:
 
 
 # ----------------------------- 이미지 → 음식 인식 (선택) ----------------------------- #
-# 외부 API 키가 있을 때만 동작. 없으면 수동 입력을 안내.
+# 외부 API 없이 로컬에서: 이 사용자가 음식 항목을 적어 저장한 식단 사진들과 비교해 비슷한 사진의 음식을 제안.
+# 사진 특징(food_recognizer.photo_features)은 샤드의 photo_features 테이블에 한 번만 계산해 두고 새 사진만 증분 색인.
+# 특징 계산(사진 디코딩)은 인식 작업 큐(food_recognizer.RecognitionQueue, 별도 프로세스)에서 하고 화면은 기다리지 않음 → 결과는 다음 재실행에서 조회.
+
+RECOGNITION_CATCHUP = 32  # 저장된 사진 색인 시 한 번 조회에서 새로 제출할 최대 사진 수 (나머지는 다음 조회 때)
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-GOOGLE_VISION_KEY = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "")
 
+@st.cache_resource(show_spinner=False)
+def get_recognition_queue() -> RecognitionQueue:
+    queue = RecognitionQueue()
+    atexit.register(queue.close)
+    return queue
 
-def infer_foods_from_image(file_bytes: bytes) -> List[Tuple[str, float]]:
+
+def index_meal_photos(conn: sqlite3.Connection) -> int:
     """
-    이미지를 음식명 리스트로 추정 (샘플 구현: 키 없으면 빈 리스트 반환).
-    실제 사용시 아래 중 하나 연결:
-      1) Google Cloud Vision → label detection → 상위 라벨 중 음식 키워드 추출
-      2) OpenAI(비전) → "사진 속 음식 항목을 한국어로 나열" 프롬프트
-      3) 로컬 모델(예: Food-101) fine-tune (고급)
-    반환: [(음식명, 예상 1인분 칼로리)] — 칼로리는 다음 단계에서 영양 API로 보강 권장
+    사진이 있는데 아직 색인되지 않은 식단의 특징을 인식 작업 큐에 맡기고, 계산이 끝난 것만 저장.
+    큐에 새로 제출하는 사진은 한 번에 RECOGNITION_CATCHUP 개까지 (사진이 많이 쌓인 기록은 여러 번의 조회에 걸쳐 색인).
+    반환: 아직 색인을 기다리는 사진 수 (분석 중 + 다음 조회로 미룬 것, 실패한 사진은 제외).
     """
-    try:
-        # 키가 없으면 비활성화
-        if not OPENAI_API_KEY and not GOOGLE_VISION_KEY:
-            return []
-        # 여기에 실제 API 호출 코드 연결 (프로젝트 키 보안상 예시 생략)
-        # TODO: Vision API 연동
-        return []
-    except Exception:
+    todo = conn.execute(
+        """
+        SELECT m.id, m.photo_path FROM meals m
+        LEFT JOIN photo_features pf ON pf.meal_id = m.id
+        WHERE m.photo_path IS NOT NULL AND pf.meal_id IS NULL
+        """
+    ).fetchall()
+    rows = []
+    waiting = 0
+    queue = get_recognition_queue()
+    budget = RECOGNITION_CATCHUP
+    for meal_id, path in todo:
+        if path not in queue:
+            if budget <= 0:
+                waiting += 1
+                continue
+            budget -= 1
+        status, features = queue.poll(path, os.path.abspath(path))  # 작업자 프로세스의 작업 폴더와 무관하게
+        if status != "done":  # 계산 중이면 다음 조회 때, 실패(지워졌거나 깨진 사진)면 건너뜀
+            waiting += status == "pending"
+            continue
+        queue.forget(path)
+        dhash, vec = features
+        rows.append((meal_id, dhash, vec.tobytes()))
+    if rows:
+        conn.executemany("INSERT OR REPLACE INTO photo_features(meal_id, dhash, vec) VALUES (?,?,?)", rows)
+        conn.commit()
+    return waiting
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _photo_index(shard: str, size: int, last_id: int) -> PhotoIndex:
+    with get_conn(shard) as conn:
+        return PhotoIndex.from_rows(conn.execute("SELECT meal_id, dhash, vec FROM photo_features ORDER BY meal_id").fetchall())
+
+
+def photo_index() -> Tuple[PhotoIndex, int]:
+    """
+    (현재 사용자의 사진 색인, 아직 색인을 기다리는 사진 수).
+    새 사진을 증분 색인한 뒤, 색인 행이 바뀐 경우에만 메모리 배열을 다시 만든다.
+    """
+    with get_conn() as conn:
+        waiting = index_meal_photos(conn)
+        size, last_id = conn.execute("SELECT COUNT(*), COALESCE(MAX(meal_id), 0) FROM photo_features").fetchone()
+    return _photo_index(current_shard(), size, last_id), waiting
+
+
+def infer_foods_from_image(file_bytes: bytes) -> Optional[List[Tuple[str, float]]]:
+    """
+    이미지를 음식명 리스트로 추정 (로컬, 네트워크 불필요).
+    이전에 음식 항목과 함께 저장한 사진 중 가장 비슷한 것들(food_recognizer.TOP_K)의 항목을 유사도 가중 투표.
+    반환: [(음식명, 1인분 칼로리)] — 음식명은 foods 테이블 이름 그대로(식단 항목에 그대로 쓰면 같은 음식으로 집계),
+    칼로리는 foods.kcal (값이 없으면 0). 비교할 사진이 없거나 비슷한 사진이 없으면(열 수 없는 사진 포함) 빈 리스트.
+    사진 분석은 인식 작업 큐에 내용 해시로 한 번만 제출하고 기다리지 않음: 아직 분석 중이면 None (다음 재실행에서 다시 호출).
+    저장된 사진의 색인이 아직 따라잡는 중이라 비슷한 사진을 못 찾은 경우도 None.
+    """
+    status, features = get_recognition_queue().poll(hashlib.sha256(file_bytes).hexdigest(), file_bytes)
+    if status == "pending":
+        return None
+    if status == "failed":
         return []
+    return suggest_foods(*features)
+
+
+def suggest_foods(dhash: int, vec: np.ndarray) -> Optional[List[Tuple[str, float]]]:
+    # 사진 특징 → 최근접 색인 사진들의 음식 항목 투표 (메모리 배열 검색 + 이웃 몇 개의 항목 조회라 수 ms)
+    index, waiting = photo_index()
+    neighbours = index.search(dhash, vec)
+    if not neighbours:
+        # 저장된 사진이 아직 분석 중이면 "못 찾음"으로 단정하지 않음 (None → 화면에 분석 중 + 결과 확인 버튼)
+        return None if waiting and get_recognition_queue().pending() else []
+    meal_ids = [meal_id for meal_id, _ in neighbours]
+    q = f"""
+        SELECT mi.meal_id, f.name, COALESCE(f.kcal, 0) FROM meal_items mi
+        JOIN foods f ON f.id = mi.food_id
+        WHERE mi.meal_id IN ({",".join("?" * len(meal_ids))})
+    """
+    labels: Dict[int, List[str]] = {}
+    kcal: Dict[str, float] = {}
+    with get_conn() as conn:
+        for meal_id, name, food_kcal in conn.execute(q, meal_ids):
+            labels.setdefault(meal_id, []).append(name)
+            kcal[name] = food_kcal
+    return [(name, float(kcal[name])) for name, _ in vote(neighbours, labels)]
+
+
+# ----------------------------- 사진 저장소 ----------------------------- #
+# 사진은 내용의 SHA-256 으로 이름을 붙여 저장 (같은 사진을 다시 올리면 기존 파일을 재사용).
+# IMG_DIR/ab/cd/abcd….jpg 처럼 해시 앞 4글자로 두 단계 하위 폴더에 나눠 한 폴더에 파일이 몰리지 않게 함.
+
+def photo_path_for(digest: str, ext: str) -> str:
+    return os.path.join(IMG_DIR, digest[:2], digest[2:4], digest + ext)
+
+
+def store_photo(upload, name: Optional[str] = None) -> str:
+    """업로드 파일(파일류 객체)을 PHOTO_CHUNK 단위로 읽어 해시하면서 임시 파일에 쓰고, 해시 경로로 옮긴 뒤 그 경로를 반환."""
+    ext = os.path.splitext(name or getattr(upload, "name", ""))[1].lower()
+    ext = PHOTO_EXTS.get(ext, ext)
+    if hasattr(upload, "seek"):
+        upload.seek(0)
+    digest = hashlib.sha256()
+    tmp = tempfile.NamedTemporaryFile(dir=IMG_DIR, prefix=".upload_", suffix=".part", delete=False)
+    try:
+        with tmp:
+            for chunk in iter(lambda: upload.read(PHOTO_CHUNK), b""):
+                digest.update(chunk)
+                tmp.write(chunk)
+        path = photo_path_for(digest.hexdigest(), ext)
+        if os.path.exists(path):  # 이미 저장된 사진
+            os.remove(tmp.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp.name, path)  # 같은 파일시스템 안의 rename 이라 중간 상태의 파일이 보이지 않음
+    except BaseException:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+        raise
+    return path
+
+
+def thumb_path(photo_path: str, size: str) -> str:
+    # 원본의 IMG_DIR 기준 상대 경로를 그대로 따라가므로 해시 폴더 구조도 유지됨
+    rel = os.path.splitext(os.path.relpath(photo_path, IMG_DIR))[0]
+    return os.path.join(THUMB_DIR, size, rel + ".jpg")
+
+
+def make_thumbnails(photo_path: str) -> Dict[str, str]:
+    """원본 사진에서 THUMB_SIZES 축소본(JPEG) 중 아직 없는 것을 만들고 {크기: 경로} 를 반환."""
+    paths = {size: thumb_path(photo_path, size) for size in THUMB_SIZES}
+    missing = [size for size, path in paths.items() if not os.path.exists(path)]
+    if missing:
+        with Image.open(photo_path) as im:
+            largest = max(THUMB_SIZES[size] for size in missing)
+            im.draft("RGB", (largest, largest))  # JPEG 는 디코딩 단계에서 미리 축소 (전체 해상도로 풀지 않음)
+            im = ImageOps.exif_transpose(im).convert("RGB")
+            for size in sorted(missing, key=THUMB_SIZES.get, reverse=True):  # 큰 것부터 만들고 그 결과를 다시 줄임
+                im.thumbnail((THUMB_SIZES[size], THUMB_SIZES[size]))
+                os.makedirs(os.path.dirname(paths[size]), exist_ok=True)
+                tmp = paths[size] + ".part"
+                im.save(tmp, "JPEG", quality=80, optimize=True)
+                os.replace(tmp, paths[size])
+    return paths
+
+
+class ThumbnailWorker:
+    """축소본을 백그라운드 스레드 하나에서 생성. 같은 사진은 진행 중인 작업이 있으면 다시 걸지 않는다.
+
+    끝난 작업은 바로 잊음 (축소본 파일이 생겼으므로 이후에는 파일 존재 확인으로 충분).
+    실패한 작업만 다시 시도하지 않도록 최근 THUMB_FAILED_KEEP 개까지 기억한다.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+        self._jobs: Dict[str, Future] = {}
+        self._failed: deque = deque()
+        self._guard = threading.Lock()
+
+    def submit(self, photo_path: str) -> Future:
+        with self._guard:
+            job = self._jobs.get(photo_path)
+            new = job is None
+            if new:
+                job = self._jobs[photo_path] = self._executor.submit(make_thumbnails, photo_path)
+        if new:  # 이미 끝났으면 콜백이 바로 이 스레드에서 실행되므로 잠금 밖에서 등록
+            job.add_done_callback(lambda done, path=photo_path: self._finished(path, done))
+        return job
+
+    def _finished(self, photo_path: str, job: Future):
+        with self._guard:
+            if job.cancelled() or job.exception() is None:
+                self._jobs.pop(photo_path, None)
+                return
+            self._failed.append(photo_path)
+            while len(self._failed) > THUMB_FAILED_KEEP:
+                self._jobs.pop(self._failed.popleft(), None)
+
+    def thumbnail(self, photo_path: str, size: str) -> Tuple[Optional[str], bool]:
+        """(축소본 경로 또는 None, 생성 대기 중 여부). 축소본이 없으면 생성 작업을 걸어 두고 기다리지 않음."""
+        path = thumb_path(photo_path, size)
+        if os.path.exists(path):
+            return path, False
+        if not os.path.exists(photo_path):  # 원본이 지워진 기록
+            return None, False
+        job = self.submit(photo_path)
+        if job.done():
+            return (path, False) if job.exception() is None else (None, False)
+        return None, True
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+@st.cache_resource(show_spinner=False)
+def get_thumbnail_worker() -> ThumbnailWorker:
+    worker = ThumbnailWorker()
+    atexit.register(worker.close)
+    return worker
 
 
 # ----------------------------- DB 헬퍼 ----------------------------- #
 
+class Profile:
+    """profile 테이블의 한 행. 사이드바 기본값·목표선·차트가 같은 객체를 공유한다."""
+
+    __slots__ = (
+        "birth_year",
+        "sex",
+        "height_cm",
+        "weight_kg",
+        "target_weight_kg",
+        "daily_calorie_target",
+        "daily_carb_target_g",
+        "knee_care",
+    )
+
+    def __init__(
+        self,
+        birth_year: Optional[int] = None,
+        sex: Optional[str] = None,
+        height_cm: Optional[float] = None,
+        weight_kg: Optional[float] = None,
+        target_weight_kg: Optional[float] = None,
+        daily_calorie_target: Optional[int] = None,
+        daily_carb_target_g: Optional[int] = None,
+        knee_care: Optional[int] = None,
+    ):
+        self.birth_year = birth_year
+        self.sex = sex
+        self.height_cm = height_cm
+        self.weight_kg = weight_kg
+        self.target_weight_kg = target_weight_kg
+        self.daily_calorie_target = daily_calorie_target
+        self.daily_carb_target_g = daily_carb_target_g
+        self.knee_care = knee_care
+
+
+def get_profile() -> Optional[Profile]:
+    # 세션당 한 번 읽고, 사용자(샤드)가 바뀌거나 upsert_profile 로 profile 버전이 바뀐 경우에만 다시 읽음
+    version = (current_shard(), get_table_cache().version("profile"))
+    cached = st.session_state.get("_profile")
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with get_conn() as conn:
+        row = conn.execute(f"SELECT {', '.join(Profile.__slots__)} FROM profile WHERE id = 1").fetchone()
+    profile = Profile(*row) if row else None
+    st.session_state["_profile"] = (version, profile)
+    return profile
+
+
 def upsert_profile(**kwargs):
-    conn = get_conn()
-    cur = conn.cursor()
-    # row 존재 여부
-    cur.execute("SELECT id FROM profile WHERE id = 1")
-    exists = cur.fetchone() is not None
+    with get_conn() as conn:
+        cur = conn.cursor()
+        # row 존재 여부
+        cur.execute("SELECT id FROM profile WHERE id = 1")
+        exists = cur.fetchone() is not None
+
+        cols = [k for k in kwargs.keys()]
+        vals = [kwargs[k] for k in cols]
+
+        if exists:
+            set_clause = ", ".join([f"{c} = ?" for c in cols])
+            cur.execute(f"UPDATE profile SET {set_clause} WHERE id = 1", vals)
+        else:
+            col_clause = ", ".join(cols)
+            q = ",".join(["?"] * len(cols))
+            cur.execute(f"INSERT INTO profile(id, {col_clause}) VALUES (1, {q})", vals)
+        conn.commit()
+    refresh_cache("profile", reload=True)
+    st.session_state.pop("_profile", None)
 
-    cols = [k for k in kwargs.keys()]
-    vals = [kwargs[k] for k in cols]
 
-    if exists:
-        set_clause = ", ".join([f"{c} = ?" for c in cols])
-        cur.execute(f"UPDATE profile SET {set_clause} WHERE id = 1", vals)
-    else:
-        col_clause = ", ".join(cols)
-        q = ",".join(["?"] * len(cols))
-        cur.execute(f"INSERT INTO profile(id, {col_clause}) VALUES (1, {q})", vals)
-    conn.commit()
-    refresh_cache()
+def _chunked(records: Iterable[tuple], size: int = BULK_CHUNK) -> Iterator[List[tuple]]:
+    it = iter(records)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def insert_meals(records: Iterable[tuple]) -> int:
+    """(dt, label, items, calories, carbs_g, photo_path) 레코드를 한 트랜잭션으로 일괄 입력 (dt: datetime·ISO 문자열·epoch 초).
+
+    제너레이터도 BULK_CHUNK 행씩 끊어 executemany 로 넘기므로 입력 크기와 무관하게 메모리가 일정하다.
+    meal_items·daily_summary 도 같은 트랜잭션에서 갱신하고, 캐시 무효화는 끝에 한 번만 한다.
+    """
+    total = 0
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")  # 쓰기 잠금을 먼저 잡아 새 id 구간이 이 트랜잭션 것임을 보장
+        for chunk in _chunked(records):
+            rows = [(to_epoch(dt), label, items, calories, carbs_g, photo_path) for dt, label, items, calories, carbs_g, photo_path in chunk]
+            last_id = cur.execute("SELECT COALESCE(MAX(id), 0) FROM meals").fetchone()[0]
+            cur.executemany("INSERT INTO meals(dt, label, items, calories, carbs_g, photo_path) VALUES (?,?,?,?,?,?)", rows)
+            meal_ids = [r[0] for r in cur.execute("SELECT id FROM meals WHERE id > ? ORDER BY id", (last_id,))]
+            _insert_meal_items(cur, zip(meal_ids, (r[2] for r in rows)))
+            cur.executemany(SUMMARY_ADD_MEAL, [(r[0] // 86400, r[3], r[4]) for r in rows])
+            total += len(rows)
+        conn.commit()
+    if total:
+        refresh_cache("meals", "daily_summary")
+    return total
+
+
+def insert_activities(records: Iterable[tuple]) -> int:
+    """(dt, kind, minutes, steps, distance_km, pace_kmh, calories) 레코드 일괄 입력 (insert_meals 와 같은 방식)."""
+    total = 0
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        for chunk in _chunked(records):
+            rows = [(to_epoch(dt),) + tuple(rest) for dt, *rest in chunk]
+            cur.executemany("INSERT INTO activities(dt, kind, minutes, steps, distance_km, pace_kmh, calories) VALUES (?,?,?,?,?,?,?)", rows)
+            cur.executemany(SUMMARY_ADD_ACTIVITY, [(r[0] // 86400, r[6], r[3]) for r in rows])
+            total += len(rows)
+        conn.commit()
+    if total:
+        refresh_cache("activities", "daily_summary")
+    return total
+
+
+def insert_weights(records: Iterable[tuple]) -> int:
+    """(d, weight_kg) 레코드 일괄 입력. 같은 날짜가 여러 번 나오면 마지막 값이 일별 요약에 남는다."""
+    total = 0
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        for chunk in _chunked(records):
+            rows = [(to_day(d), weight_kg) for d, weight_kg in chunk]
+            cur.executemany("INSERT INTO weights(d, weight_kg) VALUES (?,?)", rows)
+            cur.executemany(SUMMARY_SET_WEIGHT, rows)
+            total += len(rows)
+        conn.commit()
+    if total:
+        refresh_cache("weights", "daily_summary")
+    return total
 
 
 def insert_meal(dt: datetime, label: str, items: str, calories: float, carbs_g: float, photo_path: Optional[str]):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO meals(dt, label, items, calories, carbs_g, photo_path) VALUES (?,?,?,?,?,?)",
-        (dt.isoformat(), label, items, calories, carbs_g, photo_path),
-    )
-    conn.commit()
-    refresh_cache()
+    insert_meals([(dt, label, items, calories, carbs_g, photo_path)])
 
 
 def insert_activity(dt: datetime, kind: str, minutes: float, steps: Optional[int], distance_km: Optional[float], pace_kmh: Optional[float], calories: float):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO activities(dt, kind, minutes, steps, distance_km, pace_kmh, calories) VALUES (?,?,?,?,?,?,?)",
-        (dt.isoformat(), kind, minutes, steps, distance_km, pace_kmh, calories),
-    )
-    conn.commit()
-    refresh_cache()
+    insert_activities([(dt, kind, minutes, steps, distance_km, pace_kmh, calories)])
 
 
 def insert_weight(d: date, weight_kg: float):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO weights(d, weight_kg) VALUES (?,?)",
-        (d.isoformat(), weight_kg),
-    )
-    conn.commit()
-    refresh_cache()
+    insert_weights([(d, weight_kg)])
+
+
+def _epoch_column(col: pd.Series, unit: str) -> pd.Series:
+    # 가져온 날짜/일시 열 → 정수 epoch (초 "s" / 일 "D"). 숫자는 그대로, ISO 문자열(CSV)·datetime64(Parquet)는 변환
+    if pd.api.types.is_numeric_dtype(col):
+        return col.astype("int64")
+    stamps = col if pd.api.types.is_datetime64_any_dtype(col) else pd.to_datetime(col, format="ISO8601")
+    return (stamps - pd.Timestamp(0)) // pd.Timedelta(1, unit=unit)
+
+
+def _read_import_chunks(zf: ZipFile, table: str, cols: Tuple[str, ...]) -> Iterator[Tuple[str, pd.DataFrame]]:
+    # ZIP 안의 테이블 파일을 IMPORT_CHUNK 행씩 읽음. Parquet가 있으면 우선 사용(파싱 없이 타입 그대로)
+    names = set(zf.namelist())
+    if pq is not None and f"{table}.parquet" in names:
+        with zf.open(f"{table}.parquet") as fh:
+            pf = pq.ParquetFile(fh)
+            wanted = [c for c in cols if c in pf.schema_arrow.names]
+            for batch in pf.iter_batches(batch_size=IMPORT_CHUNK, columns=wanted):
+                yield f"{table}.parquet", batch.to_pandas(date_as_object=False)
+    elif f"{table}.csv" in names:
+        text_cols = {c: str for c in ("dt", "d", "label", "items", "kind", "photo_path") if c in cols}
+        with zf.open(f"{table}.csv") as fh:
+            for chunk in pd.read_csv(fh, chunksize=IMPORT_CHUNK, dtype=text_cols, float_precision="round_trip"):
+                yield f"{table}.csv", chunk
+
+
+def import_export_zip(file) -> Dict[str, int]:
+    """내보내기 ZIP(<테이블>.parquet 또는 .csv)을 복원. 반환: 파일별 새로 입력한 행 수.
+
+    파일은 IMPORT_CHUNK 행씩 읽고, 자연 키가 같은 행은 파일 안에서도·DB와도 중복으로 보고 건너뛴다.
+    날짜는 ISO 문자열·datetime64·정수 모두 받아 정수 epoch 로 맞춘다. DB 중복 확인은 조각의 날짜 범위만 조회하므로 여러 해 분량의 백업도 메모리에 한꺼번에 올리지 않는다.
+    """
+    inserters = {"meals": insert_meals, "activities": insert_activities, "weights": insert_weights}
+    counts: Dict[str, int] = {}
+    with ZipFile(file) as zf:
+        for table, (keys, cols) in IMPORT_SPECS.items():
+            date_col = keys[0]  # dt 또는 d
+            for fname, chunk in _read_import_chunks(zf, table, cols):
+                counts.setdefault(fname, 0)
+                chunk = chunk.reindex(columns=list(cols)).dropna(subset=[date_col])
+                chunk[date_col] = _epoch_column(chunk[date_col], EPOCH_UNITS[date_col])
+                key_df = chunk[list(keys)].fillna("")
+                chunk, key_df = chunk[~key_df.duplicated()], key_df[~key_df.duplicated()]
+                if chunk.empty:
+                    continue
+                key_sql = ", ".join(f"COALESCE({k}, '')" for k in keys)
+                with get_conn() as conn:
+                    existing = set(conn.execute(
+                        f"SELECT {key_sql} FROM {table} WHERE {date_col} BETWEEN ? AND ?",
+                        (int(chunk[date_col].min()), int(chunk[date_col].max())),  # numpy 정수는 BLOB 으로 바인딩되므로 변환
+                    ).fetchall())
+                new = [k not in existing for k in key_df.itertuples(index=False, name=None)]
+                records = chunk[new].astype(object).where(chunk[new].notna(), None)
+                counts[fname] += inserters[table](records.itertuples(index=False, name=None))
+    return counts
+
+
+def _export_columns(conn: sqlite3.Connection, table: str) -> List[Tuple[str, str]]:
+    # 저장 열 (이름, 선언 타입). table_info 는 생성 열(day)을 포함하지 않음
+    return [(name, decl.upper()) for _, name, decl, *_ in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _arrow_schema(columns: List[Tuple[str, str]]) -> "pa.Schema":
+    # SQLite 선언 타입 → Arrow 타입. epoch 정수 열은 timestamp[s] / date32 로 내보냄
+    types = {"INTEGER": pa.int64(), "REAL": pa.float64(), "TEXT": pa.string()}
+    temporal = {"dt": pa.timestamp("s"), "d": pa.date32()}
+    return pa.schema([pa.field(name, temporal.get(name) or types.get(decl, pa.string())) for name, decl in columns])
+
+
+def _write_table_csv(zf: ZipFile, cur: sqlite3.Cursor, table: str):
+    with zf.open(f"{table}.csv", "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow([col[0] for col in cur.description])
+        while True:
+            rows = cur.fetchmany(BULK_CHUNK)
+            if not rows:
+                break
+            writer.writerows(rows)
+
+
+def _stored_entry(name: str) -> ZipInfo:
+    # 이미 압축된 파일(Parquet)용 무압축 ZIP 항목
+    info = ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+    info.compress_type = ZIP_STORED
+    return info
+
+
+def _write_table_parquet(zf: ZipFile, cur: sqlite3.Cursor, table: str, schema: "pa.Schema"):
+    # PARQUET_ROW_GROUP 행마다 하나의 row group. zstd 압축이므로 ZIP 안에서는 다시 압축하지 않음
+    # id·일시처럼 증가하는 정수 열은 델타 인코딩, 문자열 열만 사전 인코딩
+    int_cols = [f.name for f in schema if pa.types.is_integer(f.type) or pa.types.is_temporal(f.type)]
+    text_cols = [f.name for f in schema if pa.types.is_string(f.type)]
+    encoding = {name: "DELTA_BINARY_PACKED" for name in int_cols}
+    with zf.open(_stored_entry(f"{table}.parquet"), "w") as fh:
+        with pq.ParquetWriter(fh, schema, compression="zstd", use_dictionary=text_cols, column_encoding=encoding) as writer:
+            while True:
+                rows = cur.fetchmany(PARQUET_ROW_GROUP)
+                if not rows:
+                    break
+                chunk = with_datetimes(pd.DataFrame.from_records(rows, columns=schema.names))
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def write_export_zip(fileobj, tables: Tuple[str, ...] = EXPORT_TABLES, fmt: str = "csv"):
+    # 테이블별 <table>.csv 또는 <table>.parquet 를 ZIP에 기록. 행은 커서에서 BULK_CHUNK 개씩 읽어 바로 씀
+    with ZipFile(fileobj, "w", compression=ZIP_DEFLATED) as zf, get_conn() as conn:
+        conn.execute("BEGIN")  # 세 테이블을 같은 시점(스냅샷)으로 읽음. 반납 시 롤백
+        for table in tables:
+            columns = _export_columns(conn, table)
+            if fmt == "parquet":
+                cur = conn.execute(f"SELECT {', '.join(name for name, _ in columns)} FROM {table} ORDER BY id")
+                _write_table_parquet(zf, cur, table, _arrow_schema(columns))
+            else:
+                # CSV는 사람이 읽을 수 있도록 ISO 문자열로 (가져오기에서 다시 정수로 변환)
+                iso = {"dt": "strftime('%Y-%m-%dT%H:%M:%S', dt, 'unixepoch') AS dt", "d": "date(d * 86400, 'unixepoch') AS d"}
+                cur = conn.execute(f"SELECT {', '.join(iso.get(name, name) for name, _ in columns)} FROM {table} ORDER BY id")
+                _write_table_csv(zf, cur, table)
+
+
+@contextmanager
+def export_zip(fmt: str = "csv") -> Iterator[io.RawIOBase]:
+    """내보내기 ZIP 을 이름 없는 임시 파일에 쓰고, 처음으로 되감은 파일 객체를 넘김 (블록을 벗어나면 파일 삭제).
+
+    행은 커서에서 BULK_CHUNK 개씩 읽어 바로 압축해 디스크에 쓰므로 만드는 동안의 메모리는 청크 크기로 제한된다.
+    공유 경로를 쓰지 않으므로 동시에 내보내는 사용자끼리 파일이 겹치지 않는다.
+    """
+    with tempfile.TemporaryFile() as fh:
+        write_export_zip(fh, fmt=fmt)
+        fh.seek(0)  # 버퍼를 비우고 되감음
+        yield fh.raw  # st.download_button 은 BufferedReader/RawIOBase 만 받으므로 버퍼 아래의 파일 객체
 
 
 # ----------------------------- 스트림릿 UI ----------------------------- #
@@ -229,26 +1225,59 @@ def insert_weight(d: date, weight_kg: float):
 st.set_page_config(page_title=f"{APP_NAME}", page_icon="🍎", layout="wide")
 init_db()
 
+# 부분 재실행: 위젯을 바꾸면 그 위젯이 있는 fragment 함수(사이드바/탭 하나/내보내기)만 다시 실행
+# st.fragment(1.37+, requirements.txt 의 고정 버전) / st.experimental_fragment(1.33+). 더 낮은 버전에서는 그냥 호출되어 전체 재실행
+_st_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+fragment = _st_fragment or (lambda func: func)
+
+
+def share(key: str, value):
+    """다른 fragment도 쓰는 값을 세션에 공유. 부분 재실행 중 값이 바뀌면 앱 전체를 다시 실행해 함께 갱신."""
+    changed = key in st.session_state and st.session_state[key] != value
+    st.session_state[key] = value
+    if changed and _st_fragment is not None:
+        st.rerun()
+    return value
+
+
 st.title("🍎 PrediCare — 걷기 기반 당뇨 전단계 체중 관리")
 st.caption("*개인 건강 참고용 도구입니다. 의학적 진단/치료를 대체하지 않습니다.*")
 
-with st.sidebar:
+@fragment
+def render_sidebar():
+    st.header("사용자")
+    if "user_pending" in st.session_state:  # 새로 등록한 사용자를 선택 상태로
+        st.session_state["user"] = st.session_state.pop("user_pending")
+    user = st.selectbox("사용자 선택", list_users(), key="user", help="사용자마다 프로필과 기록을 별도 DB 파일에 저장합니다.")
+    with st.expander("새 사용자 등록"):
+        new_user = st.text_input("이름", key="new_user").strip()
+        if st.button("등록") and new_user:
+            shard_for(new_user)
+            st.session_state["user_pending"] = new_user
+            st.rerun()
+    shard = shard_for(user)
+    if shard != current_shard():
+        # 다른 사용자의 샤드로 바꾸고 처음부터 다시 그림 (샤드 열기/카탈로그 반영은 스크립트 상단에서)
+        st.session_state["shard"] = shard
+        st.rerun()
+
     st.header("프로필 & 목표")
+    profile = get_profile() or Profile()
     today = date.today()
     default_birth_year = today.year - 52  # 50대 기준 값
 
     col1, col2 = st.columns(2)
     with col1:
-        birth_year = st.number_input("출생연도", min_value=1930, max_value=today.year, value=default_birth_year, step=1)
+        birth_year = st.number_input("출생연도", min_value=1930, max_value=today.year, value=int(profile.birth_year or default_birth_year), step=1)
     with col2:
-        sex = st.selectbox("성별", ["여성", "남성"], index=0)
+        sex = st.selectbox("성별", ["여성", "남성"], index=1 if profile.sex == "남성" else 0)
 
-    height_cm = st.number_input("키 (cm)", min_value=120.0, max_value=210.0, value=160.0, step=0.5)
-    weight_kg = st.number_input("현재 체중 (kg)", min_value=35.0, max_value=200.0, value=65.0, step=0.1)
-    target_weight_kg = st.number_input("목표 체중 (kg)", min_value=35.0, max_value=200.0, value=60.0, step=0.1)
+    height_cm = st.number_input("키 (cm)", min_value=120.0, max_value=210.0, value=float(profile.height_cm or 160.0), step=0.5)
+    weight_kg = share("weight_kg", st.number_input("현재 체중 (kg)", min_value=35.0, max_value=200.0, value=float(profile.weight_kg or 65.0), step=0.1))  # 걷기 소모열량 계산에 사용
+    target_weight_kg = st.number_input("목표 체중 (kg)", min_value=35.0, max_value=200.0, value=float(profile.target_weight_kg or 60.0), step=0.1)
 
     activity_level = st.select_slider("평소 활동량", options=["낮음", "보통", "활동적", "매우 활동적"], value="보통")
-    knee_care = st.checkbox("무릎 보호 모드 (전방십자인대 수술 이력)", value=True)
+    knee_care = st.checkbox("무릎 보호 모드 (전방십자인대 수술 이력)", value=profile.knee_care != 0)
 
     age = today.year - int(birth_year)
     bmr = bmr_mifflin(weight_kg, height_cm, age, sex)
@@ -259,7 +1288,7 @@ with st.sidebar:
 
     deficit = 300  # 온건 감량 권장
     daily_calorie_target = int(max(1200, tdee - deficit))
-    daily_carb_target_g = 150  # 당뇨 전단계: 중간 탄수화물 목표(개인차 고려)
+    daily_carb_target_g = share("daily_carb_target_g", 150)  # 당뇨 전단계: 중간 탄수화물 목표(개인차 고려)
 
     st.write(f"권장 섭취열량: **{daily_calorie_target} kcal/일** (약 -{deficit} kcal)")
     st.write(f"권장 탄수화물: **{daily_carb_target_g} g/일**")
@@ -277,12 +1306,13 @@ with st.sidebar:
         )
         st.success("프로필이 저장되었습니다.")
 
-
-# 탭 구성
-TAB1, TAB2, TAB3 = st.tabs(["오늘 기록", "통계", "가이드"])
+with st.sidebar:
+    render_sidebar()
 
 # ----------------------------- 탭: 오늘 기록 ----------------------------- #
-with TAB1:
+@fragment
+def render_today():
+    weight_kg = st.session_state["weight_kg"]
     st.subheader("📸 식단 기록 (사진 업로드 / 수동 입력)")
 
     col_a, col_b = st.columns([1, 1])
@@ -291,15 +1321,22 @@ with TAB1:
         meal_time = st.time_input("섭취 시간", value=datetime.now().time())
 
         uploaded = st.file_uploader("음식 사진 업로드 (선택)", type=["jpg", "jpeg", "png"])
-        auto_detect = st.checkbox("사진에서 음식 자동 인식 시도 (API 키 필요)")
+        auto_detect = st.checkbox("사진에서 음식 자동 인식 시도 (저장했던 사진과 비교)")
         detected_items: List[str] = []
         if uploaded is not None and auto_detect:
             foods = infer_foods_from_image(uploaded.getvalue())
-            if foods:
+            if foods is None:
+                st.info("사진을 분석하는 중입니다. 다른 항목은 계속 입력하셔도 됩니다.")
+                st.button("분석 결과 확인")  # 누르면 재실행되어 결과를 다시 조회
+            elif foods:
                 detected_items = [f"{name}" for name, _ in foods]
                 st.info("자동 인식 결과 (검토/수정하세요): " + ", ".join(detected_items))
             else:
-                st.warning("자동 인식 불가 또는 API 키 미설정. 수동 입력을 이용하세요.")
+                st.warning("비슷한 사진을 찾지 못했습니다. 음식 항목을 적어 사진과 함께 저장해 두면 다음부터 제안됩니다.")
+        if auto_detect:
+            backlog = get_recognition_queue().pending()
+            if backlog:
+                st.caption(f"사진 분석 대기 중: {backlog}건 (저장된 사진 색인 포함)")
 
         items_text = st.text_area(
             "음식 항목 (쉼표로 구분)",
@@ -312,13 +1349,9 @@ with TAB1:
 
         if st.button("식단 저장"):
             # 이미지 저장
-            photo_path = None
-            if uploaded is not None:
-                ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                ext = os.path.splitext(uploaded.name)[1].lower()
-                photo_path = os.path.join(IMG_DIR, f"meal_{ts}{ext}")
-                with open(photo_path, "wb") as f:
-                    f.write(uploaded.getvalue())
+            photo_path = store_photo(uploaded) if uploaded is not None else None
+            if photo_path is not None:
+                get_thumbnail_worker().submit(photo_path)  # 축소본은 저장 직후 백그라운드에서 한 번만 생성
 
             dt = datetime.combine(date.today(), meal_time)
             insert_meal(dt, meal_label, items_text.strip(), float(calories), float(carbs_g), photo_path)
@@ -326,21 +1359,14 @@ with TAB1:
 
     with col_b:
         st.write("오늘 입력된 식단")
-        meals_df = load_df("meals")
-        if not meals_df.empty:
-            meals_df["date"] = pd.to_datetime(meals_df["dt"]).dt.date
-            today_df = meals_df[meals_df["date"] == date.today()]
-            if today_df.empty:
-                st.info("아직 오늘 식단 기록이 없습니다.")
-            else:
-                st.dataframe(
-                    today_df[["dt", "label", "items", "calories", "carbs_g"]]
-                    .rename(columns={"dt": "시간", "label": "구분", "items": "항목", "calories": "kcal", "carbs_g": "탄수(g)"})
-                    .sort_values("시간"),
-                    use_container_width=True,
-                )
+        today_df = query_df("meals", ["dt", "label", "items", "calories", "carbs_g"], start=date.today(), end=date.today())
+        if today_df.empty:
+            st.info("아직 오늘 식단 기록이 없습니다.")
         else:
-            st.info("아직 식단 데이터가 없습니다.")
+            st.dataframe(
+                today_df.rename(columns={"dt": "시간", "label": "구분", "items": "항목", "calories": "kcal", "carbs_g": "탄수(g)"}),
+                use_container_width=True,
+            )
 
     st.markdown("---")
     st.subheader("🚶 걷기 기록")
@@ -381,90 +1407,95 @@ with TAB1:
             st.success("체중이 저장되었습니다.")
 
 # ----------------------------- 탭: 통계 ----------------------------- #
-with TAB2:
+@fragment
+def render_stats():
     st.subheader("📈 추이 시각화")
-    meals_df = load_df("meals")
-    acts_df = load_df("activities")
-    w_df = load_df("weights")
-
-    # 집계
-    if not meals_df.empty:
-        meals_df["d"] = pd.to_datetime(meals_df["dt"]).dt.date
-        kcal_by_day = meals_df.groupby("d")["calories"].sum().reset_index().rename(columns={"calories": "intake_kcal"})
-        carb_by_day = meals_df.groupby("d")["carbs_g"].sum().reset_index().rename(columns={"carbs_g": "carb_g"})
-    else:
-        kcal_by_day = pd.DataFrame(columns=["d", "intake_kcal"]) 
-        carb_by_day = pd.DataFrame(columns=["d", "carb_g"]) 
-
-    if not acts_df.empty:
-        acts_df["d"] = pd.to_datetime(acts_df["dt"]).dt.date
-        out_kcal = acts_df.groupby("d")["calories"].sum().reset_index().rename(columns={"calories": "burn_kcal"})
-        steps_by_day = acts_df.groupby("d")["steps"].sum(min_count=1).reset_index().rename(columns={"steps": "steps"})
-    else:
-        out_kcal = pd.DataFrame(columns=["d", "burn_kcal"]) 
-        steps_by_day = pd.DataFrame(columns=["d", "steps"]) 
-
-    # 병합
-    daily = pd.merge(kcal_by_day, out_kcal, on="d", how="outer")
-    daily = pd.merge(daily, carb_by_day, on="d", how="outer")
-    if not w_df.empty:
-        w_df["d"] = pd.to_datetime(w_df["d"]).dt.date
-        daily = pd.merge(daily, w_df[["d", "weight_kg"]], on="d", how="outer")
-
-    daily = daily.sort_values("d")
-    # 목표선 표시를 위해 프로필에서 목표/권장 읽기 (사이드바 계산값을 그대로 사용)
-    daily_calorie_target_line = daily_calorie_target
-    daily_carb_target_line = daily_carb_target_g
-
-    # 결측 0 처리 (시각화를 위한 용도)
-    daily_fill = daily.fillna({"intake_kcal":0, "burn_kcal":0, "carb_g":0})
-
-    if daily_fill.empty:
+    period_days = {"최근 7일": 7, "최근 30일": 30, "최근 90일": 90, "최근 1년": 365, "전체": None}
+    period = st.selectbox("기간", list(period_days.keys()), index=1)
+    stats_start = date.today() - timedelta(days=period_days[period] - 1) if period_days[period] else None
+    # 탄수화물 목표선은 사이드바 계산값을 그대로 사용
+    daily_carb_target_line = st.session_state["daily_carb_target_g"]
+    charts = stats_charts(stats_start, daily_carb_target_line)
+
+    if charts is None:
         st.info("아직 통계에 표시할 데이터가 없습니다. '오늘 기록'에서 식단/운동/체중을 입력해 주세요.")
     else:
         c1, c2 = st.columns(2)
         with c1:
             st.write("체중 추이 (kg)")
-            if "weight_kg" in daily_fill.columns and daily_fill["weight_kg"].notna().any():
-                chart_w = alt.Chart(daily_fill.dropna(subset=["weight_kg"])) \
-                    .mark_line(point=True) \
-                    .encode(x=alt.X("d:T", title="날짜"), y=alt.Y("weight_kg:Q", title="체중(kg)"))
-                st.altair_chart(chart_w, use_container_width=True)
+            if charts["weight"] is not None:
+                st.vega_lite_chart(charts["weight"], use_container_width=True)
             else:
                 st.info("체중 데이터가 아직 없습니다.")
 
         with c2:
             st.write("칼로리 섭취/소모")
-            melt = daily_fill.melt(id_vars=["d"], value_vars=["intake_kcal", "burn_kcal"], var_name="type", value_name="kcal")
-            chart_c = alt.Chart(melt).mark_bar().encode(
-                x=alt.X("d:T", title="날짜"),
-                y=alt.Y("kcal:Q", title="kcal"),
-                color="type:N",
-                tooltip=["d:T", "type:N", "kcal:Q"],
-            )
-            st.altair_chart(chart_c, use_container_width=True)
+            st.vega_lite_chart(charts["kcal"], use_container_width=True)
 
         st.write("일일 탄수화물(g)")
-        chart_carbs = alt.Chart(daily_fill).mark_line(point=True).encode(
-            x=alt.X("d:T", title="날짜"),
-            y=alt.Y("carb_g:Q", title="탄수화물(g)"),
-        )
-        # 목표선
-        rule = alt.Chart(pd.DataFrame({"y": [daily_carb_target_line]})).mark_rule().encode(y="y:Q")
-        st.altair_chart(chart_carbs + rule, use_container_width=True)
+        st.vega_lite_chart(charts["carbs"], use_container_width=True)
 
         st.write("일일 걸음수")
-        if not steps_by_day.empty and steps_by_day["steps"].notna().any():
-            chart_s = alt.Chart(steps_by_day.fillna({"steps":0})).mark_bar().encode(
-                x=alt.X("d:T", title="날짜"),
-                y=alt.Y("steps:Q", title="걸음수"),
-            )
-            st.altair_chart(chart_s, use_container_width=True)
+        if charts["steps"] is not None:
+            st.vega_lite_chart(charts["steps"], use_container_width=True)
         else:
             st.info("걸음수 데이터가 아직 없습니다.")
 
+        st.write("음식별 섭취 순위 (상위 10개)")
+        # 이 버전에는 음식 영양 카탈로그가 없어 foods.kcal/carb_g 가 비어 있음 → 횟수/인분 기준 순위만 제공
+        top_order = {"자주 먹은 음식": "count", "많이 먹은 음식(인분)": "servings"}
+        top_by = st.radio("순위 기준", list(top_order.keys()), horizontal=True)
+        foods_top = top_foods(stats_start, top_order[top_by])
+        if foods_top.empty:
+            st.info("음식 항목이 기록된 식단이 아직 없습니다.")
+        else:
+            st.dataframe(
+                foods_top.drop(columns=["kcal", "carb_g"]).rename(columns={"food": "음식", "meals": "식사 횟수", "servings": "인분 합계"}),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+# ----------------------------- 탭: 사진 기록 ----------------------------- #
+@fragment
+def render_gallery():
+    st.subheader("🖼️ 식단 사진 기록")
+    total = photo_count()
+    if total == 0:
+        st.info("사진과 함께 저장된 식단이 없습니다. '오늘 기록'에서 사진을 올려 저장해 보세요.")
+        return
+    pages = -(-total // GALLERY_PAGE_SIZE)
+    page_no = st.number_input(f"페이지 (사진 {total}장, {pages}쪽)", min_value=1, max_value=pages, value=1, step=1, key="gallery_page")
+    page_df = photo_page(int(page_no) - 1)
+
+    # 현재 페이지의 small 축소본만 전송 (원본은 보내지 않음)
+    worker = get_thumbnail_worker()
+    pending = 0
+    cols = st.columns(GALLERY_COLUMNS)
+    for i, row in enumerate(page_df.itertuples(index=False)):
+        with cols[i % GALLERY_COLUMNS]:
+            caption = f"{row.dt:%Y-%m-%d %H:%M} · {row.label} · {int(row.calories)} kcal"
+            path, waiting = worker.thumbnail(row.photo_path, "small")
+            if path:
+                st.image(path, caption=caption)
+                if st.button("크게 보기", key=f"gallery_open_{row.id}"):
+                    st.session_state["gallery_open"] = row.id
+            else:
+                pending += waiting
+                st.caption(f"{caption}\n\n({'축소본 만드는 중…' if waiting else '사진을 열 수 없음'})")
+    if pending:
+        st.caption(f"축소본 {pending}개를 만드는 중입니다.")
+        st.button("새로고침", key="gallery_refresh")
+
+    # 선택한 한 장만 medium 축소본으로
+    opened = page_df[page_df["id"] == st.session_state.get("gallery_open")]
+    if not opened.empty:
+        row = opened.iloc[0]
+        path, _ = worker.thumbnail(row["photo_path"], "medium")
+        if path:
+            st.image(path, caption=f"{row['dt']:%Y-%m-%d %H:%M} {row['label']}: {row['items']}")
+
 # ----------------------------- 탭: 가이드 ----------------------------- #
-with TAB3:
+def render_guide():
     st.subheader("🥗 식단 가이드 (당뇨 전단계 & 갱년기 친화)")
     st.markdown(
         """
@@ -496,38 +1527,44 @@ with TAB3:
 
     st.info("혈당·체중 반응은 개인차가 큽니다. 이상 증상 시 전문의와 상의하세요.")
 
+# 탭 구성 - st.tabs 는 보이지 않는 탭까지 매번 모두 계산하므로, 선택한 화면 하나만 실행
+TABS = {"오늘 기록": render_today, "통계": render_stats, "사진 기록": render_gallery, "가이드": render_guide}
+active_tab = st.radio("화면 선택", list(TABS), horizontal=True, label_visibility="collapsed", key="active_tab")
+TABS[active_tab]()
+
 # ----------------------------- 추가: 내보내기/가져오기 ----------------------------- #
-with st.expander("데이터 내보내기/가져오기"):
-    export_btn = st.button("CSV로 내보내기(zip)")
-    if export_btn:
-        meals = load_df("meals")
-        acts = load_df("activities")
-        weights = load_df("weights")
-        from zipfile import ZipFile
-        zip_path = "data/export_predicare.zip"
-        with ZipFile(zip_path, 'w') as zf:
-            meals.to_csv("data/meals.csv", index=False)
-            acts.to_csv("data/activities.csv", index=False)
-            weights.to_csv("data/weights.csv", index=False)
-            zf.write("data/meals.csv", arcname="meals.csv")
-            zf.write("data/activities.csv", arcname="activities.csv")
-            zf.write("data/weights.csv", arcname="weights.csv")
-        with open(zip_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode()
-        href = f'<a download="predicare_export.zip" href="data:file/zip;base64,{b64}">ZIP 다운로드</a>'
-        st.markdown(href, unsafe_allow_html=True)
+@fragment
+def render_data_tools():
+    export_formats = {"CSV": "csv", "Parquet (분석용, 날짜 타입 유지)": "parquet"} if pq is not None else {"CSV": "csv"}
+    export_fmt = st.radio("내보내기 형식", list(export_formats.keys()), horizontal=True)
+    if st.button("내보내기(zip)"):
+        # 임시 파일의 ZIP 을 스트림릿이 한 번 읽어 미디어 저장소로 넘김 (base64/HTML 링크 없음)
+        with export_zip(export_formats[export_fmt]) as fh:
+            st.download_button("ZIP 다운로드", data=fh, file_name="predicare_export.zip", mime="application/zip")
 
     st.markdown("**주의**: 브라우저/실행 환경에 따라 파일 저장 경로가 달라질 수 있습니다.")
 
+    import_file = st.file_uploader("내보낸 ZIP 가져오기 (meals / activities / weights 의 .csv 또는 .parquet)", type=["zip"], help="이미 있는 기록(같은 일시·항목)은 건너뜁니다.")
+    if import_file is not None and st.button("ZIP 가져오기"):
+        imported = import_export_zip(import_file)
+        if imported:
+            st.success("가져오기 완료 → " + ", ".join(f"{name} {n}건" for name, n in imported.items()))
+        else:
+            st.warning("ZIP 안에 meals / activities / weights 파일(.csv 또는 .parquet)이 없습니다.")
+
+with st.expander("데이터 내보내기/가져오기"):
+    render_data_tools()
+
 # ----------------------------- requirements 안내 ----------------------------- #
 with st.expander("requirements.txt 예시"):
     st.code(
         """
-        streamlit
+        streamlit>=1.37
         altair
         pandas
         numpy
         pillow
+        pyarrow
         """.strip(), language="text")
 
 # ----------------------------- 끝 ----------------------------- #
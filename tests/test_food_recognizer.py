@@ -0,0 +1,74 @@
+# food_recognizer: 무늬가 거의 없는 사진이 dHash 만으로 "같은 사진"이 되지 않는지 (회귀 테스트)
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from food_recognizer import PhotoIndex, photo_features
+
+rng = np.random.default_rng(0)
+
+
+def jpeg(pixels: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def plate(rgb, noise: float = 20, size=(800, 600)) -> bytes:
+    # 한 가지 색 + 픽셀 잡음 (무늬 없음)
+    return jpeg(np.array(rgb)[None, None, :] + rng.normal(0, noise, (size[1], size[0], 3)))
+
+
+def gradient(c0, c1, angle: float, size=(640, 480)) -> bytes:
+    # 두 색 사이의 완만한 그라데이션 (무늬 없음)
+    y, x = np.mgrid[0 : size[1], 0 : size[0]] / max(size)
+    t = np.clip((np.cos(angle) * x + np.sin(angle) * y + 0.5) / 1.7, 0, 1)[..., None]
+    return jpeg(np.array(c0) * (1 - t) + np.array(c1) * t)
+
+
+def textured(seed: int, size=(640, 480)) -> bytes:
+    coarse = np.random.default_rng(seed).normal(128, 60, (12, 16, 3))
+    return jpeg(np.asarray(Image.fromarray(np.clip(coarse, 0, 255).astype(np.uint8)).resize(size, Image.BICUBIC)))
+
+
+def index_of(photos):
+    features = [photo_features(p) for p in photos]
+    return PhotoIndex(range(len(photos)), [h for h, _ in features], np.stack([v for _, v in features]))
+
+
+LOW_TEXTURE = [
+    plate((200, 60, 40)),
+    plate((40, 70, 200)),
+    plate((70, 170, 60)),
+    plate((230, 230, 225)),
+    gradient((200, 60, 40), (240, 200, 150), 0.3),
+    gradient((40, 70, 200), (200, 220, 250), 1.2),
+    gradient((70, 170, 60), (20, 60, 20), 2.0),
+    gradient((230, 230, 225), (120, 110, 100), 3.0),
+    gradient((250, 200, 40), (120, 60, 10), 4.2),
+    gradient((90, 40, 120), (230, 180, 240), 5.1),
+]
+
+
+@pytest.mark.parametrize("i", range(len(LOW_TEXTURE)))
+def test_low_texture_photo_has_no_duplicate(i):
+    others = LOW_TEXTURE[:i] + LOW_TEXTURE[i + 1 :]
+    scores = [score for _, score in index_of(others).search(*photo_features(LOW_TEXTURE[i]))]
+    assert all(score <= 1.0 for score in scores)
+
+
+def test_noisy_plate_matches_by_colour_not_hash():
+    # 파란 접시(연어)가 dHash 근접으로 빨간 접시(김치찌개)보다 앞서면 안 됨
+    salmon, kimchi_stew = plate((40, 70, 200)), plate((200, 60, 40))
+    hits = index_of([salmon, kimchi_stew]).search(*photo_features(plate((200, 60, 40))))  # 같은 음식의 다른 사진
+    assert [photo_id for photo_id, _ in hits] == [1]
+
+
+def test_reencoded_photo_is_duplicate():
+    original = textured(5)
+    smaller = jpeg(np.asarray(Image.open(io.BytesIO(original)).resize((500, 375))))
+    hits = index_of([textured(6), original]).search(*photo_features(smaller))
+    assert hits[0][0] == 1 and hits[0][1] > 1.0
@@ -0,0 +1,42 @@
+# RecognitionQueue: spawn 작업자가 __main__(스트림릿에서는 앱 스크립트)을 다시 실행하지 않는지
+
+import io
+import sys
+import time
+import types
+
+import numpy as np
+from PIL import Image
+
+from food_recognizer import RecognitionQueue
+
+
+def wait(queue: RecognitionQueue, key: str, source, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    status, result = queue.poll(key, source)
+    while status == "pending" and time.monotonic() < deadline:
+        time.sleep(0.05)
+        status, result = queue.poll(key, source)
+    return status, result
+
+
+def test_worker_does_not_run_app_script(tmp_path, monkeypatch):
+    # 스트림릿처럼 __file__ 이 앱 스크립트인 모듈을 __main__ 으로 설치. 실행되면 표시 파일을 남김
+    marker = tmp_path / "ran"
+    script = tmp_path / "app.py"
+    script.write_text(f"open({str(marker)!r}, 'w').close()\n", encoding="utf-8")
+    app_main = types.ModuleType("__main__")
+    app_main.__file__ = str(script)
+    monkeypatch.setitem(sys.modules, "__main__", app_main)
+
+    buf = io.BytesIO()
+    Image.fromarray(np.full((48, 64, 3), 120, dtype=np.uint8)).save(buf, "PNG")
+    queue = RecognitionQueue(workers=1)
+    try:
+        status, result = wait(queue, "photo", buf.getvalue())
+    finally:
+        queue.close()
+
+    assert status == "done" and result[1].shape == (64,)
+    assert not marker.exists()
+    assert sys.modules["__main__"] is app_main
@@ -9,36 +9,277 @@
 
 import os
 import io
+import hashlib
+import csv
 import math
-import base64
+import re
+import tempfile
+import atexit
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
 from datetime import datetime, date, time, timedelta
-from typing import List, Tuple, Optional, Dict
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+from typing import Any, Iterable, Iterator, List, Tuple, Optional, Dict
 
 import pandas as pd
 import numpy as np
 import streamlit as st
 import altair as alt
+from PIL import Image, ImageOps
 import sqlite3
 
+# Parquet 내보내기/가져오기용 (스트림릿 설치 시 함께 설치됨). 없으면 CSV만 사용
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
 APP_NAME = "PrediCare"
-DB_PATH = "data/health.db"
+DB_PATH = "data/health.db"  # 기본 사용자 샤드 (사용자 구분 이전의 단일 DB를 그대로 사용)
+REGISTRY_PATH = "data/users.db"  # 사용자 이름 → 개인 DB(샤드) 파일 목록
+SHARD_DIR = "data/users"
+DEFAULT_USER = "기본 사용자"
 IMG_DIR = "data/meal_photos"
+PHOTO_CHUNK = 256 * 1024  # 사진 업로드를 디스크로 옮길 때 한 번에 읽는 바이트 수
+PHOTO_EXTS = {".jpg": ".jpg", ".jpeg": ".jpg", ".png": ".png"}  # 같은 내용이 확장자 표기만 달라 두 번 저장되지 않도록 정규화
+THUMB_DIR = "data/meal_thumbs"
+THUMB_SIZES = {"small": 160, "medium": 640}  # 축소본 이름 → 긴 변 픽셀
+THUMB_FAILED_KEEP = 1024  # 축소본 생성에 실패한 사진(다시 시도하지 않음)을 기억해 둘 최대 개수
+GALLERY_PAGE_SIZE = 12  # 사진 기록 한 페이지에 보여줄 식단 수 (이 수만큼의 small 축소본만 전송)
+GALLERY_COLUMNS = 4
+DATE_COLUMNS = {"meals": "day", "activities": "day", "weights": "d", "daily_summary": "d"}  # 기간 조회 기준 열 (일 번호)
+SCHEMA_VERSION = 4  # PRAGMA user_version 으로 관리하는 마이그레이션 단계
+# 일시는 정수로 저장: dt = 1970-01-01 기준 epoch 초(벽시계 시각 그대로, 시간대 변환 없음), d/day = epoch 일 번호(dt // 86400)
+EPOCH = datetime(1970, 1, 1)
+EPOCH_UNITS = {"dt": "s", "d": "D", "day": "D"}  # 정수 열 → 조회 시 datetime64 로 바꿀 단위
+ITEM_SERVING_RE = re.compile(r"^(.*\S)\s+x(\d+(?:\.\d+)?)$")  # "닭가슴살 100g x1.5" → (음식명, 인분)
+
+# 일별 요약(daily_summary) 누적 갱신: 원본 INSERT와 같은 트랜잭션에서 실행
+SUMMARY_ADD_MEAL = """
+    INSERT INTO daily_summary(d, intake_kcal, carb_g) VALUES (?, ?, ?)
+    ON CONFLICT(d) DO UPDATE SET
+        intake_kcal = intake_kcal + excluded.intake_kcal,
+        carb_g = carb_g + excluded.carb_g
+"""
+SUMMARY_ADD_ACTIVITY = """
+    INSERT INTO daily_summary(d, burn_kcal, steps) VALUES (?, ?, ?)
+    ON CONFLICT(d) DO UPDATE SET
+        burn_kcal = burn_kcal + excluded.burn_kcal,
+        steps = CASE WHEN excluded.steps IS NULL THEN steps ELSE COALESCE(steps, 0) + excluded.steps END
+"""
+SUMMARY_SET_WEIGHT = """
+    INSERT INTO daily_summary(d, weight_kg) VALUES (?, ?)
+    ON CONFLICT(d) DO UPDATE SET weight_kg = excluded.weight_kg
+"""
+DB_POOL_SIZE = 8  # 유휴 상태로 보관할 최대 연결 수
+BULK_CHUNK = 1000  # 일괄 입력 시 한 번에 executemany 로 넘기는 행 수 (메모리는 이 크기만큼만 사용)
+IMPORT_CHUNK = 5000  # ZIP 가져오기 시 CSV를 읽는 행 단위
+EXPORT_TABLES = ("meals", "activities", "weights")
+PARQUET_ROW_GROUP = 65536  # Parquet 내보내기 시 한 번에 읽어 쓰는 행 수 (= row group 크기)
+# 가져오기 대상: 테이블 → (중복 판단 자연 키, 일괄 입력 레코드 열 순서). ZIP 안의 <테이블>.parquet 또는 <테이블>.csv
+IMPORT_SPECS = {
+    "meals": (("dt", "label", "items"), ("dt", "label", "items", "calories", "carbs_g", "photo_path")),
+    "activities": (("dt", "kind", "minutes"), ("dt", "kind", "minutes", "steps", "distance_km", "pace_kmh", "calories")),
+    "weights": (("d", "weight_kg"), ("d", "weight_kg")),
+}
+
+# 연결 생성 시 1회 적용. WAL: 읽기와 쓰기가 서로를 막지 않음 / NORMAL: WAL에서 안전한 수준의 fsync
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA foreign_keys=ON",
+)
 
 # ----------------------------- 유틸 & 초기화 ----------------------------- #
 
 def ensure_dirs():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    os.makedirs(SHARD_DIR, exist_ok=True)
     os.makedirs(IMG_DIR, exist_ok=True)
+    os.makedirs(THUMB_DIR, exist_ok=True)
+
+
+class ConnectionPool:
+    """스레드 인식 SQLite 연결 풀.
+
+    스트림릿은 세션마다 별도 스레드에서 스크립트를 실행한다. 한 스레드가 빌린 연결은 반납 전까지
+    그 스레드 전용이며(중첩 호출 시 같은 연결 재사용), 반납된 연결은 최대 `size`개까지 보관했다가
+    다음 요청에 재사용한다.
+    """
+
+    def __init__(self, path: str, size: int = DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        self._local = threading.local()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    def _release(self, conn: sqlite3.Connection):
+        # 커밋되지 않은 작업이 다음 사용자에게 넘어가지 않도록 정리
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
 
 
-def get_conn():
+@st.cache_resource(show_spinner=False)
+def get_pool(path: str = DB_PATH) -> ConnectionPool:
     ensure_dirs()
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    return conn
+    pool = ConnectionPool(path)
+    atexit.register(pool.close)
+    return pool
+
+
+# ----------------------------- 사용자별 샤드 ----------------------------- #
+# 사용자마다 SQLite 파일 하나(샤드)를 쓰므로 쓰기 잠금도 사용자별로 나뉜다. 어떤 사용자가 어느 파일을 쓰는지는
+# 작은 레지스트리 DB(REGISTRY_PATH)에 기록하고, 세션은 고른 사용자의 샤드 경로만 session_state 에 들고 있다.
+
+@st.cache_resource(show_spinner=False)
+def get_registry() -> ConnectionPool:
+    pool = get_pool(REGISTRY_PATH)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS users (name TEXT PRIMARY KEY, shard TEXT NOT NULL UNIQUE, created_at INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO users(name, shard, created_at) VALUES (?, ?, 0)", (DEFAULT_USER, DB_PATH))
+        conn.commit()
+    return pool
+
+
+def list_users() -> List[str]:
+    with get_registry().connection() as conn:
+        return [name for (name,) in conn.execute("SELECT name FROM users ORDER BY created_at, name")]
+
+
+def shard_for(user: str) -> str:
+    """사용자의 샤드 경로. 처음 보는 이름이면 SHARD_DIR 아래에 새 파일을 배정해 등록한다."""
+    with get_registry().connection() as conn:
+        row = conn.execute("SELECT shard FROM users WHERE name = ?", (user,)).fetchone()
+        if row is not None:
+            return row[0]
+        shard = os.path.join(SHARD_DIR, hashlib.sha1(user.encode("utf-8")).hexdigest()[:16] + ".db")
+        conn.execute("INSERT OR IGNORE INTO users(name, shard, created_at) VALUES (?, ?, ?)", (user, shard, to_epoch(datetime.now())))
+        conn.commit()
+        return conn.execute("SELECT shard FROM users WHERE name = ?", (user,)).fetchone()[0]
+
+
+def current_shard() -> str:
+    # 이 세션이 고른 사용자의 샤드 (고르기 전에는 기본 사용자)
+    return st.session_state.get("shard", DB_PATH)
+
+
+@st.cache_resource(show_spinner=False)
+def open_shard(path: str) -> ConnectionPool:
+    """샤드의 연결 풀 (샤드마다 하나). 프로세스에서 처음 열 때 테이블 생성/마이그레이션을 실행한다."""
+    pool = get_pool(path)
+    with pool.connection() as conn:
+        _create_tables(conn)
+        _migrate(conn)
+        _create_indexes(conn)
+    return pool
+
 
+@contextmanager
+def get_conn(path: Optional[str] = None):
+    with open_shard(path or current_shard()).connection() as conn:
+        yield conn
 
-def init_db():
-    conn = get_conn()
+
+def init_db(path: Optional[str] = None):
+    open_shard(path or current_shard())
+
+
+# 일시 열이 있는 테이블 DDL ({name}: 마이그레이션 시 임시 테이블 이름으로도 사용). day 는 dt 에서 계산되는 생성 열
+TIMESTAMP_TABLE_DDL = {
+    "meals": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dt INTEGER,
+            label TEXT,
+            items TEXT,
+            calories REAL,
+            carbs_g REAL,
+            photo_path TEXT,
+            day INTEGER GENERATED ALWAYS AS (dt / 86400) VIRTUAL
+        )
+    """,
+    "activities": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dt INTEGER,
+            kind TEXT,
+            minutes REAL,
+            steps INTEGER,
+            distance_km REAL,
+            pace_kmh REAL,
+            calories REAL,
+            day INTEGER GENERATED ALWAYS AS (dt / 86400) VIRTUAL
+        )
+    """,
+    "weights": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            d INTEGER,
+            weight_kg REAL
+        )
+    """,
+    "daily_summary": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            d INTEGER PRIMARY KEY,
+            intake_kcal REAL NOT NULL DEFAULT 0,
+            carb_g REAL NOT NULL DEFAULT 0,
+            burn_kcal REAL NOT NULL DEFAULT 0,
+            steps INTEGER,
+            weight_kg REAL
+        )
+    """,
+}
+
+
+def _create_tables(conn: sqlite3.Connection):
     cur = conn.cursor()
     cur.execute(
         """
@@ -55,627 +296,391 @@ def init_db():
         )
         """
     )
+    for table in ("meals", "activities", "weights"):
+        cur.execute(TIMESTAMP_TABLE_DDL[table].format(name=table))
+    # 식단 항목: meals.items 문자열을 음식 단위로 정규화 (음식별 빈도/탄수화물 공급원 집계용)
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS meals (
+        CREATE TABLE IF NOT EXISTS foods (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            dt TEXT,
-            label TEXT,
-            items TEXT,
-            calories REAL,
-            carbs_g REAL,
-            photo_path TEXT
+            name TEXT NOT NULL UNIQUE,
+            kcal REAL,
+            carb_g REAL
         )
         """
     )
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS activities (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            dt TEXT,
-            kind TEXT,
-            minutes REAL,
-            steps INTEGER,
-            distance_km REAL,
-            pace_kmh REAL,
-            calories REAL
+        CREATE TABLE IF NOT EXISTS meal_items (
+            meal_id INTEGER NOT NULL REFERENCES meals(id) ON DELETE CASCADE,
+            food_id INTEGER NOT NULL REFERENCES foods(id),
+            servings REAL NOT NULL DEFAULT 1
         )
         """
     )
+    cur.execute(TIMESTAMP_TABLE_DDL["daily_summary"].format(name="daily_summary"))
+    # 사진 인식용 식단 사진 특징 (food_recognizer.photo_features: dHash + float32 색 분포 BLOB)
     cur.execute(
         """
-        CREATE TABLE IF NOT EXISTS weights (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            d TEXT,
-            weight_kg REAL
+        CREATE TABLE IF NOT EXISTS photo_features (
+            meal_id INTEGER PRIMARY KEY REFERENCES meals(id) ON DELETE CASCADE,
+            dhash INTEGER NOT NULL,
+            vec BLOB NOT NULL
         )
         """
     )
     conn.commit()
 
 
-@st.cache_data(show_spinner=False)
-def load_df(table: str) -> pd.DataFrame:
-    conn = get_conn()
-    return pd.read_sql_query(f"SELECT * FROM {table}", conn)
-
-
-def refresh_cache():
-    load_df.clear()
-
-
-# ----------------------------- 계산 로직 ----------------------------- #
-
-def bmr_mifflin(weight_kg: float, height_cm: float, age: int, sex: str) -> float:
-    s = 5 if sex.lower().startswith("m") else -161
-    return 10 * weight_kg + 6.25 * height_cm - 5 * age + s
-
-
-def tdee_from_activity(bmr: float, activity_level: str) -> float:
-    factors = {"낮음": 1.2, "보통": 1.375, "활동적": 1.55, "매우 활동적": 1.725}
-    return bmr * factors.get(activity_level, 1.375)
-
-
-def walking_met(pace_kmh: float) -> float:
-    if pace_kmh <= 3.5: return 3.0
-    if pace_kmh <= 4.5: return 3.8
-    if pace_kmh <= 5.5: return 4.8
-    if pace_kmh <= 6.4: return 6.0
-    return 6.5
-
-
-def kcal_from_met(met: float, weight_kg: float, minutes: float) -> float:
-    return met * 3.5 * weight_kg / 200 * minutes
-
-
-# ----------------------------- 내장 음식 DB (API 없이 계산) ----------------------------- #
-# 1인분 기준 칼로리/탄수화물(g) 간이치. 필요시 자유롭게 확장하세요.
-FOOD_DB: Dict[str, Dict[str, float]] = {
-    # 곡류/밥
-    "현미밥 1/2공기(100g)": {"kcal": 150, "carb": 33},
-    "현미밥 1공기(200g)": {"kcal": 300, "carb": 66},
-    "잡곡밥 1공기": {"kcal": 320, "carb": 68},
-    "곤약밥 1공기": {"kcal": 180, "carb": 40},
-    # 단백질
-    "닭가슴살 100g": {"kcal": 165, "carb": 0},
-    "두부 100g": {"kcal": 80, "carb": 2},
-    "계란 1개": {"kcal": 70, "carb": 0.6},
-    "연어 120g": {"kcal": 240, "carb": 0},
-    "고등어 120g": {"kcal": 250, "carb": 0},
-    # 채소/샐러드
-    "샐러드(채소) 1접시": {"kcal": 60, "carb": 8},
-    "찐브로콜리 1접시": {"kcal": 55, "carb": 11},
-    "시금치나물 1접시": {"kcal": 70, "carb": 7},
-    # 곡/면 대체
-    "곤약면 1인분": {"kcal": 25, "carb": 2},
-    "현미국수 1인분": {"kcal": 380, "carb": 78},
-    # 간식/유제품/견과
-    "플레인 요거트 150g": {"kcal": 95, "carb": 11},
-    "아몬드 25g": {"kcal": 145, "carb": 5},
-    "방울토마토 10개": {"kcal": 30, "carb": 7},
-    # 과일(소량)
-    "사과 1/2개": {"kcal": 50, "carb": 14},
-    "바나나 1/2개": {"kcal": 45, "carb": 12},
-    # 조미/지방(선택)
-    "올리브오일 1작은술": {"kcal": 40, "carb": 0},
-}
-
-TEMPLATES = {
-    "아침(예시)": ["현미밥 1/2공기(100g)", "계란 1개", "샐러드(채소) 1접시", "두부 100g"],
-    "점심(예시)": ["곤약면 1인분", "닭가슴살 100g", "샐러드(채소) 1접시", "올리브오일 1작은술"],
-    "저녁(예시)": ["연어 120g", "찐브로콜리 1접시", "두부 100g"],
-    "간식(예시)": ["플레인 요거트 150g", "아몬드 25g"],
-}
-
-
-def compute_nutrition(selected: List[str], servings: Dict[str, float]) -> Tuple[float, float]:
-    kcal = 0.0
-    carb = 0.0
-    for item in selected:
-        base = FOOD_DB.get(item, {"kcal": 0, "carb": 0})
-        s = servings.get(item, 1.0)
-        kcal += base["kcal"] * s
-        carb += base["carb"] * s
-    return kcal, carb
-
-
-# ----------------------------- DB 헬퍼 ----------------------------- #
-
-def upsert_profile(**kwargs):
-    conn = get_conn()
+def _create_indexes(conn: sqlite3.Connection):
+    # 마이그레이션(열 타입 변경) 이후에 생성해야 하므로 테이블 생성과 분리
     cur = conn.cursor()
-    cur.execute("SELECT id FROM profile WHERE id = 1")
-    exists = cur.fetchone() is not None
-    cols = [k for k in kwargs.keys()]
-    vals = [kwargs[k] for k in cols]
-    if exists:
-        set_clause = ", ".join([f"{c} = ?" for c in cols])
-        cur.execute(f"UPDATE profile SET {set_clause} WHERE id = 1", vals)
-    else:
-        col_clause = ", ".join(cols)
-        q = ",".join(["?"] * len(cols))
-        cur.execute(f"INSERT INTO profile(id, {col_clause}) VALUES (1, {q})", vals)
+    # 기간 조회(query_df)는 day/d, 가져오기 중복 확인은 dt/d 로 범위 검색
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meals_dt ON meals(dt)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meals_day ON meals(day)")
+    # 사진 기록 페이지 조회용 (사진이 있는 식단만 담는 부분 인덱스)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meals_photo ON meals(dt) WHERE photo_path IS NOT NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_activities_dt ON activities(dt)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_activities_day ON activities(day)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_weights_d ON weights(d)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meal_items_meal ON meal_items(meal_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meal_items_food ON meal_items(food_id)")
     conn.commit()
-    refresh_cache()
 
 
-def insert_meal(dt: datetime, label: str, items: str, calories: float, carbs_g: float, photo_path: Optional[str]):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO meals(dt, label, items, calories, carbs_g, photo_path) VALUES (?,?,?,?,?,?)",
-        (dt.isoformat(), label, items, calories, carbs_g, photo_path),
-    )
+def _migrate(conn: sqlite3.Connection):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    if version < 2:
+        rebuild_meal_items(conn)
+    if version < 3:
+        _migrate_epoch_columns(conn)  # daily_summary 재계산 포함 (v1 단계 대체)
+    if version < 4:
+        conn.execute("DELETE FROM photo_features")  # v4: dHash 계산 방식 변경 → 예전 특징은 버리고 다시 색인
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
-    refresh_cache()
 
 
-def insert_activity(dt: datetime, kind: str, minutes: float, steps: Optional[int], distance_km: Optional[float], pace_kmh: Optional[float], calories: float):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO activities(dt, kind, minutes, steps, distance_km, pace_kmh, calories) VALUES (?,?,?,?,?,?,?)",
-        (dt.isoformat(), kind, minutes, steps, distance_km, pace_kmh, calories),
-    )
+def _migrate_epoch_columns(conn: sqlite3.Connection):
+    # v3: ISO 문자열 일시/날짜 → 정수 epoch 초/일 번호.
+    # SQLite는 열 타입을 바꿀 수 없으므로 새 테이블에 변환해 옮긴 뒤 교체 (id 유지 → meal_items 그대로 유효)
+    copies = {
+        "meals": "SELECT id, CAST(strftime('%s', dt) AS INTEGER), label, items, calories, carbs_g, photo_path FROM meals",
+        "activities": "SELECT id, CAST(strftime('%s', dt) AS INTEGER), kind, minutes, steps, distance_km, pace_kmh, calories FROM activities",
+        "weights": "SELECT id, CAST(strftime('%s', d) AS INTEGER) / 86400, weight_kg FROM weights",
+    }
+    columns = {
+        "meals": "id, dt, label, items, calories, carbs_g, photo_path",
+        "activities": "id, dt, kind, minutes, steps, distance_km, pace_kmh, calories",
+        "weights": "id, d, weight_kg",
+    }
+    decl = {name: typ for _, name, typ, *_ in conn.execute("PRAGMA table_info(meals)")}
+    if decl.get("dt", "").upper() == "INTEGER":  # 새로 만든 DB는 이미 v3 형식
+        rebuild_daily_summary(conn)
+        return
     conn.commit()
-    refresh_cache()
-
-
-def insert_weight(d: date, weight_kg: float):
-    conn = get_conn()
+    conn.execute("PRAGMA foreign_keys=OFF")  # meals 교체 중 meal_items 가 CASCADE 로 지워지지 않도록 (트랜잭션 밖에서만 변경 가능)
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        for table, select in copies.items():
+            cur.execute(TIMESTAMP_TABLE_DDL[table].format(name=f"{table}_v3"))
+            cur.execute(f"INSERT INTO {table}_v3({columns[table]}) {select}")
+            cur.execute(f"DROP TABLE {table}")
+            cur.execute(f"ALTER TABLE {table}_v3 RENAME TO {table}")
+        cur.execute("DROP TABLE daily_summary")
+        cur.execute(TIMESTAMP_TABLE_DDL["daily_summary"].format(name="daily_summary"))
+        rebuild_daily_summary(conn)  # commit 포함
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
+
+
+def rebuild_daily_summary(conn: sqlite3.Connection):
+    # 기존 기록 전체로 일별 요약을 다시 계산 (최초 마이그레이션/복구용)
     cur = conn.cursor()
-    cur.execute("INSERT INTO weights(d, weight_kg) VALUES (?,?)", (d.isoformat(), weight_kg))
-    conn.commit()
-    refresh_cache()
-
-
-# ----------------------------- 스트림릿 UI ----------------------------- #
-
-st.set_page_config(page_title=f"{APP_NAME}", page_icon="🍎", layout="wide")
-init_db()
-
-st.title("🍎 PrediCare — 걷기 기반 당뇨 전단계 체중 관리")
-st.caption("*개인 건강 참고용 도구입니다. 의학적 진단/치료를 대체하지 않습니다.*")
-
-with st.sidebar:
-    st.header("프로필 & 목표")
-    today = date.today()
-    default_birth_year = today.year - 52
-
-    col1, col2 = st.columns(2)
-    with col1:
-        birth_year = st.number_input("출생연도", min_value=1930, max_value=today.year, value=default_birth_year, step=1)
-    with col2:
-        sex = st.selectbox("성별", ["여성", "남성"], index=0)
-
-    height_cm = st.number_input("키 (cm)", min_value=120.0, max_value=210.0, value=160.0, step=0.5)
-    weight_kg = st.number_input("현재 체중 (kg)", min_value=35.0, max_value=200.0, value=65.0, step=0.1)
-    target_weight_kg = st.number_input("목표 체중 (kg)", min_value=35.0, max_value=200.0, value=60.0, step=0.1)
-
-    activity_level = st.select_slider("평소 활동량", options=["낮음", "보통", "활동적", "매우 활동적"], value="보통")
-    knee_care = st.checkbox("무릎 보호 모드 (전방십자인대 수술 이력)", value=True)
-
-    age = today.year - int(birth_year)
-    bmr = bmr_mifflin(weight_kg, height_cm, age, sex)
-    tdee = tdee_from_activity(bmr, activity_level)
-
-    st.write(f"BMR(기초대사량): **{int(bmr)}** kcal/일")
-    st.write(f"TDEE(유지 칼로리): **{int(tdee)}** kcal/일")
-
-    deficit = 300
-    daily_calorie_target = int(max(1200, tdee - deficit))
-    daily_carb_target_g = 150
-
-    st.write(f"권장 섭취열량: **{daily_calorie_target} kcal/일** (약 -{deficit} kcal)")
-    st.write(f"권장 탄수화물: **{daily_carb_target_g} g/일**")
-
-    if st.button("목표 저장/업데이트"):
-        upsert_profile(
-            birth_year=birth_year,
-            sex=sex,
-            height_cm=height_cm,
-            weight_kg=weight_kg,
-            target_weight_kg=target_weight_kg,
-            daily_calorie_target=daily_calorie_target,
-            daily_carb_target_g=daily_carb_target_g,
-            knee_care=1 if knee_care else 0,
-        )
-        st.success("프로필이 저장되었습니다.")
-
-# 탭 구성
-TAB1, TAB2, TAB3 = st.tabs(["오늘 기록", "통계", "가이드"])
-
-# ----------------------------- 탭: 오늘 기록 ----------------------------- #
-with TAB1:
-    st.subheader("📸 식단 기록 (사진 업로드 / 내장 DB 자동계산 / 수동 입력)")
-
-    col_a, col_b = st.columns([1, 1])
-    with col_a:
-        meal_label = st.selectbox("식사 구분", ["아침", "점심", "저녁", "간식"])
-
-        # 시간: 선택 + 직접 입력(HH:MM)
-        meal_time_select = st.time_input("섭취 시간(선택)", value=datetime.now().time())
-        meal_time_text = st.text_input("섭취 시간 직접 입력(HH:MM)", value="")
-        def _parse_time(txt: str) -> Optional[time]:
-            try:
-                if not txt: return None
-                hh, mm = txt.strip().split(":")
-                return time(hour=int(hh), minute=int(mm))
-            except Exception:
-                return None
-        meal_time = _parse_time(meal_time_text) or meal_time_select
-
-        uploaded = st.file_uploader("음식 사진 업로드 (선택)", type=["jpg", "jpeg", "png"], help="사진은 기록/미리보기 용도입니다. API 없이 자동 인식은 불가합니다.")
-
-        st.markdown("**방법 A. 내장 음식 DB로 자동 계산(권장, API 불필요)**")
-        selected_items = st.multiselect("음식 선택", options=sorted(FOOD_DB.keys()))
-
-        servings = {}
-        if selected_items:
-            st.write("인분/분량 조정")
-            for it in selected_items:
-                servings[it] = st.number_input(f"{it} x", min_value=0.0, max_value=10.0, value=1.0, step=0.25, key=f"srv_{it}")
-        kcal_auto, carb_auto = compute_nutrition(selected_items, servings)
-        st.info(f"자동 계산 결과 → 칼로리: **{int(kcal_auto)} kcal**, 탄수화물: **{int(carb_auto)} g**")
-
-        st.markdown("**방법 B. 직접 입력(라벨/앱 참조값)**")
-        items_text = st.text_area("음식 항목 (쉼표로 구분)", placeholder="예: 현미밥 1/2공기, 닭가슴살 100g, 샐러드, 두부 100g")
-        calories = st.number_input("총 칼로리(kcal)", min_value=0.0, max_value=5000.0, value=float(kcal_auto), step=10.0)
-        carbs_g = st.number_input("총 탄수화물(g)", min_value=0.0, max_value=1000.0, value=float(carb_auto), step=1.0)
-
-        # 템플릿 불러오기
-        st.markdown("**빠른 입력: 예시 식단 템플릿**")
-        tcol1, tcol2, tcol3, tcol4 = st.columns(4)
-        if tcol1.button("아침(예시) 불러오기"):
-            items_text = ", ".join(TEMPLATES["아침(예시)"])
-            st.session_state["_tmp_items_text"] = items_text
-        if tcol2.button("점심(예시) 불러오기"):
-            items_text = ", ".join(TEMPLATES["점심(예시)"])
-            st.session_state["_tmp_items_text"] = items_text
-        if tcol3.button("저녁(예시) 불러오기"):
-            items_text = ", ".join(TEMPLATES["저녁(예시)"])
-            st.session_state["_tmp_items_text"] = items_text
-        if tcol4.button("간식(예시) 불러오기"):
-            items_text = ", ".join(TEMPLATES["간식(예시)"])
-            st.session_state["_tmp_items_text"] = items_text
-        # 버튼으로 채운 텍스트 반영
-        if st.session_state.get("_tmp_items_text"):
-            items_text = st.session_state["_tmp_items_text"]
-            st.text_area("템플릿 적용됨", items_text, key="items_text_applied")
-            # 템플릿 영양 자동 계산
-            servings_tmp = {it:1.0 for it in items_text.split(", ") if it in FOOD_DB}
-            kcal_t, carb_t = compute_nutrition(list(servings_tmp.keys()), servings_tmp)
-            calories = kcal_t
-            carbs_g = carb_t
-            st.info(f"템플릿 자동 계산 → {int(kcal_t)} kcal / {int(carb_t)} g")
-
-        if st.button("식단 저장"):
-            # 이미지 저장
-            photo_path = None
-            if uploaded is not None:
-                ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                ext = os.path.splitext(uploaded.name)[1].lower()
-                photo_path = os.path.join(IMG_DIR, f"meal_{ts}{ext}")
-                with open(photo_path, "wb") as f:
-                    f.write(uploaded.getvalue())
-
-            # 저장할 항목 문자열 구성(선택+수동 합침)
-            auto_items_str = ", ".join([f"{k} x{servings.get(k,1)}" for k in selected_items])
-            items_final = ", ".join([s for s in [auto_items_str, items_text.strip()] if s])
-            # 시간 합성
-            dt = datetime.combine(date.today(), meal_time)
-            insert_meal(dt, meal_label, items_final, float(calories), float(carbs_g), photo_path)
-            st.success("식단이 저장되었습니다.")
-
-    with col_b:
-        st.write("오늘 입력된 식단")
-        meals_df = load_df("meals")
-        if not meals_df.empty:
-            meals_df["date"] = pd.to_datetime(meals_df["dt"]).dt.date
-            today_df = meals_df[meals_df["date"] == date.today()]
-            if today_df.empty:
-                st.info("아직 오늘 식단 기록이 없습니다.")
-            else:
-                st.dataframe(
-                    today_df[["dt", "label", "items", "calories", "carbs_g"]]
-                    .rename(columns={"dt": "시간", "label": "구분", "items": "항목", "calories": "kcal", "carbs_g": "탄수(g)"})
-                    .sort_values("시간"),
-                    use_container_width=True,
-                )
-        else:
-            st.info("아직 식단 데이터가 없습니다.")
-
-    st.markdown("---")
-    st.subheader("🚶 걷기 기록")
-
-    col1, col2, col3, col4 = st.columns(4)
-    with col1:
-        minutes = st.number_input("운동 시간(분)", min_value=0.0, max_value=600.0, value=30.0, step=5.0)
-    with col2:
-        distance_km = st.number_input("거리(km) (선택)", min_value=0.0, max_value=50.0, value=0.0, step=0.1)
-    with col3:
-        steps = st.number_input("걸음수 (선택)", min_value=0, max_value=100000, value=0, step=100)
-    with col4:
-        pace_kmh = st.number_input("평균 속도(km/h) (선택)", min_value=0.0, max_value=12.0, value=4.5, step=0.1)
-
-    if pace_kmh and minutes and distance_km == 0:
-        distance_km = pace_kmh * (minutes / 60)
-    if distance_km and minutes and pace_kmh == 0:
-        pace_kmh = (distance_km / (minutes / 60)) if minutes > 0 else 0
-
-    met = walking_met(pace_kmh if pace_kmh > 0 else 4.0)
-    kcal = kcal_from_met(met, weight_kg, minutes)
-    st.write(f"예상 소모 칼로리: **{int(kcal)} kcal** (MET {met:.1f})")
-
-    if st.button("걷기 저장"):
-        dt = datetime.now()
-        insert_activity(dt, "걷기", float(minutes), int(steps) if steps else None, float(distance_km) if distance_km else None, float(pace_kmh) if pace_kmh else None, float(kcal))
-        st.success("운동이 저장되었습니다.")
-
-    st.markdown("---")
-    st.subheader("⚖️ 체중 기록")
-    wcol1, wcol2 = st.columns([1,1])
-    with wcol1:
-        weight_input = st.number_input("오늘 체중 (kg)", min_value=30.0, max_value=250.0, value=float(weight_kg), step=0.1)
-    with wcol2:
-        if st.button("체중 저장"):
-            insert_weight(date.today(), float(weight_input))
-            st.success("체중이 저장되었습니다.")
-
-# ----------------------------- 탭: 통계 ----------------------------- #
-with TAB2:
-    st.subheader("📈 추이 시각화")
-    meals_df = load_df("meals")
-    acts_df = load_df("activities")
-    w_df = load_df("weights")
-
-    if not meals_df.empty:
-        meals_df["d"] = pd.to_datetime(meals_df["dt"]).dt.date
-        kcal_by_day = meals_df.groupby("d")["calories"].sum().reset_index().rename(columns={"calories": "intake_kcal"})
-        carb_by_day = meals_df.groupby("d")["carbs_g"].sum().reset_index().rename(columns={"carbs_g": "carb_g"})
-    else:
-        kcal_by_day = pd.DataFrame(columns=["d", "intake_kcal"]) 
-        carb_by_day = pd.DataFrame(columns=["d", "carb_g"]) 
-
-    if not acts_df.empty:
-        acts_df["d"] = pd.to_datetime(acts_df["dt"]).dt.date
-        out_kcal = acts_df.groupby("d")["calories"].sum().reset_index().rename(columns={"calories": "burn_kcal"})
-        steps_by_day = acts_df.groupby("d")["steps"].sum(min_count=1).reset_index().rename(columns={"steps": "steps"})
-    else:
-        out_kcal = pd.DataFrame(columns=["d", "burn_kcal"]) 
-        steps_by_day = pd.DataFrame(columns=["d", "steps"]) 
-
-    daily = pd.merge(kcal_by_day, out_kcal, on="d", how="outer")
-    daily = pd.merge(daily, carb_by_day, on="d", how="outer")
-    if not w_df.empty:
-        w_df["d"] = pd.to_datetime(w_df["d"]).dt.date
-        daily = pd.merge(daily, w_df[["d", "weight_kg"]], on="d", how="outer")
-
-    daily = daily.sort_values("d")
-    daily_calorie_target_line = load_df("profile")["daily_calorie_target"].iloc[0] if not load_df("profile").empty else 0
-    daily_carb_target_line = load_df("profile")["daily_carb_target_g"].iloc[0] if not load_df("profile").empty else 0
-
-    daily_fill = daily.fillna({"intake_kcal":0, "burn_kcal":0, "carb_g":0})
-
-    if daily_fill.empty:
-        st.info("아직 통계에 표시할 데이터가 없습니다. '오늘 기록'에서 식단/운동/체중을 입력해 주세요.")
-    else:
-        c1, c2 = st.columns(2)
-        with c1:
-            st.write("체중 추이 (kg)")
-            if "weight_kg" in daily_fill.columns and daily_fill["weight_kg"].notna().any():
-                chart_w = alt.Chart(daily_fill.dropna(subset=["weight_kg"])) \
-                    .mark_line(point=True) \
-                    .encode(x=alt.X("d:T", title="날짜"), y=alt.Y("weight_kg:Q", title="체중(kg)"))
-                st.altair_chart(chart_w, use_container_width=True)
-            else:
-                st.info("체중 데이터가 아직 없습니다.")
-
-        with c2:
-            st.write("칼로리 섭취/소모")
-            melt = daily_fill.melt(id_vars=["d"], value_vars=["intake_kcal", "burn_kcal"], var_name="type", value_name="kcal")
-            chart_c = alt.Chart(melt).mark_bar().encode(
-                x=alt.X("d:T", title="날짜"),
-                y=alt.Y("kcal:Q", title="kcal"),
-                color="type:N",
-                tooltip=["d:T", "type:N", "kcal:Q"],
-            )
-            st.altair_chart(chart_c, use_container_width=True)
-
-        st.write("일일 탄수화물(g)")
-        chart_carbs = alt.Chart(daily_fill).mark_line(point=True).encode(
-            x=alt.X("d:T", title="날짜"),
-            y=alt.Y("carb_g:Q", title="탄수화물(g)"),
-        )
-        if daily_carb_target_line:
-            rule = alt.Chart(pd.DataFrame({"y": [daily_carb_target_line]})).mark_rule().encode(y="y:Q")
-            st.altair_chart(chart_carbs + rule, use_container_width=True)
-        else:
-            st.altair_chart(chart_carbs, use_container_width=True)
-
-        st.write("일일 걸음수")
-        if not steps_by_day.empty and steps_by_day["steps"].notna().any():
-            chart_s = alt.Chart(steps_by_day.fillna({"steps":0})).mark_bar().encode(
-                x=alt.X("d:T", title="날짜"),
-                y=alt.Y("steps:Q", title="걸음수"),
-            )
-            st.altair_chart(chart_s, use_container_width=True)
-        else:
-            st.info("걸음수 데이터가 아직 없습니다.")
-
-# ----------------------------- 탭: 가이드 ----------------------------- #
-with TAB3:
-    st.subheader("🥗 식단 가이드 (당뇨 전단계 & 갱년기 친화)")
-    st.markdown(
-        """
-        - 하루 3끼 + 필요 시 간식 1회, 식사 간격 3~4시간 권장
-        - 현미/잡곡, 채소, 단백질(생선·두부·계란·닭가슴살), 견과류 중심의 균형
-        - 정제 탄수화물·설탕·달콤한 음료 최소화, 과일은 1~2회/일 소량
-        - 탄수화물 목표: 약 150 g/일부터 시작해 반응(공복/식후 혈당, 체중)에 맞춰 조정
-
-        **예시 식단표** (각 400~600 kcal 범위에서 조정)
-        - 아침: 현미밥 1/2공기 + 달걀 1개 + 샐러드 + 두부 100g
-        - 점심: 곤약/현미국수 + 닭가슴살 100~120g + 샐러드 + 올리브오일 드레싱
-        - 저녁: 생선(연어/고등어) 120g + 찐브로콜리/시금치 + 두부/콩류 소량
-        - 간식(선택): 플레인 요거트 + 아몬드 한 줌(20~25g) 또는 방울토마토
-
-        💡 외식/반찬 팁: 밥 양 반공기부터, 국물은 건더기 위주, 튀김/전은 적게, 소스는 따로.
-        """
-    )
-
-    st.subheader("🚶 걷기 운동 가이드 (무릎 친화)")
-    st.markdown(
+    cur.execute("DELETE FROM daily_summary")
+    cur.execute(
         """
-        - 목표: 주 5일, 회당 30~45분 빠른 걷기(평지 위주). 통증 3/10 이하 유지.
-        - 속도: 편안한 대화가 가능한 4.0~5.0 km/h부터 시작, 점진적 증가.
-        - 신발: 쿠셔닝 좋은 워킹화, 경사/계단/러닝/스쿼트 회피.
-        - 보강: 2~3일/주 둔근·햄스트링·종아리 가벼운 근지구력(통증 없는 범위, 밴드/체중 저항)
-        - 준비/마무리: 5~10분 워밍업/쿨다운 + 종아리/햄스트링 스트레칭.
+        WITH src AS (
+            SELECT day AS d, calories AS intake_kcal, carbs_g AS carb_g, 0 AS burn_kcal, NULL AS steps FROM meals
+            UNION ALL
+            SELECT day, 0, 0, calories, steps FROM activities
+            UNION ALL
+            SELECT d, 0, 0, 0, NULL FROM weights
+        )
+        INSERT INTO daily_summary(d, intake_kcal, carb_g, burn_kcal, steps, weight_kg)
+        SELECT
+            d,
+            COALESCE(SUM(intake_kcal), 0),
+            COALESCE(SUM(carb_g), 0),
+            COALESCE(SUM(burn_kcal), 0),
+            SUM(steps),
+            (SELECT w.weight_kg FROM weights w WHERE w.d = src.d ORDER BY w.id DESC LIMIT 1)
+        FROM src
+        GROUP BY d
         """
     )
+    conn.commit()
 
-    st.info("혈당·체중 반응은 개인차가 큽니다. 이상 증상 시 전문의와 상의하세요.")
 
-# ----------------------------- 추가: 내보내기/가져오기 ----------------------------- #
-with st.expander("데이터 내보내기/가져오기"):
-    export_btn = st.button("CSV로 내보내기(zip)")
-    if export_btn:
-        meals = load_df("meals")
-        acts = load_df("activities")
-        weights = load_df("weights")
-        from zipfile import ZipFile
-        zip_path = "data/export_predicare.zip"
-        with ZipFile(zip_path, 'w') as zf:
-            meals.to_csv("data/meals.csv", index=False)
-            acts.to_csv("data/activities.csv", index=False)
-            weights.to_csv("data/weights.csv", index=False)
-            zf.write("data/meals.csv", arcname="meals.csv")
-            zf.write("data/activities.csv", arcname="activities.csv")
-            zf.write("data/weights.csv", arcname="weights.csv")
-        with open(zip_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode()
-        href = f'<a download="predicare_export.zip" href="data:file/zip;base64,{b64}">ZIP 다운로드</a>'
-        st.markdown(href, unsafe_allow_html=True)
+def parse_items(items_text: str) -> List[Tuple[str, float]]:
+    """'현미밥 1/2공기(100g) x1.5, 두부 100g' → [(음식명, 인분)]. 'xN' 표기가 없으면 1인분."""
+    pairs = []
+    for part in items_text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        m = ITEM_SERVING_RE.match(part)
+        pairs.append((m.group(1), float(m.group(2))) if m else (part, 1.0))
+    return pairs
 
-    st.markdown("**주의**: 브라우저/실행 환경에 따라 파일 저장 경로가 달라질 수 있습니다.")
 
-# ----------------------------- requirements 안내 ----------------------------- #
-with st.expander("requirements.txt 예시"):
-    st.code(
-        """
-        streamlit
-        altair
-        pandas
-        numpy
-        pillow
-        """.strip(), language="text")
-# PrediCare: 스트림릿 개인 체중·혈당 관리 앱 (이미지 식단 기록 + 걷기 중심 운동)
-# --------------------------------------------------------------
-# 변경 내역 (2025-10-23)
-# - ✅ API 없이도 동작하는 "내장 음식 DB 기반 자동 칼로리/탄수화물 계산" 추가
-# - ✅ "식단 템플릿 불러오기" 버튼(가이드 식단표 바로 채우기)
-# - ✅ 섭취 시간: 선택(time_input) + 직접 입력(HH:MM) 모두 지원
-# - ⚠️ 사진만으로 자동 인식은 외부 AI/비전 API 없이는 불가 → 대신 사진 첨부 + 음식 선택으로 계산
-# --------------------------------------------------------------
+def _insert_meal_items(cur: sqlite3.Cursor, meals: Iterable[Tuple[int, Optional[str]]]):
+    # [(meal_id, items 문자열)] → meal_items. 호출 측 트랜잭션 안에서 실행 (commit 하지 않음)
+    rows = [(meal_id, servings, name) for meal_id, items in meals for name, servings in parse_items(items or "")]
+    if not rows:
+        return
+    cur.executemany("INSERT INTO foods(name) VALUES (?) ON CONFLICT(name) DO NOTHING", [(name,) for _, _, name in rows])
+    cur.executemany("INSERT INTO meal_items(meal_id, food_id, servings) SELECT ?, id, ? FROM foods WHERE name = ?", rows)
 
-import os
-import io
-import math
-import base64
-from datetime import datetime, date, time, timedelta
-from typing import List, Tuple, Optional, Dict
 
-import pandas as pd
-import numpy as np
-import streamlit as st
-import altair as alt
-import sqlite3
+def rebuild_meal_items(conn: sqlite3.Connection):
+    # 기존 meals.items 문자열을 파싱해 meal_items를 다시 채움 (마이그레이션/복구용)
+    cur = conn.cursor()
+    cur.execute("DELETE FROM meal_items")
+    _insert_meal_items(cur, conn.execute("SELECT id, items FROM meals ORDER BY id").fetchall())
+    conn.commit()
 
-APP_NAME = "PrediCare"
-DB_PATH = "data/health.db"
-IMG_DIR = "data/meal_photos"
 
-# ----------------------------- 유틸 & 초기화 ----------------------------- #
+def to_epoch(value: Any) -> int:
+    """datetime / date / ISO 문자열 → epoch 초 (정수는 그대로)."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    elif not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return (value - EPOCH) // timedelta(seconds=1)
+
+
+def to_day(value: Any) -> int:
+    """date / datetime / ISO 문자열 → epoch 일 번호 (정수는 그대로)."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return to_epoch(value) // 86400
+
+
+def with_datetimes(df: pd.DataFrame) -> pd.DataFrame:
+    # 정수 일시/일 번호 열을 datetime64 로 한 번에 변환 (행마다 파이썬 객체를 만들지 않음)
+    for col, unit in EPOCH_UNITS.items():
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], unit=unit)
+    return df
+
+
+class TableCache:
+    """테이블별 버전 캐시.
+
+    테이블마다 버전 번호와 (행 수, 최대 id) 워터마크를 함께 보관한다. 쓰기 후 버전이 오르면
+    다음 조회에서 워터마크 이후의 행만 읽어 기존 프레임 뒤에 붙이고, 행 수가 맞지 않으면
+    (수정/삭제가 있었던 경우) 그 테이블만 전체를 다시 읽는다.
+    """
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._entries: Dict[str, Tuple[int, int, int, pd.DataFrame]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _lock(self, table: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(table, threading.Lock())
+
+    def version(self, table: str) -> int:
+        return self._versions.get(table, 0)
+
+    def bump(self, table: str, reload: bool = False):
+        with self._lock(table):
+            self._versions[table] = self.version(table) + 1
+            if reload:
+                self._entries.pop(table, None)
+
+    def get(self, conn: sqlite3.Connection, table: str) -> pd.DataFrame:
+        with self._lock(table):
+            version = self.version(table)
+            entry = self._entries.get(table)
+            if entry is not None and entry[0] == version:
+                return entry[3]
+            rows, max_id = conn.execute(f"SELECT COUNT(*), COALESCE(MAX(id), 0) FROM {table}").fetchone()
+            df = None
+            if entry is not None:
+                _, old_rows, old_max_id, old_df = entry
+                delta = with_datetimes(pd.read_sql_query(f"SELECT * FROM {table} WHERE id > ? ORDER BY id", conn, params=(old_max_id,)))
+                if old_rows + len(delta) == rows:
+                    df = old_df if delta.empty else pd.concat([old_df, delta], ignore_index=True)
+            if df is None:
+                df = with_datetimes(pd.read_sql_query(f"SELECT * FROM {table}", conn))
+            self._entries[table] = (version, rows, max_id, df)
+            return df
+
+
+@st.cache_resource(show_spinner=False)
+def _table_cache(shard: str) -> TableCache:
+    return TableCache()
+
+
+def get_table_cache() -> TableCache:
+    # 버전/프레임 캐시는 샤드마다 따로 (다른 사용자의 쓰기가 내 캐시를 무효화하지 않음)
+    return _table_cache(current_shard())
 
-def ensure_dirs():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    os.makedirs(IMG_DIR, exist_ok=True)
 
+def load_df(table: str) -> pd.DataFrame:
+    with get_conn() as conn:
+        df = get_table_cache().get(conn, table)
+    # 얕은 복사: 호출 측에서 열을 추가/교체해도 캐시된 프레임은 그대로 유지
+    return df.copy(deep=False)
+
+
+def refresh_cache(*tables: str, reload: bool = False):
+    """쓰기 후 해당 테이블만 무효화. 추가(INSERT)는 증분 반영, reload=True면 전체 재조회."""
+    cache = get_table_cache()
+    for table in tables or ("profile", "meals", "activities", "weights", "daily_summary"):
+        cache.bump(table, reload=reload)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _query_df(shard: str, table: str, columns: Optional[Tuple[str, ...]], start: Optional[date], end: Optional[date], version: int) -> pd.DataFrame:
+    date_col = DATE_COLUMNS[table]
+    col_clause = ", ".join(columns) if columns else "*"
+    where, params = [], []
+    if start is not None:
+        where.append(f"{date_col} >= ?")
+        params.append(to_day(start))
+    if end is not None:
+        where.append(f"{date_col} <= ?")
+        params.append(to_day(end))
+    q = f"SELECT {col_clause} FROM {table}"
+    if where:
+        q += " WHERE " + " AND ".join(where)
+    q += f" ORDER BY {'dt' if date_col == 'day' else date_col}"  # 같은 날 안에서는 시각 순
+    with get_conn(shard) as conn:
+        return with_datetimes(pd.read_sql_query(q, conn, params=params))
+
+
+def query_df(table: str, columns: Optional[List[str]] = None, start: Optional[date] = None, end: Optional[date] = None) -> pd.DataFrame:
+    """기간(start~end, 양끝 포함)과 열 목록을 SQLite 쿼리로 넘겨 필요한 행만 조회.
+
+    결과는 테이블 버전을 키에 포함해 캐시하므로 해당 테이블에 쓰기가 있을 때만 다시 읽는다.
+    """
+    cols = tuple(columns) if columns else None
+    return _query_df(current_shard(), table, cols, start, end, get_table_cache().version(table))
+
+
+TOP_FOOD_ORDERS = {"count": "meals", "servings": "servings", "kcal": "kcal", "carb": "carb_g"}
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _top_foods(shard: str, start: Optional[date], order: str, limit: int, version: int) -> pd.DataFrame:
+    where, params = "", []
+    if start is not None:
+        where = "WHERE m.day >= ?"
+        params.append(to_day(start))
+    q = f"""
+        SELECT f.name AS food,
+               COUNT(DISTINCT mi.meal_id) AS meals,
+               SUM(mi.servings) AS servings,
+               SUM(mi.servings * f.kcal) AS kcal,
+               SUM(mi.servings * f.carb_g) AS carb_g
+        FROM meal_items mi
+        JOIN meals m ON m.id = mi.meal_id
+        JOIN foods f ON f.id = mi.food_id
+        {where}
+        GROUP BY f.id
+        ORDER BY {TOP_FOOD_ORDERS[order]} DESC, f.name
+        LIMIT ?
+    """
+    with get_conn(shard) as conn:
+        return pd.read_sql_query(q, conn, params=params + [limit])
+
+
+def top_foods(start: Optional[date] = None, order: str = "count", limit: int = 10) -> pd.DataFrame:
+    """기간 내 음식별 섭취 빈도·인분·칼로리·탄수화물 상위 N개 (meal_items 집계, 칼로리/탄수화물은 foods에 값이 있는 음식만)."""
+    return _top_foods(current_shard(), start, order, limit, get_table_cache().version("meals"))
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _photo_count(shard: str, version: int) -> int:
+    with get_conn(shard) as conn:
+        return conn.execute("SELECT COUNT(*) FROM meals WHERE photo_path IS NOT NULL").fetchone()[0]
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _photo_page(shard: str, page: int, page_size: int, version: int) -> pd.DataFrame:
+    q = """
+        SELECT id, dt, label, items, calories, photo_path FROM meals
+        WHERE photo_path IS NOT NULL
+        ORDER BY dt DESC, id DESC
+        LIMIT ? OFFSET ?
+    """
+    with get_conn(shard) as conn:
+        return with_datetimes(pd.read_sql_query(q, conn, params=(page_size, page * page_size)))
+
+
+def photo_count() -> int:
+    return _photo_count(current_shard(), get_table_cache().version("meals"))
+
+
+def photo_page(page: int, page_size: int = GALLERY_PAGE_SIZE) -> pd.DataFrame:
+    """사진이 있는 식단을 최신순으로 page_size 개씩 나눈 page 번째(0부터) 묶음. 사진 파일은 읽지 않고 경로만 반환."""
+    return _photo_page(current_shard(), page, page_size, get_table_cache().version("meals"))
 
-def get_conn():
-    ensure_dirs()
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    return conn
 
+# ----------------------------- 계산 로직 ----------------------------- #
 
-def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS profile (
-            id INTEGER PRIMARY KEY CHECK (id = 1),
-            birth_year INTEGER,
-            sex TEXT,
-            height_cm REAL,
-            weight_kg REAL,
-            target_weight_kg REAL,
-            daily_calorie_target INTEGER,
-            daily_carb_target_g INTEGER,
-            knee_care INTEGER DEFAULT 1
-        )
-        """
+@st.cache_data(show_spinner=False, max_entries=32)
+def _stats_charts(shard: str, start: Optional[date], carb_target: float, version: int) -> Optional[Dict[str, Optional[dict]]]:
+    # 일별 합계는 저장 시점에 daily_summary에 누적되어 있으므로 기간 내 행만 읽으면 됨
+    daily = _query_df(shard, "daily_summary", ("d", "intake_kcal", "carb_g", "burn_kcal", "steps", "weight_kg"), start, None, version)  # d: datetime64
+    if daily.empty:
+        return None
+    daily = daily.fillna({"intake_kcal": 0, "burn_kcal": 0, "carb_g": 0})  # 결측 0 처리 (시각화를 위한 용도)
+    x = alt.X("d:T", title="날짜")
+    # 데이터는 이름(NamedData)으로만 참조하고 DataFrame 은 datasets 로 따로 넘김 (행을 JSON 으로 풀어 명세에 넣지 않음)
+    specs: Dict[str, Optional[dict]] = {"weight": None, "steps": None}
+    if daily["weight_kg"].notna().any():
+        chart_w = alt.Chart(alt.NamedData(name="weight")).mark_line(point=True).encode(x=x, y=alt.Y("weight_kg:Q", title="체중(kg)"))
+        specs["weight"] = {**chart_w.to_dict(), "datasets": {"weight": daily.dropna(subset=["weight_kg"])[["d", "weight_kg"]]}}
+
+    melt = daily.melt(id_vars=["d"], value_vars=["intake_kcal", "burn_kcal"], var_name="type", value_name="kcal")
+    chart_c = alt.Chart(alt.NamedData(name="kcal")).mark_bar().encode(
+        x=x,
+        y=alt.Y("kcal:Q", title="kcal"),
+        color="type:N",
+        tooltip=["d:T", "type:N", "kcal:Q"],
     )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS meals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            dt TEXT,
-            label TEXT,
-            items TEXT,
-            calories REAL,
-            carbs_g REAL,
-            photo_path TEXT
-        )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS activities (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            dt TEXT,
-            kind TEXT,
-            minutes REAL,
-            steps INTEGER,
-            distance_km REAL,
-            pace_kmh REAL,
-            calories REAL
-        )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS weights (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            d TEXT,
-            weight_kg REAL
-        )
-        """
-    )
-    conn.commit()
+    specs["kcal"] = {**chart_c.to_dict(), "datasets": {"kcal": melt}}
 
+    chart_carbs = alt.Chart(alt.NamedData(name="carbs")).mark_line(point=True).encode(x=x, y=alt.Y("carb_g:Q", title="탄수화물(g)"))
+    if carb_target:
+        # 목표선
+        chart_carbs = chart_carbs + alt.Chart(alt.Data(values=[{"y": carb_target}])).mark_rule().encode(y="y:Q")
+    specs["carbs"] = {**chart_carbs.to_dict(), "datasets": {"carbs": daily[["d", "carb_g"]]}}
 
-@st.cache_data(show_spinner=False)
-def load_df(table: str) -> pd.DataFrame:
-    conn = get_conn()
-    return pd.read_sql_query(f"SELECT * FROM {table}", conn)
+    if daily["steps"].notna().any():
+        chart_s = alt.Chart(alt.NamedData(name="steps")).mark_bar().encode(x=x, y=alt.Y("steps:Q", title="걸음수"))
+        specs["steps"] = {**chart_s.to_dict(), "datasets": {"steps": daily[["d", "steps"]].fillna({"steps": 0})}}
+    return specs
 
 
-def refresh_cache():
-    load_df.clear()
+def stats_charts(start: Optional[date], carb_target: float = 0) -> Optional[Dict[str, Optional[dict]]]:
+    """통계 탭 차트의 Vega-Lite 명세 (데이터 없으면 None, 체중/걸음수 기록이 없으면 해당 항목 None).
 
+    daily_summary 버전·기간·목표선이 같으면 캐시에서 그대로 반환하므로, 관계없는 위젯으로 다시 실행될 때
+    Altair 차트 구성과 Vega-Lite 변환(스키마 검증 포함)을 반복하지 않는다.
+    """
+    return _stats_charts(current_shard(), start, carb_target, get_table_cache().version("daily_summary"))
 
-# ----------------------------- 계산 로직 ----------------------------- #
 
 def bmr_mifflin(weight_kg: float, height_cm: float, age: int, sex: str) -> float:
     s = 5 if sex.lower().startswith("m") else -161
@@ -699,37 +704,117 @@ def kcal_from_met(met: float, weight_kg: float, minutes: float) -> float:
     return met * 3.5 * weight_kg / 200 * minutes
 
 
-# ----------------------------- 내장 음식 DB (API 없이 계산) ----------------------------- #
-# 1인분 기준 칼로리/탄수화물(g) 간이치. 필요시 자유롭게 확장하세요.
-FOOD_DB: Dict[str, Dict[str, float]] = {
-    # 곡류/밥
-    "현미밥 1/2공기(100g)": {"kcal": 150, "carb": 33},
-    "현미밥 1공기(200g)": {"kcal": 300, "carb": 66},
-    "잡곡밥 1공기": {"kcal": 320, "carb": 68},
-    "곤약밥 1공기": {"kcal": 180, "carb": 40},
-    # 단백질
-    "닭가슴살 100g": {"kcal": 165, "carb": 0},
-    "두부 100g": {"kcal": 80, "carb": 2},
-    "계란 1개": {"kcal": 70, "carb": 0.6},
-    "연어 120g": {"kcal": 240, "carb": 0},
-    "고등어 120g": {"kcal": 250, "carb": 0},
-    # 채소/샐러드
-    "샐러드(채소) 1접시": {"kcal": 60, "carb": 8},
-    "찐브로콜리 1접시": {"kcal": 55, "carb": 11},
-    "시금치나물 1접시": {"kcal": 70, "carb": 7},
-    # 곡/면 대체
-    "곤약면 1인분": {"kcal": 25, "carb": 2},
-    "현미국수 1인분": {"kcal": 380, "carb": 78},
-    # 간식/유제품/견과
-    "플레인 요거트 150g": {"kcal": 95, "carb": 11},
-    "아몬드 25g": {"kcal": 145, "carb": 5},
-    "방울토마토 10개": {"kcal": 30, "carb": 7},
-    # 과일(소량)
-    "사과 1/2개": {"kcal": 50, "carb": 14},
-    "바나나 1/2개": {"kcal": 45, "carb": 12},
-    # 조미/지방(선택)
-    "올리브오일 1작은술": {"kcal": 40, "carb": 0},
-}
+# ----------------------------- 영양 카탈로그 (API 없이 계산) ----------------------------- #
+# 음식 영양 정보는 nutrition/predicare_foods.csv 에서 관리(1인분 기준). 필요시 CSV에 행을 추가하세요.
+# 처음 실행할 때(또는 CSV가 바뀌었을 때) data/nutrition/ 아래 .npy 로 컴파일하고, 이후에는 메모리 매핑으로 읽는다.
+CATALOG_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nutrition", "predicare_foods.csv")
+CATALOG_DIR = "data/nutrition"
+NUTRIENT_COLUMNS = ("kcal", "carb_g", "protein_g", "fat_g", "fiber_g", "gi", "serving_g")
+CATALOG_TEXT_COLUMNS = ("name", "category", "serving")
+SUM_NUTRIENTS = ("kcal", "carb_g", "protein_g", "fat_g", "fiber_g")  # 끼니 합계를 내는 영양소 (GI는 합산 불가)
+BATCH_CELLS = 1 << 22  # 일괄 계산 시 (끼니 × 음식) 인분 행렬 한 조각의 최대 칸 수 (float64 32MB)
+
+
+def compile_catalog(csv_path: str, out_dir: str = CATALOG_DIR) -> Tuple[str, str]:
+    """CSV 카탈로그를 숫자 행렬(float32)과 텍스트 배열 두 개의 .npy 로 변환. CSV보다 새 파일이 있으면 재사용."""
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    values_path = os.path.join(out_dir, f"{stem}.values.npy")
+    text_path = os.path.join(out_dir, f"{stem}.text.npy")
+    src_mtime = os.path.getmtime(csv_path)
+    if all(os.path.exists(p) and os.path.getmtime(p) >= src_mtime for p in (values_path, text_path)):
+        return values_path, text_path
+
+    os.makedirs(out_dir, exist_ok=True)
+    df = pd.read_csv(csv_path, dtype={c: str for c in CATALOG_TEXT_COLUMNS})
+    arrays = {
+        values_path: df[list(NUTRIENT_COLUMNS)].to_numpy(dtype=np.float32),  # GI 미상은 NaN
+        text_path: df[list(CATALOG_TEXT_COLUMNS)].fillna("").to_numpy(dtype=str),
+    }
+    for path, arr in arrays.items():
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, path)  # 읽는 쪽이 반쯤 쓴 파일을 보지 않도록 교체
+    return values_path, text_path
+
+
+class NutritionCatalog:
+    """메모리 매핑된 영양 카탈로그.
+
+    values[i] 는 음식 i 의 NUTRIENT_COLUMNS 값(1회 제공량 기준), text[i] 는 (이름, 분류, 제공 단위).
+    숫자는 파이썬 객체로 풀지 않고 NumPy 배열 그대로 쓰며, 이름 → 번호 사전만 메모리에 둔다.
+    """
+
+    def __init__(self, values: np.ndarray, text: np.ndarray):
+        self.values = values
+        self.text = text
+        self.names: List[str] = text[:, 0].tolist()
+        self.ids: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        self._matrices: Dict[Tuple[str, ...], np.ndarray] = {}
+
+    @classmethod
+    def load(cls, csv_path: str, out_dir: str = CATALOG_DIR) -> "NutritionCatalog":
+        values_path, text_path = compile_catalog(csv_path, out_dir)
+        return cls(np.load(values_path, mmap_mode="r"), np.load(text_path, mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.ids
+
+    def lookup(self, names: List[str]) -> np.ndarray:
+        # 이름 → 음식 번호 배열 (카탈로그에 없으면 -1)
+        return np.fromiter((self.ids.get(n, -1) for n in names), dtype=np.int64, count=len(names))
+
+    def matrix(self, nutrients: Tuple[str, ...] = SUM_NUTRIENTS) -> np.ndarray:
+        # (음식 수, 영양소 수) 행렬. 일괄 계산마다 같은 열을 쓰므로 한 번만 만들어 둠
+        cached = self._matrices.get(nutrients)
+        if cached is None:
+            cols = [NUTRIENT_COLUMNS.index(c) for c in nutrients]
+            # float32 저장 오차(0.6 → 0.6000000238…)가 합계에 섞이지 않도록 소수 4자리로 정리
+            cached = self._matrices[nutrients] = np.round(self.values[:, cols].astype(np.float64), 4)
+        return cached
+
+    def column(self, nutrient: str) -> np.ndarray:
+        return self.values[:, NUTRIENT_COLUMNS.index(nutrient)]
+
+    def nutrient(self, name: str, nutrient: str, default: float = 0.0) -> float:
+        i = self.ids.get(name)
+        if i is None:
+            return default
+        return float(self.values[i, NUTRIENT_COLUMNS.index(nutrient)])
+
+    def names_in(self, category: str) -> List[str]:
+        return [self.names[i] for i in np.flatnonzero(self.text[:, 1] == category)]
+
+    def frame(self) -> pd.DataFrame:
+        df = pd.DataFrame(np.asarray(self.values), columns=list(NUTRIENT_COLUMNS))
+        for j, col in reversed(list(enumerate(CATALOG_TEXT_COLUMNS))):
+            df.insert(0, col, self.text[:, j])
+        return df
+
+
+@st.cache_resource(show_spinner=False)
+def get_catalog(csv_path: str = CATALOG_CSV) -> NutritionCatalog:
+    return NutritionCatalog.load(csv_path)
+
+
+@st.cache_resource(show_spinner=False)
+def sync_catalog_foods(shard: str, csv_path: str = CATALOG_CSV) -> int:
+    # 카탈로그의 1인분 칼로리/탄수화물을 샤드의 foods 테이블에 반영 (샤드마다 프로세스당 1회, 음식별 SQL 리포트용)
+    catalog = get_catalog(csv_path)
+    kcal, carb = catalog.matrix(("kcal", "carb_g")).T
+    rows = list(zip(catalog.names, kcal.tolist(), carb.tolist()))
+    with get_conn(shard) as conn:
+        conn.executemany(
+            "INSERT INTO foods(name, kcal, carb_g) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET kcal = excluded.kcal, carb_g = excluded.carb_g",
+            rows,
+        )
+        conn.commit()
+    return len(rows)
+
 
 TEMPLATES = {
     "아침(예시)": ["현미밥 1/2공기(100g)", "계란 1개", "샐러드(채소) 1접시", "두부 100g"],
@@ -739,92 +824,521 @@ TEMPLATES = {
 }
 
 
+def nutrition_totals(meals: List[List[Tuple[str, float]]], nutrients: Tuple[str, ...] = SUM_NUTRIENTS) -> np.ndarray:
+    """여러 끼니의 [(음식명, 인분)] 목록 → (끼니 수, 영양소 수) 합계 행렬.
+
+    음식명을 카탈로그 번호로 바꾼 뒤 (끼니 × 음식) 인분 행렬을 만들고 영양 행렬과 한 번에 곱한다.
+    카탈로그에 없는 음식은 0으로 계산. 끼니가 많으면 BATCH_CELLS 크기로 나눠 곱한다.
+    """
+    catalog = get_catalog()
+    values = catalog.matrix(nutrients)
+    totals = np.zeros((len(meals), len(nutrients)))
+    meal_idx = np.fromiter((i for i, items in enumerate(meals) for _ in items), dtype=np.int64)
+    if meal_idx.size == 0:
+        return totals
+    food_ids = catalog.lookup([name for items in meals for name, _ in items])
+    amounts = np.fromiter((s for items in meals for _, s in items), dtype=np.float64, count=meal_idx.size)
+    known = food_ids >= 0
+    meal_idx, food_ids, amounts = meal_idx[known], food_ids[known], amounts[known]
+
+    n_foods = len(catalog)
+    step = max(1, BATCH_CELLS // max(n_foods, 1))
+    bounds = np.searchsorted(meal_idx, np.arange(0, len(meals) + step, step))
+    for k, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+        start = k * step
+        rows = min(step, len(meals) - start)
+        if rows <= 0 or lo == hi:
+            continue
+        flat = (meal_idx[lo:hi] - start) * n_foods + food_ids[lo:hi]
+        servings_matrix = np.bincount(flat, weights=amounts[lo:hi], minlength=rows * n_foods).reshape(rows, n_foods)
+        totals[start:start + rows] = servings_matrix @ values
+    return totals
+
+
 def compute_nutrition(selected: List[str], servings: Dict[str, float]) -> Tuple[float, float]:
-    kcal = 0.0
-    carb = 0.0
-    for item in selected:
-        base = FOOD_DB.get(item, {"kcal": 0, "carb": 0})
-        s = servings.get(item, 1.0)
-        kcal += base["kcal"] * s
-        carb += base["carb"] * s
-    return kcal, carb
+    kcal, carb = nutrition_totals([[(item, servings.get(item, 1.0)) for item in selected]], ("kcal", "carb_g"))[0]
+    return float(kcal), float(carb)
+
+
+@st.cache_data(show_spinner=False)
+def meal_nutrition(items_text: str) -> Tuple[float, float]:
+    # 템플릿/저장된 항목 문자열 → (kcal, 탄수화물). 같은 문자열은 재실행마다 다시 파싱하지 않음
+    kcal, carb = nutrition_totals([parse_items(items_text)], ("kcal", "carb_g"))[0]
+    return float(kcal), float(carb)
+
+
+# ----------------------------- 사진 저장소 ----------------------------- #
+# 사진은 내용의 SHA-256 으로 이름을 붙여 저장 (같은 사진을 다시 올리면 기존 파일을 재사용).
+# IMG_DIR/ab/cd/abcd….jpg 처럼 해시 앞 4글자로 두 단계 하위 폴더에 나눠 한 폴더에 파일이 몰리지 않게 함.
+
+def photo_path_for(digest: str, ext: str) -> str:
+    return os.path.join(IMG_DIR, digest[:2], digest[2:4], digest + ext)
+
+
+def store_photo(upload, name: Optional[str] = None) -> str:
+    """업로드 파일(파일류 객체)을 PHOTO_CHUNK 단위로 읽어 해시하면서 임시 파일에 쓰고, 해시 경로로 옮긴 뒤 그 경로를 반환."""
+    ext = os.path.splitext(name or getattr(upload, "name", ""))[1].lower()
+    ext = PHOTO_EXTS.get(ext, ext)
+    if hasattr(upload, "seek"):
+        upload.seek(0)
+    digest = hashlib.sha256()
+    tmp = tempfile.NamedTemporaryFile(dir=IMG_DIR, prefix=".upload_", suffix=".part", delete=False)
+    try:
+        with tmp:
+            for chunk in iter(lambda: upload.read(PHOTO_CHUNK), b""):
+                digest.update(chunk)
+                tmp.write(chunk)
+        path = photo_path_for(digest.hexdigest(), ext)
+        if os.path.exists(path):  # 이미 저장된 사진
+            os.remove(tmp.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp.name, path)  # 같은 파일시스템 안의 rename 이라 중간 상태의 파일이 보이지 않음
+    except BaseException:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+        raise
+    return path
+
+
+def thumb_path(photo_path: str, size: str) -> str:
+    # 원본의 IMG_DIR 기준 상대 경로를 그대로 따라가므로 해시 폴더 구조도 유지됨
+    rel = os.path.splitext(os.path.relpath(photo_path, IMG_DIR))[0]
+    return os.path.join(THUMB_DIR, size, rel + ".jpg")
+
+
+def make_thumbnails(photo_path: str) -> Dict[str, str]:
+    """원본 사진에서 THUMB_SIZES 축소본(JPEG) 중 아직 없는 것을 만들고 {크기: 경로} 를 반환."""
+    paths = {size: thumb_path(photo_path, size) for size in THUMB_SIZES}
+    missing = [size for size, path in paths.items() if not os.path.exists(path)]
+    if missing:
+        with Image.open(photo_path) as im:
+            largest = max(THUMB_SIZES[size] for size in missing)
+            im.draft("RGB", (largest, largest))  # JPEG 는 디코딩 단계에서 미리 축소 (전체 해상도로 풀지 않음)
+            im = ImageOps.exif_transpose(im).convert("RGB")
+            for size in sorted(missing, key=THUMB_SIZES.get, reverse=True):  # 큰 것부터 만들고 그 결과를 다시 줄임
+                im.thumbnail((THUMB_SIZES[size], THUMB_SIZES[size]))
+                os.makedirs(os.path.dirname(paths[size]), exist_ok=True)
+                tmp = paths[size] + ".part"
+                im.save(tmp, "JPEG", quality=80, optimize=True)
+                os.replace(tmp, paths[size])
+    return paths
+
+
+class ThumbnailWorker:
+    """축소본을 백그라운드 스레드 하나에서 생성. 같은 사진은 진행 중인 작업이 있으면 다시 걸지 않는다.
+
+    끝난 작업은 바로 잊음 (축소본 파일이 생겼으므로 이후에는 파일 존재 확인으로 충분).
+    실패한 작업만 다시 시도하지 않도록 최근 THUMB_FAILED_KEEP 개까지 기억한다.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+        self._jobs: Dict[str, Future] = {}
+        self._failed: deque = deque()
+        self._guard = threading.Lock()
+
+    def submit(self, photo_path: str) -> Future:
+        with self._guard:
+            job = self._jobs.get(photo_path)
+            new = job is None
+            if new:
+                job = self._jobs[photo_path] = self._executor.submit(make_thumbnails, photo_path)
+        if new:  # 이미 끝났으면 콜백이 바로 이 스레드에서 실행되므로 잠금 밖에서 등록
+            job.add_done_callback(lambda done, path=photo_path: self._finished(path, done))
+        return job
+
+    def _finished(self, photo_path: str, job: Future):
+        with self._guard:
+            if job.cancelled() or job.exception() is None:
+                self._jobs.pop(photo_path, None)
+                return
+            self._failed.append(photo_path)
+            while len(self._failed) > THUMB_FAILED_KEEP:
+                self._jobs.pop(self._failed.popleft(), None)
+
+    def thumbnail(self, photo_path: str, size: str) -> Tuple[Optional[str], bool]:
+        """(축소본 경로 또는 None, 생성 대기 중 여부). 축소본이 없으면 생성 작업을 걸어 두고 기다리지 않음."""
+        path = thumb_path(photo_path, size)
+        if os.path.exists(path):
+            return path, False
+        if not os.path.exists(photo_path):  # 원본이 지워진 기록
+            return None, False
+        job = self.submit(photo_path)
+        if job.done():
+            return (path, False) if job.exception() is None else (None, False)
+        return None, True
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+@st.cache_resource(show_spinner=False)
+def get_thumbnail_worker() -> ThumbnailWorker:
+    worker = ThumbnailWorker()
+    atexit.register(worker.close)
+    return worker
 
 
 # ----------------------------- DB 헬퍼 ----------------------------- #
 
+class Profile:
+    """profile 테이블의 한 행. 사이드바 기본값·목표선·차트가 같은 객체를 공유한다."""
+
+    __slots__ = (
+        "birth_year",
+        "sex",
+        "height_cm",
+        "weight_kg",
+        "target_weight_kg",
+        "daily_calorie_target",
+        "daily_carb_target_g",
+        "knee_care",
+    )
+
+    def __init__(
+        self,
+        birth_year: Optional[int] = None,
+        sex: Optional[str] = None,
+        height_cm: Optional[float] = None,
+        weight_kg: Optional[float] = None,
+        target_weight_kg: Optional[float] = None,
+        daily_calorie_target: Optional[int] = None,
+        daily_carb_target_g: Optional[int] = None,
+        knee_care: Optional[int] = None,
+    ):
+        self.birth_year = birth_year
+        self.sex = sex
+        self.height_cm = height_cm
+        self.weight_kg = weight_kg
+        self.target_weight_kg = target_weight_kg
+        self.daily_calorie_target = daily_calorie_target
+        self.daily_carb_target_g = daily_carb_target_g
+        self.knee_care = knee_care
+
+
+def get_profile() -> Optional[Profile]:
+    # 세션당 한 번 읽고, 사용자(샤드)가 바뀌거나 upsert_profile 로 profile 버전이 바뀐 경우에만 다시 읽음
+    version = (current_shard(), get_table_cache().version("profile"))
+    cached = st.session_state.get("_profile")
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with get_conn() as conn:
+        row = conn.execute(f"SELECT {', '.join(Profile.__slots__)} FROM profile WHERE id = 1").fetchone()
+    profile = Profile(*row) if row else None
+    st.session_state["_profile"] = (version, profile)
+    return profile
+
+
 def upsert_profile(**kwargs):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM profile WHERE id = 1")
-    exists = cur.fetchone() is not None
-    cols = [k for k in kwargs.keys()]
-    vals = [kwargs[k] for k in cols]
-    if exists:
-        set_clause = ", ".join([f"{c} = ?" for c in cols])
-        cur.execute(f"UPDATE profile SET {set_clause} WHERE id = 1", vals)
-    else:
-        col_clause = ", ".join(cols)
-        q = ",".join(["?"] * len(cols))
-        cur.execute(f"INSERT INTO profile(id, {col_clause}) VALUES (1, {q})", vals)
-    conn.commit()
-    refresh_cache()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM profile WHERE id = 1")
+        exists = cur.fetchone() is not None
+        cols = [k for k in kwargs.keys()]
+        vals = [kwargs[k] for k in cols]
+        if exists:
+            set_clause = ", ".join([f"{c} = ?" for c in cols])
+            cur.execute(f"UPDATE profile SET {set_clause} WHERE id = 1", vals)
+        else:
+            col_clause = ", ".join(cols)
+            q = ",".join(["?"] * len(cols))
+            cur.execute(f"INSERT INTO profile(id, {col_clause}) VALUES (1, {q})", vals)
+        conn.commit()
+    refresh_cache("profile", reload=True)
+    st.session_state.pop("_profile", None)
+
+
+def _chunked(records: Iterable[tuple], size: int = BULK_CHUNK) -> Iterator[List[tuple]]:
+    it = iter(records)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def insert_meals(records: Iterable[tuple]) -> int:
+    """(dt, label, items, calories, carbs_g, photo_path) 레코드를 한 트랜잭션으로 일괄 입력 (dt: datetime·ISO 문자열·epoch 초).
+
+    제너레이터도 BULK_CHUNK 행씩 끊어 executemany 로 넘기므로 입력 크기와 무관하게 메모리가 일정하다.
+    meal_items·daily_summary 도 같은 트랜잭션에서 갱신하고, 캐시 무효화는 끝에 한 번만 한다.
+    """
+    total = 0
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")  # 쓰기 잠금을 먼저 잡아 새 id 구간이 이 트랜잭션 것임을 보장
+        for chunk in _chunked(records):
+            rows = [(to_epoch(dt), label, items, calories, carbs_g, photo_path) for dt, label, items, calories, carbs_g, photo_path in chunk]
+            last_id = cur.execute("SELECT COALESCE(MAX(id), 0) FROM meals").fetchone()[0]
+            cur.executemany("INSERT INTO meals(dt, label, items, calories, carbs_g, photo_path) VALUES (?,?,?,?,?,?)", rows)
+            meal_ids = [r[0] for r in cur.execute("SELECT id FROM meals WHERE id > ? ORDER BY id", (last_id,))]
+            _insert_meal_items(cur, zip(meal_ids, (r[2] for r in rows)))
+            cur.executemany(SUMMARY_ADD_MEAL, [(r[0] // 86400, r[3], r[4]) for r in rows])
+            total += len(rows)
+        conn.commit()
+    if total:
+        refresh_cache("meals", "daily_summary")
+    return total
+
+
+def insert_activities(records: Iterable[tuple]) -> int:
+    """(dt, kind, minutes, steps, distance_km, pace_kmh, calories) 레코드 일괄 입력 (insert_meals 와 같은 방식)."""
+    total = 0
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        for chunk in _chunked(records):
+            rows = [(to_epoch(dt),) + tuple(rest) for dt, *rest in chunk]
+            cur.executemany("INSERT INTO activities(dt, kind, minutes, steps, distance_km, pace_kmh, calories) VALUES (?,?,?,?,?,?,?)", rows)
+            cur.executemany(SUMMARY_ADD_ACTIVITY, [(r[0] // 86400, r[6], r[3]) for r in rows])
+            total += len(rows)
+        conn.commit()
+    if total:
+        refresh_cache("activities", "daily_summary")
+    return total
+
+
+def insert_weights(records: Iterable[tuple]) -> int:
+    """(d, weight_kg) 레코드 일괄 입력. 같은 날짜가 여러 번 나오면 마지막 값이 일별 요약에 남는다."""
+    total = 0
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        for chunk in _chunked(records):
+            rows = [(to_day(d), weight_kg) for d, weight_kg in chunk]
+            cur.executemany("INSERT INTO weights(d, weight_kg) VALUES (?,?)", rows)
+            cur.executemany(SUMMARY_SET_WEIGHT, rows)
+            total += len(rows)
+        conn.commit()
+    if total:
+        refresh_cache("weights", "daily_summary")
+    return total
 
 
 def insert_meal(dt: datetime, label: str, items: str, calories: float, carbs_g: float, photo_path: Optional[str]):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO meals(dt, label, items, calories, carbs_g, photo_path) VALUES (?,?,?,?,?,?)",
-        (dt.isoformat(), label, items, calories, carbs_g, photo_path),
-    )
-    conn.commit()
-    refresh_cache()
+    insert_meals([(dt, label, items, calories, carbs_g, photo_path)])
+
+
+def recompute_meal_nutrition() -> int:
+    """카탈로그 기준으로 과거 식단의 칼로리/탄수화물을 일괄 재계산 (카탈로그 수정 후 사용).
+
+    항목이 모두 카탈로그에 있는 식단만 갱신하고(직접 입력한 항목이 섞인 식단은 그대로 둠), 일별 요약도 다시 만든다.
+    """
+    meals = load_df("meals")
+    if meals.empty:
+        return 0
+    catalog = get_catalog()
+    parsed = [parse_items(text or "") for text in meals["items"]]
+    resolvable = [bool(items) and all(name in catalog for name, _ in items) for items in parsed]
+    totals = nutrition_totals([items for items, ok in zip(parsed, resolvable) if ok], ("kcal", "carb_g"))
+    ids = meals.loc[resolvable, "id"].to_numpy()
+    rows = [(float(kcal), float(carb), int(meal_id)) for (kcal, carb), meal_id in zip(totals, ids)]
+    with get_conn() as conn:
+        conn.executemany("UPDATE meals SET calories = ?, carbs_g = ? WHERE id = ?", rows)
+        rebuild_daily_summary(conn)  # commit 포함
+    refresh_cache("meals", "daily_summary", reload=True)
+    return len(rows)
 
 
 def insert_activity(dt: datetime, kind: str, minutes: float, steps: Optional[int], distance_km: Optional[float], pace_kmh: Optional[float], calories: float):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO activities(dt, kind, minutes, steps, distance_km, pace_kmh, calories) VALUES (?,?,?,?,?,?,?)",
-        (dt.isoformat(), kind, minutes, steps, distance_km, pace_kmh, calories),
-    )
-    conn.commit()
-    refresh_cache()
+    insert_activities([(dt, kind, minutes, steps, distance_km, pace_kmh, calories)])
 
 
 def insert_weight(d: date, weight_kg: float):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO weights(d, weight_kg) VALUES (?,?)", (d.isoformat(), weight_kg))
-    conn.commit()
-    refresh_cache()
+    insert_weights([(d, weight_kg)])
+
+
+def _epoch_column(col: pd.Series, unit: str) -> pd.Series:
+    # 가져온 날짜/일시 열 → 정수 epoch (초 "s" / 일 "D"). 숫자는 그대로, ISO 문자열(CSV)·datetime64(Parquet)는 변환
+    if pd.api.types.is_numeric_dtype(col):
+        return col.astype("int64")
+    stamps = col if pd.api.types.is_datetime64_any_dtype(col) else pd.to_datetime(col, format="ISO8601")
+    return (stamps - pd.Timestamp(0)) // pd.Timedelta(1, unit=unit)
+
+
+def _read_import_chunks(zf: ZipFile, table: str, cols: Tuple[str, ...]) -> Iterator[Tuple[str, pd.DataFrame]]:
+    # ZIP 안의 테이블 파일을 IMPORT_CHUNK 행씩 읽음. Parquet가 있으면 우선 사용(파싱 없이 타입 그대로)
+    names = set(zf.namelist())
+    if pq is not None and f"{table}.parquet" in names:
+        with zf.open(f"{table}.parquet") as fh:
+            pf = pq.ParquetFile(fh)
+            wanted = [c for c in cols if c in pf.schema_arrow.names]
+            for batch in pf.iter_batches(batch_size=IMPORT_CHUNK, columns=wanted):
+                yield f"{table}.parquet", batch.to_pandas(date_as_object=False)
+    elif f"{table}.csv" in names:
+        text_cols = {c: str for c in ("dt", "d", "label", "items", "kind", "photo_path") if c in cols}
+        with zf.open(f"{table}.csv") as fh:
+            for chunk in pd.read_csv(fh, chunksize=IMPORT_CHUNK, dtype=text_cols, float_precision="round_trip"):
+                yield f"{table}.csv", chunk
+
+
+def import_export_zip(file) -> Dict[str, int]:
+    """내보내기 ZIP(<테이블>.parquet 또는 .csv)을 복원. 반환: 파일별 새로 입력한 행 수.
+
+    파일은 IMPORT_CHUNK 행씩 읽고, 자연 키가 같은 행은 파일 안에서도·DB와도 중복으로 보고 건너뛴다.
+    날짜는 ISO 문자열·datetime64·정수 모두 받아 정수 epoch 로 맞춘다. DB 중복 확인은 조각의 날짜 범위만 조회하므로 여러 해 분량의 백업도 메모리에 한꺼번에 올리지 않는다.
+    """
+    inserters = {"meals": insert_meals, "activities": insert_activities, "weights": insert_weights}
+    counts: Dict[str, int] = {}
+    with ZipFile(file) as zf:
+        for table, (keys, cols) in IMPORT_SPECS.items():
+            date_col = keys[0]  # dt 또는 d
+            for fname, chunk in _read_import_chunks(zf, table, cols):
+                counts.setdefault(fname, 0)
+                chunk = chunk.reindex(columns=list(cols)).dropna(subset=[date_col])
+                chunk[date_col] = _epoch_column(chunk[date_col], EPOCH_UNITS[date_col])
+                key_df = chunk[list(keys)].fillna("")
+                chunk, key_df = chunk[~key_df.duplicated()], key_df[~key_df.duplicated()]
+                if chunk.empty:
+                    continue
+                key_sql = ", ".join(f"COALESCE({k}, '')" for k in keys)
+                with get_conn() as conn:
+                    existing = set(conn.execute(
+                        f"SELECT {key_sql} FROM {table} WHERE {date_col} BETWEEN ? AND ?",
+                        (int(chunk[date_col].min()), int(chunk[date_col].max())),  # numpy 정수는 BLOB 으로 바인딩되므로 변환
+                    ).fetchall())
+                new = [k not in existing for k in key_df.itertuples(index=False, name=None)]
+                records = chunk[new].astype(object).where(chunk[new].notna(), None)
+                counts[fname] += inserters[table](records.itertuples(index=False, name=None))
+    return counts
+
+
+def _export_columns(conn: sqlite3.Connection, table: str) -> List[Tuple[str, str]]:
+    # 저장 열 (이름, 선언 타입). table_info 는 생성 열(day)을 포함하지 않음
+    return [(name, decl.upper()) for _, name, decl, *_ in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _arrow_schema(columns: List[Tuple[str, str]]) -> "pa.Schema":
+    # SQLite 선언 타입 → Arrow 타입. epoch 정수 열은 timestamp[s] / date32 로 내보냄
+    types = {"INTEGER": pa.int64(), "REAL": pa.float64(), "TEXT": pa.string()}
+    temporal = {"dt": pa.timestamp("s"), "d": pa.date32()}
+    return pa.schema([pa.field(name, temporal.get(name) or types.get(decl, pa.string())) for name, decl in columns])
+
+
+def _write_table_csv(zf: ZipFile, cur: sqlite3.Cursor, table: str):
+    with zf.open(f"{table}.csv", "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow([col[0] for col in cur.description])
+        while True:
+            rows = cur.fetchmany(BULK_CHUNK)
+            if not rows:
+                break
+            writer.writerows(rows)
+
+
+def _stored_entry(name: str) -> ZipInfo:
+    # 이미 압축된 파일(Parquet)용 무압축 ZIP 항목
+    info = ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+    info.compress_type = ZIP_STORED
+    return info
+
+
+def _write_table_parquet(zf: ZipFile, cur: sqlite3.Cursor, table: str, schema: "pa.Schema"):
+    # PARQUET_ROW_GROUP 행마다 하나의 row group. zstd 압축이므로 ZIP 안에서는 다시 압축하지 않음
+    # id·일시처럼 증가하는 정수 열은 델타 인코딩, 문자열 열만 사전 인코딩
+    int_cols = [f.name for f in schema if pa.types.is_integer(f.type) or pa.types.is_temporal(f.type)]
+    text_cols = [f.name for f in schema if pa.types.is_string(f.type)]
+    encoding = {name: "DELTA_BINARY_PACKED" for name in int_cols}
+    with zf.open(_stored_entry(f"{table}.parquet"), "w") as fh:
+        with pq.ParquetWriter(fh, schema, compression="zstd", use_dictionary=text_cols, column_encoding=encoding) as writer:
+            while True:
+                rows = cur.fetchmany(PARQUET_ROW_GROUP)
+                if not rows:
+                    break
+                chunk = with_datetimes(pd.DataFrame.from_records(rows, columns=schema.names))
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def write_export_zip(fileobj, tables: Tuple[str, ...] = EXPORT_TABLES, fmt: str = "csv"):
+    # 테이블별 <table>.csv 또는 <table>.parquet 를 ZIP에 기록. 행은 커서에서 BULK_CHUNK 개씩 읽어 바로 씀
+    with ZipFile(fileobj, "w", compression=ZIP_DEFLATED) as zf, get_conn() as conn:
+        conn.execute("BEGIN")  # 세 테이블을 같은 시점(스냅샷)으로 읽음. 반납 시 롤백
+        for table in tables:
+            columns = _export_columns(conn, table)
+            if fmt == "parquet":
+                cur = conn.execute(f"SELECT {', '.join(name for name, _ in columns)} FROM {table} ORDER BY id")
+                _write_table_parquet(zf, cur, table, _arrow_schema(columns))
+            else:
+                # CSV는 사람이 읽을 수 있도록 ISO 문자열로 (가져오기에서 다시 정수로 변환)
+                iso = {"dt": "strftime('%Y-%m-%dT%H:%M:%S', dt, 'unixepoch') AS dt", "d": "date(d * 86400, 'unixepoch') AS d"}
+                cur = conn.execute(f"SELECT {', '.join(iso.get(name, name) for name, _ in columns)} FROM {table} ORDER BY id")
+                _write_table_csv(zf, cur, table)
+
+
+@contextmanager
+def export_zip(fmt: str = "csv") -> Iterator[io.RawIOBase]:
+    """내보내기 ZIP 을 이름 없는 임시 파일에 쓰고, 처음으로 되감은 파일 객체를 넘김 (블록을 벗어나면 파일 삭제).
+
+    행은 커서에서 BULK_CHUNK 개씩 읽어 바로 압축해 디스크에 쓰므로 만드는 동안의 메모리는 청크 크기로 제한된다.
+    공유 경로를 쓰지 않으므로 동시에 내보내는 사용자끼리 파일이 겹치지 않는다.
+    """
+    with tempfile.TemporaryFile() as fh:
+        write_export_zip(fh, fmt=fmt)
+        fh.seek(0)  # 버퍼를 비우고 되감음
+        yield fh.raw  # st.download_button 은 BufferedReader/RawIOBase 만 받으므로 버퍼 아래의 파일 객체
 
 
 # ----------------------------- 스트림릿 UI ----------------------------- #
 
 st.set_page_config(page_title=f"{APP_NAME}", page_icon="🍎", layout="wide")
 init_db()
+sync_catalog_foods(current_shard())
+
+# 부분 재실행: 위젯을 바꾸면 그 위젯이 있는 fragment 함수(사이드바/탭 하나/내보내기)만 다시 실행
+# st.fragment(1.37+, requirements.txt 의 고정 버전) / st.experimental_fragment(1.33+). 더 낮은 버전에서는 그냥 호출되어 전체 재실행
+_st_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+fragment = _st_fragment or (lambda func: func)
+
+
+def share(key: str, value):
+    """다른 fragment도 쓰는 값을 세션에 공유. 부분 재실행 중 값이 바뀌면 앱 전체를 다시 실행해 함께 갱신."""
+    changed = key in st.session_state and st.session_state[key] != value
+    st.session_state[key] = value
+    if changed and _st_fragment is not None:
+        st.rerun()
+    return value
+
 
 st.title("🍎 PrediCare — 걷기 기반 당뇨 전단계 체중 관리")
 st.caption("*개인 건강 참고용 도구입니다. 의학적 진단/치료를 대체하지 않습니다.*")
 
-with st.sidebar:
+@fragment
+def render_sidebar():
+    st.header("사용자")
+    if "user_pending" in st.session_state:  # 새로 등록한 사용자를 선택 상태로
+        st.session_state["user"] = st.session_state.pop("user_pending")
+    user = st.selectbox("사용자 선택", list_users(), key="user", help="사용자마다 프로필과 기록을 별도 DB 파일에 저장합니다.")
+    with st.expander("새 사용자 등록"):
+        new_user = st.text_input("이름", key="new_user").strip()
+        if st.button("등록") and new_user:
+            shard_for(new_user)
+            st.session_state["user_pending"] = new_user
+            st.rerun()
+    shard = shard_for(user)
+    if shard != current_shard():
+        # 다른 사용자의 샤드로 바꾸고 처음부터 다시 그림 (샤드 열기/카탈로그 반영은 스크립트 상단에서)
+        st.session_state["shard"] = shard
+        st.rerun()
+
     st.header("프로필 & 목표")
+    profile = get_profile() or Profile()
+    share("profile_version", get_table_cache().version("profile"))  # 통계 탭 목표선이 프로필을 따라가도록
     today = date.today()
     default_birth_year = today.year - 52
 
     col1, col2 = st.columns(2)
     with col1:
-        birth_year = st.number_input("출생연도", min_value=1930, max_value=today.year, value=default_birth_year, step=1)
+        birth_year = st.number_input("출생연도", min_value=1930, max_value=today.year, value=int(profile.birth_year or default_birth_year), step=1)
     with col2:
-        sex = st.selectbox("성별", ["여성", "남성"], index=0)
+        sex = st.selectbox("성별", ["여성", "남성"], index=1 if profile.sex == "남성" else 0)
 
-    height_cm = st.number_input("키 (cm)", min_value=120.0, max_value=210.0, value=160.0, step=0.5)
-    weight_kg = st.number_input("현재 체중 (kg)", min_value=35.0, max_value=200.0, value=65.0, step=0.1)
-    target_weight_kg = st.number_input("목표 체중 (kg)", min_value=35.0, max_value=200.0, value=60.0, step=0.1)
+    height_cm = st.number_input("키 (cm)", min_value=120.0, max_value=210.0, value=float(profile.height_cm or 160.0), step=0.5)
+    weight_kg = share("weight_kg", st.number_input("현재 체중 (kg)", min_value=35.0, max_value=200.0, value=float(profile.weight_kg or 65.0), step=0.1))  # 걷기 소모열량 계산에 사용
+    target_weight_kg = st.number_input("목표 체중 (kg)", min_value=35.0, max_value=200.0, value=float(profile.target_weight_kg or 60.0), step=0.1)
 
     activity_level = st.select_slider("평소 활동량", options=["낮음", "보통", "활동적", "매우 활동적"], value="보통")
-    knee_care = st.checkbox("무릎 보호 모드 (전방십자인대 수술 이력)", value=True)
+    knee_care = st.checkbox("무릎 보호 모드 (전방십자인대 수술 이력)", value=profile.knee_care != 0)
 
     age = today.year - int(birth_year)
     bmr = bmr_mifflin(weight_kg, height_cm, age, sex)
@@ -851,13 +1365,18 @@ with st.sidebar:
             daily_carb_target_g=daily_carb_target_g,
             knee_care=1 if knee_care else 0,
         )
+        st.session_state["profile_saved"] = True
+        share("profile_version", get_table_cache().version("profile"))  # 부분 재실행 중이면 전체 재실행 → 저장 메시지는 다음 실행에서 표시
+    if st.session_state.pop("profile_saved", False):
         st.success("프로필이 저장되었습니다.")
 
-# 탭 구성
-TAB1, TAB2, TAB3 = st.tabs(["오늘 기록", "통계", "가이드"])
+with st.sidebar:
+    render_sidebar()
 
 # ----------------------------- 탭: 오늘 기록 ----------------------------- #
-with TAB1:
+@fragment
+def render_today():
+    weight_kg = st.session_state["weight_kg"]
     st.subheader("📸 식단 기록 (사진 업로드 / 내장 DB 자동계산 / 수동 입력)")
 
     col_a, col_b = st.columns([1, 1])
@@ -879,7 +1398,7 @@ with TAB1:
         uploaded = st.file_uploader("음식 사진 업로드 (선택)", type=["jpg", "jpeg", "png"], help="사진은 기록/미리보기 용도입니다. API 없이 자동 인식은 불가합니다.")
 
         st.markdown("**방법 A. 내장 음식 DB로 자동 계산(권장, API 불필요)**")
-        selected_items = st.multiselect("음식 선택", options=sorted(FOOD_DB.keys()))
+        selected_items = st.multiselect("음식 선택", options=sorted(get_catalog().names))
 
         servings = {}
         if selected_items:
@@ -914,21 +1433,16 @@ with TAB1:
             items_text = st.session_state["_tmp_items_text"]
             st.text_area("템플릿 적용됨", items_text, key="items_text_applied")
             # 템플릿 영양 자동 계산
-            servings_tmp = {it:1.0 for it in items_text.split(", ") if it in FOOD_DB}
-            kcal_t, carb_t = compute_nutrition(list(servings_tmp.keys()), servings_tmp)
+            kcal_t, carb_t = meal_nutrition(items_text)
             calories = kcal_t
             carbs_g = carb_t
             st.info(f"템플릿 자동 계산 → {int(kcal_t)} kcal / {int(carb_t)} g")
 
         if st.button("식단 저장"):
             # 이미지 저장
-            photo_path = None
-            if uploaded is not None:
-                ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                ext = os.path.splitext(uploaded.name)[1].lower()
-                photo_path = os.path.join(IMG_DIR, f"meal_{ts}{ext}")
-                with open(photo_path, "wb") as f:
-                    f.write(uploaded.getvalue())
+            photo_path = store_photo(uploaded) if uploaded is not None else None
+            if photo_path is not None:
+                get_thumbnail_worker().submit(photo_path)  # 축소본은 저장 직후 백그라운드에서 한 번만 생성
 
             # 저장할 항목 문자열 구성(선택+수동 합침)
             auto_items_str = ", ".join([f"{k} x{servings.get(k,1)}" for k in selected_items])
@@ -940,21 +1454,14 @@ with TAB1:
 
     with col_b:
         st.write("오늘 입력된 식단")
-        meals_df = load_df("meals")
-        if not meals_df.empty:
-            meals_df["date"] = pd.to_datetime(meals_df["dt"]).dt.date
-            today_df = meals_df[meals_df["date"] == date.today()]
-            if today_df.empty:
-                st.info("아직 오늘 식단 기록이 없습니다.")
-            else:
-                st.dataframe(
-                    today_df[["dt", "label", "items", "calories", "carbs_g"]]
-                    .rename(columns={"dt": "시간", "label": "구분", "items": "항목", "calories": "kcal", "carbs_g": "탄수(g)"})
-                    .sort_values("시간"),
-                    use_container_width=True,
-                )
+        today_df = query_df("meals", ["dt", "label", "items", "calories", "carbs_g"], start=date.today(), end=date.today())
+        if today_df.empty:
+            st.info("아직 오늘 식단 기록이 없습니다.")
         else:
-            st.info("아직 식단 데이터가 없습니다.")
+            st.dataframe(
+                today_df.rename(columns={"dt": "시간", "label": "구분", "items": "항목", "calories": "kcal", "carbs_g": "탄수(g)"}),
+                use_container_width=True,
+            )
 
     st.markdown("---")
     st.subheader("🚶 걷기 기록")
@@ -994,88 +1501,94 @@ with TAB1:
             st.success("체중이 저장되었습니다.")
 
 # ----------------------------- 탭: 통계 ----------------------------- #
-with TAB2:
+@fragment
+def render_stats():
+    profile = get_profile() or Profile()
     st.subheader("📈 추이 시각화")
-    meals_df = load_df("meals")
-    acts_df = load_df("activities")
-    w_df = load_df("weights")
-
-    if not meals_df.empty:
-        meals_df["d"] = pd.to_datetime(meals_df["dt"]).dt.date
-        kcal_by_day = meals_df.groupby("d")["calories"].sum().reset_index().rename(columns={"calories": "intake_kcal"})
-        carb_by_day = meals_df.groupby("d")["carbs_g"].sum().reset_index().rename(columns={"carbs_g": "carb_g"})
-    else:
-        kcal_by_day = pd.DataFrame(columns=["d", "intake_kcal"]) 
-        carb_by_day = pd.DataFrame(columns=["d", "carb_g"]) 
-
-    if not acts_df.empty:
-        acts_df["d"] = pd.to_datetime(acts_df["dt"]).dt.date
-        out_kcal = acts_df.groupby("d")["calories"].sum().reset_index().rename(columns={"calories": "burn_kcal"})
-        steps_by_day = acts_df.groupby("d")["steps"].sum(min_count=1).reset_index().rename(columns={"steps": "steps"})
-    else:
-        out_kcal = pd.DataFrame(columns=["d", "burn_kcal"]) 
-        steps_by_day = pd.DataFrame(columns=["d", "steps"]) 
-
-    daily = pd.merge(kcal_by_day, out_kcal, on="d", how="outer")
-    daily = pd.merge(daily, carb_by_day, on="d", how="outer")
-    if not w_df.empty:
-        w_df["d"] = pd.to_datetime(w_df["d"]).dt.date
-        daily = pd.merge(daily, w_df[["d", "weight_kg"]], on="d", how="outer")
+    period_days = {"최근 7일": 7, "최근 30일": 30, "최근 90일": 90, "최근 1년": 365, "전체": None}
+    period = st.selectbox("기간", list(period_days.keys()), index=1)
+    stats_start = date.today() - timedelta(days=period_days[period] - 1) if period_days[period] else None
+    daily_carb_target_line = profile.daily_carb_target_g or 0
+    charts = stats_charts(stats_start, daily_carb_target_line)
 
-    daily = daily.sort_values("d")
-    daily_calorie_target_line = load_df("profile")["daily_calorie_target"].iloc[0] if not load_df("profile").empty else 0
-    daily_carb_target_line = load_df("profile")["daily_carb_target_g"].iloc[0] if not load_df("profile").empty else 0
-
-    daily_fill = daily.fillna({"intake_kcal":0, "burn_kcal":0, "carb_g":0})
-
-    if daily_fill.empty:
+    if charts is None:
         st.info("아직 통계에 표시할 데이터가 없습니다. '오늘 기록'에서 식단/운동/체중을 입력해 주세요.")
     else:
         c1, c2 = st.columns(2)
         with c1:
             st.write("체중 추이 (kg)")
-            if "weight_kg" in daily_fill.columns and daily_fill["weight_kg"].notna().any():
-                chart_w = alt.Chart(daily_fill.dropna(subset=["weight_kg"])) \
-                    .mark_line(point=True) \
-                    .encode(x=alt.X("d:T", title="날짜"), y=alt.Y("weight_kg:Q", title="체중(kg)"))
-                st.altair_chart(chart_w, use_container_width=True)
+            if charts["weight"] is not None:
+                st.vega_lite_chart(charts["weight"], use_container_width=True)
             else:
                 st.info("체중 데이터가 아직 없습니다.")
 
         with c2:
             st.write("칼로리 섭취/소모")
-            melt = daily_fill.melt(id_vars=["d"], value_vars=["intake_kcal", "burn_kcal"], var_name="type", value_name="kcal")
-            chart_c = alt.Chart(melt).mark_bar().encode(
-                x=alt.X("d:T", title="날짜"),
-                y=alt.Y("kcal:Q", title="kcal"),
-                color="type:N",
-                tooltip=["d:T", "type:N", "kcal:Q"],
-            )
-            st.altair_chart(chart_c, use_container_width=True)
+            st.vega_lite_chart(charts["kcal"], use_container_width=True)
 
         st.write("일일 탄수화물(g)")
-        chart_carbs = alt.Chart(daily_fill).mark_line(point=True).encode(
-            x=alt.X("d:T", title="날짜"),
-            y=alt.Y("carb_g:Q", title="탄수화물(g)"),
-        )
-        if daily_carb_target_line:
-            rule = alt.Chart(pd.DataFrame({"y": [daily_carb_target_line]})).mark_rule().encode(y="y:Q")
-            st.altair_chart(chart_carbs + rule, use_container_width=True)
-        else:
-            st.altair_chart(chart_carbs, use_container_width=True)
+        st.vega_lite_chart(charts["carbs"], use_container_width=True)
 
         st.write("일일 걸음수")
-        if not steps_by_day.empty and steps_by_day["steps"].notna().any():
-            chart_s = alt.Chart(steps_by_day.fillna({"steps":0})).mark_bar().encode(
-                x=alt.X("d:T", title="날짜"),
-                y=alt.Y("steps:Q", title="걸음수"),
-            )
-            st.altair_chart(chart_s, use_container_width=True)
+        if charts["steps"] is not None:
+            st.vega_lite_chart(charts["steps"], use_container_width=True)
         else:
             st.info("걸음수 데이터가 아직 없습니다.")
 
+        st.write("음식별 섭취 순위 (상위 10개)")
+        top_order = {"자주 먹은 음식": "count", "탄수화물 공급원": "carb", "칼로리 공급원": "kcal"}
+        top_by = st.radio("순위 기준", list(top_order.keys()), horizontal=True)
+        foods_top = top_foods(stats_start, top_order[top_by])
+        if foods_top.empty:
+            st.info("음식 항목이 기록된 식단이 아직 없습니다.")
+        else:
+            st.dataframe(
+                foods_top.rename(columns={"food": "음식", "meals": "식사 횟수", "servings": "인분 합계", "kcal": "칼로리(kcal)", "carb_g": "탄수화물(g)"}),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+# ----------------------------- 탭: 사진 기록 ----------------------------- #
+@fragment
+def render_gallery():
+    st.subheader("🖼️ 식단 사진 기록")
+    total = photo_count()
+    if total == 0:
+        st.info("사진과 함께 저장된 식단이 없습니다. '오늘 기록'에서 사진을 올려 저장해 보세요.")
+        return
+    pages = -(-total // GALLERY_PAGE_SIZE)
+    page_no = st.number_input(f"페이지 (사진 {total}장, {pages}쪽)", min_value=1, max_value=pages, value=1, step=1, key="gallery_page")
+    page_df = photo_page(int(page_no) - 1)
+
+    # 현재 페이지의 small 축소본만 전송 (원본은 보내지 않음)
+    worker = get_thumbnail_worker()
+    pending = 0
+    cols = st.columns(GALLERY_COLUMNS)
+    for i, row in enumerate(page_df.itertuples(index=False)):
+        with cols[i % GALLERY_COLUMNS]:
+            caption = f"{row.dt:%Y-%m-%d %H:%M} · {row.label} · {int(row.calories)} kcal"
+            path, waiting = worker.thumbnail(row.photo_path, "small")
+            if path:
+                st.image(path, caption=caption)
+                if st.button("크게 보기", key=f"gallery_open_{row.id}"):
+                    st.session_state["gallery_open"] = row.id
+            else:
+                pending += waiting
+                st.caption(f"{caption}\n\n({'축소본 만드는 중…' if waiting else '사진을 열 수 없음'})")
+    if pending:
+        st.caption(f"축소본 {pending}개를 만드는 중입니다.")
+        st.button("새로고침", key="gallery_refresh")
+
+    # 선택한 한 장만 medium 축소본으로
+    opened = page_df[page_df["id"] == st.session_state.get("gallery_open")]
+    if not opened.empty:
+        row = opened.iloc[0]
+        path, _ = worker.thumbnail(row["photo_path"], "medium")
+        if path:
+            st.image(path, caption=f"{row['dt']:%Y-%m-%d %H:%M} {row['label']}: {row['items']}")
+
 # ----------------------------- 탭: 가이드 ----------------------------- #
-with TAB3:
+def render_guide():
     st.subheader("🥗 식단 가이드 (당뇨 전단계 & 갱년기 친화)")
     st.markdown(
         """
@@ -1107,36 +1620,46 @@ with TAB3:
 
     st.info("혈당·체중 반응은 개인차가 큽니다. 이상 증상 시 전문의와 상의하세요.")
 
+# 탭 구성 - st.tabs 는 보이지 않는 탭까지 매번 모두 계산하므로, 선택한 화면 하나만 실행
+TABS = {"오늘 기록": render_today, "통계": render_stats, "사진 기록": render_gallery, "가이드": render_guide}
+active_tab = st.radio("화면 선택", list(TABS), horizontal=True, label_visibility="collapsed", key="active_tab")
+TABS[active_tab]()
+
 # ----------------------------- 추가: 내보내기/가져오기 ----------------------------- #
-with st.expander("데이터 내보내기/가져오기"):
-    export_btn = st.button("CSV로 내보내기(zip)")
-    if export_btn:
-        meals = load_df("meals")
-        acts = load_df("activities")
-        weights = load_df("weights")
-        from zipfile import ZipFile
-        zip_path = "data/export_predicare.zip"
-        with ZipFile(zip_path, 'w') as zf:
-            meals.to_csv("data/meals.csv", index=False)
-            acts.to_csv("data/activities.csv", index=False)
-            weights.to_csv("data/weights.csv", index=False)
-            zf.write("data/meals.csv", arcname="meals.csv")
-            zf.write("data/activities.csv", arcname="activities.csv")
-            zf.write("data/weights.csv", arcname="weights.csv")
-        with open(zip_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode()
-        href = f'<a download="predicare_export.zip" href="data:file/zip;base64,{b64}">ZIP 다운로드</a>'
-        st.markdown(href, unsafe_allow_html=True)
+@fragment
+def render_data_tools():
+    export_formats = {"CSV": "csv", "Parquet (분석용, 날짜 타입 유지)": "parquet"} if pq is not None else {"CSV": "csv"}
+    export_fmt = st.radio("내보내기 형식", list(export_formats.keys()), horizontal=True)
+    if st.button("내보내기(zip)"):
+        # 임시 파일의 ZIP 을 스트림릿이 한 번 읽어 미디어 저장소로 넘김 (base64/HTML 링크 없음)
+        with export_zip(export_formats[export_fmt]) as fh:
+            st.download_button("ZIP 다운로드", data=fh, file_name="predicare_export.zip", mime="application/zip")
 
     st.markdown("**주의**: 브라우저/실행 환경에 따라 파일 저장 경로가 달라질 수 있습니다.")
 
+    import_file = st.file_uploader("내보낸 ZIP 가져오기 (meals / activities / weights 의 .csv 또는 .parquet)", type=["zip"], help="이미 있는 기록(같은 일시·항목)은 건너뜁니다.")
+    if import_file is not None and st.button("ZIP 가져오기"):
+        imported = import_export_zip(import_file)
+        if imported:
+            st.success("가져오기 완료 → " + ", ".join(f"{name} {n}건" for name, n in imported.items()))
+        else:
+            st.warning("ZIP 안에 meals / activities / weights 파일(.csv 또는 .parquet)이 없습니다.")
+
+    if st.button("영양 카탈로그 기준으로 과거 식단 재계산"):
+        updated = recompute_meal_nutrition()
+        st.success(f"식단 {updated}건의 칼로리/탄수화물을 다시 계산했습니다.")
+
+with st.expander("데이터 내보내기/가져오기"):
+    render_data_tools()
+
 # ----------------------------- requirements 안내 ----------------------------- #
 with st.expander("requirements.txt 예시"):
     st.code(
         """
-        streamlit
+        streamlit>=1.37
         altair
         pandas
         numpy
         pillow
+        pyarrow
         """.strip(), language="text")